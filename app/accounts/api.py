@@ -6,6 +6,7 @@ from django.contrib.auth import authenticate, get_user_model, login, logout
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.tokens import default_token_generator
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
 from django.middleware.csrf import get_token
 from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
@@ -14,6 +15,7 @@ from ninja import Router
 from ninja.errors import HttpError
 
 from notifications.forms import TemplatedPasswordResetForm
+from recipe_platform import slug_allocator
 
 from .models import UserConsents
 from .schemas import (
@@ -97,13 +99,9 @@ def _generate_username_from_email(email: str) -> str:
     base = (email.split("@", 1)[0] if "@" in email else email).strip().lower()
     base = re.sub(r"[^a-z0-9_\.\-]+", "-", base).strip("-._")
     base = base or "user"
-
-    username = base
-    counter = 1
-    while User.objects.filter(username__iexact=username).exists():
-        counter += 1
-        username = f"{base}-{counter}"
-    return username
+    return slug_allocator.allocate(
+        User, base, field="username", first_suffix=2, case_insensitive=True
+    )
 
 
 @router.get("/session", response=SessionSchema)
@@ -200,7 +198,8 @@ def register_user(request, payload: RegisterRequestSchema):
         raise HttpError(400, "Naudotojas su tokiu el. paštu jau egzistuoja")
 
     username = (payload.username or "").strip()
-    if not username:
+    generated_username = not username
+    if generated_username:
         username = _generate_username_from_email(email)
     elif User.objects.filter(username__iexact=username).exists():
         raise HttpError(400, "Toks vartotojo vardas jau užimtas")
@@ -212,7 +211,20 @@ def register_user(request, payload: RegisterRequestSchema):
         message = "; ".join(exc.messages) if exc.messages else "Neteisingas slaptažodis"
         raise HttpError(422, message)
 
-    user = User.objects.create_user(username=username, email=email, password=payload.password)
+    # Lygiagreti registracija gali spėti užimti tą patį vardą – sugeneruotą perskirstom.
+    for attempt in range(3):
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    username=username, email=email, password=payload.password
+                )
+            break
+        except IntegrityError as exc:
+            if not generated_username:
+                raise HttpError(400, "Toks vartotojo vardas jau užimtas") from exc
+            if attempt == 2:
+                raise
+            username = _generate_username_from_email(email)
 
     consents, _ = UserConsents.objects.get_or_create(user=user)
     consents.set_consent("newsletter_consent", payload.newsletter_consent)
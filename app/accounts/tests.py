@@ -57,3 +57,14 @@ def test_password_reset_confirm_rejects_invalid_token():
         HTTP_X_CSRFTOKEN=csrf_cookie.value,
     )
     assert resp.status_code == 400
+
+
+@pytest.mark.django_db
+def test_generated_username_picks_next_free_suffix_case_insensitively():
+    from accounts.api import _generate_username_from_email
+
+    User = get_user_model()
+    for username in ("Jonas", "jonas-2", "jonas-3", "jonasx"):
+        User.objects.create_user(username=username, email=f"{username}@example.com")
+
+    assert _generate_username_from_email("jonas@example.com") == "jonas-4"
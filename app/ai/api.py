@@ -2,6 +2,7 @@ from django.views.decorators.csrf import csrf_protect
 from ninja import Router
 from ninja.errors import HttpError
 
+from .events import job_event_response
 from .models import RecipeGenerationJob, RecipeGenerationJobStatus
 from .schemas import (
     RecipeImageJobCreateRequestSchema,
@@ -12,6 +13,7 @@ from .schemas import (
     RecipeGenerationRequestSchema,
 )
 
+from recipe_platform import jobqueue, pubsub, ratelimit
 from recipes.models import Recipe, RecipeImageJob, RecipeImageJobStatus
 
 router = Router(tags=["AI"])
@@ -26,25 +28,22 @@ def create_recipe_job(request, payload: RecipeGenerationRequestSchema):
     # Normalizuojam "selected_ingredient_ids" kaip sąjungą (patogu audit/analytics)
     selected_ids = sorted(set(payload.have_ingredient_ids + payload.can_buy_ingredient_ids))
 
+    # 429 + Retry-After (token bucket + dienos kvota, be DB užklausų); tikrinama tik prieš
+    # kuriant job'ą – 400/404 atsakymai vartotojo ribos nenaudoja.
+    ratelimit.check("generation", request.user.id)
+
     job = RecipeGenerationJob.objects.create(
         user=request.user,
         status=RecipeGenerationJobStatus.QUEUED,
         inputs=payload.dict(),
         selected_ingredient_ids=selected_ids,
     )
+    jobqueue.notify("generation")
 
     return RecipeGenerationJobCreatedSchema(id=job.id, status=job.status)
 
 
-@router.get("/recipe-jobs/{job_id}", response=RecipeGenerationJobStatusSchema)
-def get_recipe_job(request, job_id: int):
-    if not request.user.is_authenticated:
-        raise HttpError(401, "Reikia prisijungti")
-
-    job = RecipeGenerationJob.objects.filter(id=job_id, user=request.user).select_related("result_recipe").first()
-    if not job:
-        raise HttpError(404, "Job nerastas")
-
+def _recipe_job_status(job: RecipeGenerationJob) -> RecipeGenerationJobStatusSchema:
     result_recipe_id = job.result_recipe_id
     result_recipe_slug = job.result_recipe.slug if job.result_recipe_id else None
 
@@ -60,6 +59,47 @@ def get_recipe_job(request, job_id: int):
     )
 
 
+@router.get("/recipe-jobs/{job_id}", response=RecipeGenerationJobStatusSchema)
+def get_recipe_job(request, job_id: int):
+    if not request.user.is_authenticated:
+        raise HttpError(401, "Reikia prisijungti")
+
+    job = (
+        RecipeGenerationJob.objects.filter(id=job_id, user=request.user)
+        .select_related("result_recipe")
+        .first()
+    )
+    if not job:
+        raise HttpError(404, "Job nerastas")
+
+    return _recipe_job_status(job)
+
+
+@router.get("/recipe-jobs/{job_id}/events")
+async def recipe_job_events(request, job_id: int):
+    """SSE: būsenos pokyčiai ir daliniai generavimo rezultatai (žr. `ai.events`)."""
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        raise HttpError(401, "Reikia prisijungti")
+
+    async def load_state():
+        job = await (
+            RecipeGenerationJob.objects.filter(id=job_id, user=user)
+            .select_related("result_recipe")
+            .afirst()
+        )
+        return _recipe_job_status(job).model_dump(mode="json") if job else None
+
+    # Prenumerata prieš skaitant būseną – tarp jų įvykęs pokytis nepraleidžiamas.
+    subscription = pubsub.subscribe(pubsub.topic("generation", job_id))
+    state = await load_state()
+    if state is None:
+        subscription.close()
+        raise HttpError(404, "Job nerastas")
+    return job_event_response(subscription, state, load_state)
+
+
 @router.post("/recipe-image-jobs", response=RecipeImageJobCreatedSchema)
 @csrf_protect
 def create_recipe_image_job(request, payload: RecipeImageJobCreateRequestSchema):
@@ -95,24 +135,18 @@ def create_recipe_image_job(request, payload: RecipeImageJobCreateRequestSchema)
     if existing:
         return RecipeImageJobCreatedSchema(id=existing.id, status=existing.status)
 
+    ratelimit.check("image", request.user.id)
     job = RecipeImageJob.objects.create(
         recipe_id=recipe.id,
         requested_by=request.user,
         status=RecipeImageJobStatus.QUEUED,
     )
+    jobqueue.notify("image")
 
     return RecipeImageJobCreatedSchema(id=job.id, status=job.status)
 
 
-@router.get("/recipe-image-jobs/{job_id}", response=RecipeImageJobStatusSchema)
-def get_recipe_image_job(request, job_id: int):
-    if not request.user.is_authenticated:
-        raise HttpError(401, "Reikia prisijungti")
-
-    job = RecipeImageJob.objects.filter(id=job_id).select_related("recipe").first()
-    if not job:
-        raise HttpError(404, "Job nerastas")
-
+def _image_job_status(job: RecipeImageJob) -> RecipeImageJobStatusSchema:
     return RecipeImageJobStatusSchema(
         id=job.id,
         status=job.status,
@@ -123,3 +157,35 @@ def get_recipe_image_job(request, job_id: int):
         finished_at=job.finished_at,
         error=job.error.strip() or None,
     )
+
+
+@router.get("/recipe-image-jobs/{job_id}", response=RecipeImageJobStatusSchema)
+def get_recipe_image_job(request, job_id: int):
+    if not request.user.is_authenticated:
+        raise HttpError(401, "Reikia prisijungti")
+
+    job = RecipeImageJob.objects.filter(id=job_id).select_related("recipe").first()
+    if not job:
+        raise HttpError(404, "Job nerastas")
+
+    return _image_job_status(job)
+
+
+@router.get("/recipe-image-jobs/{job_id}/events")
+async def recipe_image_job_events(request, job_id: int):
+    """SSE: paveikslo job'o būsenos pokyčiai."""
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        raise HttpError(401, "Reikia prisijungti")
+
+    async def load_state():
+        job = await RecipeImageJob.objects.filter(id=job_id).select_related("recipe").afirst()
+        return _image_job_status(job).model_dump(mode="json") if job else None
+
+    subscription = pubsub.subscribe(pubsub.topic("image", job_id))
+    state = await load_state()
+    if state is None:
+        subscription.close()
+        raise HttpError(404, "Job nerastas")
+    return job_event_response(subscription, state, load_state)
@@ -0,0 +1,75 @@
+"""Server-Sent Events: job'o progreso srautas vietoje GET poll'inimo.
+
+Įvykiai:
+- `status` – visa job'o būsena (tokia pati kaip `GET` endpointo atsakymas); siunčiama
+  prisijungus ir po kiekvieno būsenos pokyčio. Galutinėje būsenoje srautas baigiasi.
+- `partial` – (tik generavimui) `{"title": ..., "steps": [...]}`; `steps` – tik nauji,
+  ką tik sugeneruoti žingsniai (klientas juos prideda prie jau gautų).
+
+Būsena skaitoma iš DB tik pradžioje, gavus `status` įvykį iš pub/sub ir kas
+`JOB_EVENTS_KEEPALIVE_SECONDS` (atsarginis patikrinimas, jei įvykis praleistas).
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from recipe_platform.pubsub import Subscription
+
+TERMINAL_STATUSES = {"succeeded", "failed", "dead"}
+# Kliento (EventSource) persijungimo pauzė, ms.
+RECONNECT_MS = 3000
+
+
+def format_event(event: str, data: dict[str, Any], *, retry: int | None = None) -> str:
+    lines = [f"retry: {retry}"] if retry is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, ensure_ascii=False)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def _stream(
+    subscription: Subscription,
+    state: dict[str, Any],
+    load_state: Callable[[], Awaitable[dict[str, Any] | None]],
+) -> AsyncIterator[str]:
+    keepalive = getattr(settings, "JOB_EVENTS_KEEPALIVE_SECONDS", 15)
+    deadline = time.monotonic() + getattr(settings, "JOB_EVENTS_MAX_SECONDS", 600)
+    try:
+        yield format_event("status", state, retry=RECONNECT_MS)
+        while state["status"] not in TERMINAL_STATUSES and time.monotonic() < deadline:
+            event = await subscription.get(keepalive)
+            if event is not None and event.get("type") == "partial":
+                yield format_event("partial", {k: v for k, v in event.items() if k != "type"})
+                continue
+            fresh = await load_state()
+            if fresh is None:
+                break
+            if fresh != state:
+                state = fresh
+                yield format_event("status", state)
+            elif event is None:
+                # Komentaras – proxy neuždaro „tylaus“ ryšio.
+                yield ": keepalive\n\n"
+    finally:
+        subscription.close()
+
+
+def job_event_response(
+    subscription: Subscription,
+    state: dict[str, Any],
+    load_state: Callable[[], Awaitable[dict[str, Any] | None]],
+) -> StreamingHttpResponse:
+    """SSE atsakymas; `subscription` sukuriamas prieš pirmą būsenos nuskaitymą."""
+
+    response = StreamingHttpResponse(
+        _stream(subscription, state, load_state), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # nginx: nebuferizuoti srauto.
+    response["X-Accel-Buffering"] = "no"
+    return response
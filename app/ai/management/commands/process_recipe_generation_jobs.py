@@ -1,14 +1,30 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import operator
+import queue as queue_module
+import threading
+import time
 from decimal import Decimal, InvalidOperation
+from functools import reduce
+from typing import Any, Iterable, Iterator
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from django.utils import timezone
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+from openai import AsyncOpenAI
 
-from ai.models import RecipeGenerationJob, RecipeGenerationJobStatus
-from ai.services import generate_recipe_from_payload
+from ai.models import RecipeGenerationJob
+from ai.services import (
+    GeneratedRecipe,
+    agenerate_recipe,
+    build_inputs_from_payload,
+    build_openai_chat_request,
+)
+from recipe_platform import jobqueue, pubsub, slug_allocator
 from recipes.models import (
     Difficulty,
     Ingredient,
@@ -24,56 +40,170 @@ logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    help = "Apdoroja RecipeGenerationJob: kviečia OpenAI ir sukuria Recipe + Steps (MVP)."
+    help = (
+        "Apdoroja RecipeGenerationJob: lygiagrečiai (async) kviečia OpenAI ir sukuria "
+        "Recipe + Steps."
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument("--limit", type=int, default=5)
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=getattr(settings, "OPENAI_RECIPE_CONCURRENCY", 8),
+            help="Kiek OpenAI užklausų vykdyti lygiagrečiai (async).",
+        )
 
     def handle(self, *args, **options):
         limit: int = options["limit"]
         processed = 0
+        succeeded = 0
+        retried = 0
         failed = 0
 
-        jobs = list(
-            RecipeGenerationJob.objects.filter(status=RecipeGenerationJobStatus.QUEUED)
-            .select_related("user")
-            .order_by("created_at")[:limit]
-        )
+        queue = jobqueue.get_queue("generation")
+        released, dead = jobqueue.reap_expired(queue)
+        if released or dead:
+            self.stdout.write(f"Pasibaigęs lease: grąžinta į eilę={released} dead={dead}")
 
-        for job in jobs:
-            processed += 1
-            try:
-                self._process_one(job)
-            except Exception:
-                failed += 1
-                logger.exception("Nepavyko apdoroti RecipeGenerationJob (id=%s)", job.id)
+        # Claim'as ribojamas eilės concurrency (JOB_QUEUES["generation"]).
+        token, jobs = jobqueue.claim(queue, limit, select_related=("user",))
+        heartbeat = jobqueue.Heartbeat(queue, token)
+
+        try:
+            if jobs and not getattr(settings, "OPENAI_API_KEY", ""):
+                raise RuntimeError("OPENAI_API_KEY nenustatytas")
+            # Request'ai (su ingredientų pavadinimais iš DB) paruošiami prieš async dalį.
+            requests = {
+                job.id: build_openai_chat_request(inputs=build_inputs_from_payload(job.inputs))
+                for job in jobs
+            }
+            by_id = {job.id: job for job in jobs}
+            for job_id, outcome, latency_ms in self._generate(requests, options["concurrency"]):
+                job = by_id[job_id]
+                processed += 1
+                try:
+                    if isinstance(outcome, Exception):
+                        raise outcome
+                    self._persist(queue, token, job, *outcome, latency_ms=latency_ms)
+                    succeeded += 1
+                    logger.info(
+                        "RecipeGenerationJob (id=%s) sukurtas per %sms, tokens=%s",
+                        job.id,
+                        latency_ms,
+                        (outcome[1] or {}).get("total_tokens"),
+                    )
+                except jobqueue.LeaseLostError:
+                    logger.warning("RecipeGenerationJob (id=%s) lease nebegalioja", job.id)
+                except Exception as exc:
+                    logger.error(
+                        "Nepavyko apdoroti RecipeGenerationJob (id=%s, %sms): %s",
+                        job.id,
+                        latency_ms,
+                        exc,
+                        exc_info=exc,
+                    )
+                    retry_ids, _terminal = jobqueue.fail(
+                        queue, jobqueue.leased(queue, token), {job.id: str(exc)}
+                    )
+                    if retry_ids:
+                        retried += 1
+                    else:
+                        failed += 1
+                heartbeat()
+        finally:
+            jobqueue.release(queue, token)
 
         self.stdout.write(
             self.style.SUCCESS(
-                f"Done. processed={processed} failed={failed}"
+                f"Done. processed={processed} succeeded={succeeded} retried={retried} "
+                f"failed={failed}"
             )
         )
 
-    def _process_one(self, job: RecipeGenerationJob) -> None:
-        # Perjungiam į RUNNING kuo anksčiau, kad nedubliuotųsi workeriai.
-        updated = RecipeGenerationJob.objects.filter(
-            id=job.id, status=RecipeGenerationJobStatus.QUEUED
-        ).update(status=RecipeGenerationJobStatus.RUNNING, started_at=timezone.now(), error="")
-        if updated == 0:
+    def _generate(
+        self, requests: dict[int, dict[str, Any]], concurrency: int
+    ) -> Iterator[tuple[int, Any, int]]:
+        """OpenAI užklausos async (iki `concurrency` vienu metu) atskiroje gijoje.
+
+        Rezultatai grąžinami baigimo tvarka kaip (job_id, (recipe, token_usage) arba
+        klaida, latency_ms); DB įrašymas lieka kvietėjo (pagrindinėje) gijoje, todėl
+        event loop'as jo nelaukia. Stream'inami daliniai rezultatai (pavadinimas, nauji
+        žingsniai) publikuojami SSE klientams iš pagrindinės gijos.
+        """
+
+        if not requests:
             return
+        results: queue_module.SimpleQueue = queue_module.SimpleQueue()
 
-        job.refresh_from_db()
+        async def run() -> None:
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+            async with AsyncOpenAI(api_key=settings.OPENAI_API_KEY) as client:
 
-        try:
-            generated, token_usage = generate_recipe_from_payload(payload=job.inputs)
-        except Exception as exc:
-            RecipeGenerationJob.objects.filter(id=job.id).update(
-                status=RecipeGenerationJobStatus.FAILED,
-                finished_at=timezone.now(),
-                error=str(exc),
-            )
-            raise
+                async def one(job_id: int, req: dict[str, Any]) -> None:
+                    def on_partial(preview: dict[str, Any]) -> None:
+                        results.put((job_id, "partial", preview, 0))
+
+                    async with semaphore:
+                        started = time.monotonic()
+                        try:
+                            outcome: Any = await agenerate_recipe(
+                                req, client=client, on_partial=on_partial
+                            )
+                        except Exception as exc:
+                            outcome = exc
+                        latency_ms = int((time.monotonic() - started) * 1000)
+                        results.put((job_id, "done", outcome, latency_ms))
 
+                await asyncio.gather(*(one(job_id, req) for job_id, req in requests.items()))
+
+        def target() -> None:
+            try:
+                asyncio.run(run())
+            except Exception as exc:
+                # Pvz. nepavyko sukurti kliento – visi dar negrąžinti job'ai gauna klaidą.
+                for job_id in requests:
+                    results.put((job_id, "done", exc, 0))
+
+        thread = threading.Thread(target=target, name="recipe-generation", daemon=True)
+        thread.start()
+        seen: set[int] = set()
+        sent_steps: dict[int, int] = {}
+        while len(seen) < len(requests):
+            job_id, kind, outcome, latency_ms = results.get()
+            if job_id in seen:
+                continue
+            if kind == "partial":
+                self._publish_partial(job_id, outcome, sent_steps)
+                continue
+            seen.add(job_id)
+            yield job_id, outcome, latency_ms
+        thread.join()
+
+    def _publish_partial(
+        self, job_id: int, preview: dict[str, Any], sent_steps: dict[int, int]
+    ) -> None:
+        # Siunčiami tik nauji žingsniai – NOTIFY payload lieka mažas.
+        sent = sent_steps.get(job_id, 0)
+        steps = preview.get("steps", [])
+        if sent and len(steps) <= sent:
+            return
+        sent_steps[job_id] = len(steps)
+        pubsub.publish(
+            pubsub.topic("generation", job_id),
+            {"type": "partial", "title": preview.get("title"), "steps": steps[sent:]},
+        )
+
+    def _persist(
+        self,
+        queue: jobqueue.Queue,
+        token: str,
+        job: RecipeGenerationJob,
+        generated: GeneratedRecipe,
+        token_usage: dict[str, Any] | None,
+        *,
+        latency_ms: int,
+    ) -> None:
         full_description = generated.description.strip()
 
         difficulty_value = generated.difficulty
@@ -93,7 +223,9 @@ class Command(BaseCommand):
             )
 
             default_category = self._get_or_create_default_ingredient_category()
-            self._persist_ingredients(recipe=recipe, items=generated.ingredients, default_category=default_category)
+            self._persist_ingredients(
+                recipe=recipe, items=generated.ingredients, default_category=default_category
+            )
 
             steps = sorted(generated.steps, key=lambda s: s.order)
             for step in steps:
@@ -105,12 +237,16 @@ class Command(BaseCommand):
                     duration=int(step.duration) if step.duration is not None else None,
                 )
 
-            RecipeGenerationJob.objects.filter(id=job.id).update(
-                status=RecipeGenerationJobStatus.SUCCEEDED,
-                finished_at=timezone.now(),
+            # Lease nebegalioja -> atšaukiam ir sukurtą receptą (job'ą apdoros kitas worker'is).
+            if not jobqueue.complete(
+                queue,
+                token,
+                job.id,
                 result_recipe=recipe,
                 token_usage=token_usage,
-            )
+                latency_ms=latency_ms,
+            ):
+                raise jobqueue.LeaseLostError(job.id)
 
     def _get_or_create_default_ingredient_category(self) -> IngredientCategory:
         existing = IngredientCategory.objects.order_by("id").first()
@@ -126,23 +262,58 @@ class Command(BaseCommand):
             return MeasurementUnitType.VOLUME
         return MeasurementUnitType.COUNT
 
-    def _get_or_create_unit(self, short_name: str) -> MeasurementUnit:
-        short = (short_name or "").strip()
-        unit = MeasurementUnit.objects.filter(short_name__iexact=short).order_by("id").first()
-        if unit:
-            return unit
-        return MeasurementUnit.objects.create(
-            name=short,
-            short_name=short,
-            unit_type=self._guess_unit_type(short),
-        )
+    def _resolve_units(self, shorts: dict[str, str]) -> dict[str, int]:
+        """`casefold` raktas -> vieneto id (esami viena užklausa, trūkstami – `bulk_create`)."""
+
+        resolved: dict[str, int] = {}
+        for short, unit_id in (
+            MeasurementUnit.objects.filter(_iexact_any("short_name", shorts.values()))
+            .order_by("id")
+            .values_list("short_name", "id")
+        ):
+            resolved.setdefault(_key(short), unit_id)
+        missing = [short for key, short in shorts.items() if key not in resolved]
+        if missing:
+            created = MeasurementUnit.objects.bulk_create(
+                MeasurementUnit(
+                    name=short, short_name=short, unit_type=self._guess_unit_type(short)
+                )
+                for short in missing
+            )
+            resolved.update({_key(unit.short_name): unit.id for unit in created})
+        return resolved
 
-    def _get_or_create_ingredient(self, name: str, *, default_category: IngredientCategory) -> Ingredient:
-        cleaned = (name or "").strip()
-        ingredient = Ingredient.objects.filter(name__iexact=cleaned).order_by("id").first()
-        if ingredient:
-            return ingredient
-        return Ingredient.objects.create(name=cleaned, category=default_category)
+    def _resolve_ingredients(
+        self, names: dict[str, str], *, default_category: IngredientCategory
+    ) -> dict[str, int]:
+        """`casefold` raktas -> ingrediento id (esami viena užklausa, trūkstami – `bulk_create`)."""
+
+        resolved: dict[str, int] = {}
+        for name, ingredient_id in (
+            Ingredient.objects.filter(_iexact_any("name", names.values()))
+            .order_by("id")
+            .values_list("name", "id")
+        ):
+            resolved.setdefault(_key(name), ingredient_id)
+        missing = [name for key, name in names.items() if key not in resolved]
+        if missing:
+            slugs = slug_allocator.allocate_many(
+                Ingredient, [slugify(name) or "item" for name in missing]
+            )
+            try:
+                with transaction.atomic():
+                    created = Ingredient.objects.bulk_create(
+                        Ingredient(name=name, slug=slug, category=default_category)
+                        for name, slug in zip(missing, slugs, strict=True)
+                    )
+            except IntegrityError:
+                # Lygiagretus worker'is užėmė slug'ą – po vieną (`save()` parenka naują).
+                created = [
+                    Ingredient.objects.create(name=name, category=default_category)
+                    for name in missing
+                ]
+            resolved.update({_key(ingredient.name): ingredient.id for ingredient in created})
+        return resolved
 
     def _to_decimal_amount(self, value) -> Decimal:
         try:
@@ -153,10 +324,10 @@ class Command(BaseCommand):
             return Decimal("1.00")
         return amount.quantize(Decimal("0.01"))
 
-    def _persist_ingredients(self, *, recipe: Recipe, items, default_category: IngredientCategory) -> None:
-        # Merge duplicates by (ingredient_id, unit_id, group_id)
-        merged: dict[tuple[int, int, int | None], dict] = {}
-
+    def _persist_ingredients(
+        self, *, recipe: Recipe, items, default_category: IngredientCategory
+    ) -> None:
+        rows = []
         for item in items:
             name = (getattr(item, "name", None) or "").strip()
             if not name:
@@ -164,11 +335,23 @@ class Command(BaseCommand):
             unit_short = (getattr(item, "unit", None) or "vnt").strip() or "vnt"
             note = (getattr(item, "note", None) or "").strip()
             amount = self._to_decimal_amount(getattr(item, "amount", 1))
+            rows.append((name, unit_short, amount, note))
+        if not rows:
+            return
 
-            ingredient = self._get_or_create_ingredient(name, default_category=default_category)
-            unit = self._get_or_create_unit(unit_short)
+        # Ingredientai ir vienetai išsprendžiami keliomis užklausomis visam receptui.
+        names: dict[str, str] = {}
+        shorts: dict[str, str] = {}
+        for name, unit_short, _amount, _note in rows:
+            names.setdefault(_key(name), name)
+            shorts.setdefault(_key(unit_short), unit_short)
+        ingredients = self._resolve_ingredients(names, default_category=default_category)
+        units = self._resolve_units(shorts)
 
-            key = (ingredient.id, unit.id, None)
+        # Merge duplicates by (ingredient_id, unit_id, group_id)
+        merged: dict[tuple[int, int, int | None], dict] = {}
+        for name, unit_short, amount, note in rows:
+            key = (ingredients[_key(name)], units[_key(unit_short)], None)
             if key not in merged:
                 merged[key] = {"amount": amount, "note": note}
             else:
@@ -176,8 +359,8 @@ class Command(BaseCommand):
                 if note and note not in merged[key]["note"]:
                     merged[key]["note"] = (merged[key]["note"] + "; " + note).strip("; ")
 
-        for (ingredient_id, unit_id, group_id), data in merged.items():
-            RecipeIngredient.objects.create(
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
                 recipe=recipe,
                 ingredient_id=ingredient_id,
                 unit_id=unit_id,
@@ -185,3 +368,16 @@ class Command(BaseCommand):
                 amount=data["amount"],
                 note=data["note"],
             )
+            for (ingredient_id, unit_id, group_id), data in merged.items()
+        )
+
+
+def _key(value: str) -> str:
+    # Python casefold(): SQLite LOWER() lietuviškų raidžių (Š, Ž, ...) nekeičia.
+    return value.strip().casefold()
+
+
+def _iexact_any(field: str, values: Iterable[str]) -> Q:
+    """`field` lygus bet kuriai reikšmei (be raidžių dydžio) – viena sąlyga užklausai."""
+
+    return reduce(operator.or_, (Q(**{f"{field}__iexact": value}) for value in values))
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import logging
+import signal
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from recipe_platform import jobqueue, pubsub
+
+logger = logging.getLogger(__name__)
+
+# Eilė -> worker komanda (kiekviena paima paketą pagal savo --limit ir concurrency).
+WORKER_COMMANDS = {
+    "generation": "process_recipe_generation_jobs",
+    "image": "process_recipe_image_jobs",
+    "nutrition": "process_recipe_nutrition_jobs",
+}
+# `nutrition` – tik nurodžius `--queues`: naktinis Batch (kvota `OPENAI_BATCH_TOKEN_QUOTA`)
+# į eilę grąžintus job'us turi pateikti kitą naktį, o ne sinchroninis worker'is.
+DEFAULT_QUEUES = ("generation", "image")
+
+
+class Command(BaseCommand):
+    help = (
+        "Nuolat veikiantis worker'is: kiekviena eilė (generavimas, paveikslai; nutrition – tik "
+        "per --queues) – atskiroje gijoje; pabunda iškart po job'o sukūrimo (Postgres "
+        "LISTEN/NOTIFY) arba poll'ina (SQLite)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queues",
+            type=str,
+            default=",".join(DEFAULT_QUEUES),
+            help="Kurias eiles apdoroti (kableliais), pvz. generation,image,nutrition.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=None,
+            help="Kas kiek sekundžių tikrinti eiles be pažadinimo "
+            "(numatyta: 30 su LISTEN/NOTIFY, 2 – be jo).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Vienas praėjimas per eiles ir išeiti (cron / testams).",
+        )
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options["queues"].split(",") if name.strip()]
+        unknown = sorted(set(names) - set(WORKER_COMMANDS))
+        if unknown:
+            raise CommandError(f"Nežinomos eilės: {', '.join(unknown)}")
+        queues = [jobqueue.get_queue(name) for name in names]
+
+        self.stopping = False
+        if options["once"]:
+            self._drain(queues)
+            return
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        listen = connection.vendor == "postgresql"
+        poll_interval = options["poll_interval"] or (30.0 if listen else 2.0)
+        self.stdout.write(
+            f"Workers: queues={','.join(names)} "
+            f"wakeup={'listen/notify' if listen else 'poll'} poll={poll_interval}s"
+        )
+        # Kiekvienai eilei – savas ciklas: ilgas paveikslų / nutrition paketas nevėlina
+        # generavimo pažadinimų.
+        threads = [
+            threading.Thread(
+                target=self._run_queue,
+                args=(queue, poll_interval),
+                name=f"worker-{queue.name}",
+                daemon=True,
+            )
+            for queue in queues
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # Trumpais join'ais – signalai apdorojami tik pagrindinėje gijoje.
+            while thread.is_alive():
+                thread.join(timeout=1.0)
+        self.stdout.write(self.style.SUCCESS("Workers: sustabdyta"))
+
+    def _run_queue(self, queue: jobqueue.Queue, poll_interval: float) -> None:
+        listener = jobqueue.listener()
+        try:
+            while not self.stopping:
+                close_old_connections()
+                if self._drain([queue]):
+                    continue
+                self._wait(listener, poll_interval, queue.name)
+        finally:
+            listener.close()
+            connection.close()
+
+    def _drain(self, queues: list[jobqueue.Queue]) -> bool:
+        """Vienas praėjimas: paleidžia worker'į eilėms, kuriose yra paruoštų job'ų."""
+
+        worked = False
+        for queue in queues:
+            if self.stopping:
+                break
+            # Be paruoštų job'ų (ar pilnos concurrency) worker'io nekviečiam – nėra tuščių ciklų.
+            if not jobqueue.has_ready(queue):
+                continue
+            try:
+                call_command(WORKER_COMMANDS[queue.name], stdout=self.stdout, stderr=self.stderr)
+            except Exception:
+                # Pvz. nesukonfigūruotas OpenAI – kitos eilės dirba toliau, ši bandoma po poll'o.
+                logger.exception("Worker'is eilei %s nepavyko", queue.name)
+                continue
+            worked = True
+        return worked
+
+    def _wait(self, listener: pubsub.Listener, timeout: float, queue_name: str) -> None:
+        # Trumpais intervalais, kad SIGTERM būtų apdorotas greitai; kitų eilių pažadinimai
+        # praleidžiami.
+        deadline = time.monotonic() + timeout
+        while not self.stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or queue_name in listener.wait(min(remaining, 1.0)):
+                return
+
+    def _stop(self, signum, frame) -> None:
+        # Einamasis worker'io paketas užbaigiamas; neapdoroti job'ai grąžinami į eilę.
+        self.stopping = True
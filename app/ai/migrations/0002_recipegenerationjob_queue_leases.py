@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:06
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai", "0001_initial"),
+        ("recipes", "0019_job_queue_leases"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipegenerationjob",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="recipegenerationjob",
+            name="available_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="recipegenerationjob",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="recipegenerationjob",
+            name="lease_token",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AlterField(
+            model_name="recipegenerationjob",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Eilėje"),
+                    ("running", "Vykdoma"),
+                    ("succeeded", "Pavyko"),
+                    ("failed", "Nepavyko"),
+                    ("dead", "Nepavyko (išnaudoti bandymai)"),
+                ],
+                default="queued",
+                max_length=20,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipegenerationjob",
+            index=models.Index(
+                fields=["status", "available_at"], name="ai_recipege_status_6c8c12_idx"
+            ),
+        ),
+    ]
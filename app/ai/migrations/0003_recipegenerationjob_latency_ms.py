@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai", "0002_recipegenerationjob_queue_leases"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipegenerationjob",
+            name="latency_ms",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
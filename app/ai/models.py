@@ -3,15 +3,18 @@ from __future__ import annotations
 from django.conf import settings
 from django.db import models
 
+from recipe_platform.jobqueue import LeasedJob
+
 
 class RecipeGenerationJobStatus(models.TextChoices):
     QUEUED = "queued", "Eilėje"
     RUNNING = "running", "Vykdoma"
     SUCCEEDED = "succeeded", "Pavyko"
     FAILED = "failed", "Nepavyko"
+    DEAD = "dead", "Nepavyko (išnaudoti bandymai)"
 
 
-class RecipeGenerationJob(models.Model):
+class RecipeGenerationJob(LeasedJob):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -37,6 +40,8 @@ class RecipeGenerationJob(models.Model):
 
     error = models.TextField(blank=True)
     token_usage = models.JSONField(null=True, blank=True)
+    # OpenAI užklausos trukmė (worker'io metrika).
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -45,6 +50,7 @@ class RecipeGenerationJob(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [models.Index(fields=["status", "available_at"])]
 
     def __str__(self) -> str:  # pragma: no cover
         return f"RecipeGenerationJob#{self.pk} ({self.status})"
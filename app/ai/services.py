@@ -2,11 +2,12 @@ from __future__ import annotations
 
 import json
 import re
+import time
 from dataclasses import dataclass
-from typing import Any, Literal
+from typing import Any, Callable, Literal
 
 from django.conf import settings
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from pydantic import BaseModel, Field, field_validator
 
 from recipes.models import Ingredient
@@ -174,6 +175,104 @@ def parse_openai_chat_content_to_recipe(*, content: str) -> GeneratedRecipe:
     return GeneratedRecipe.model_validate(data)
 
 
+def _token_usage(usage) -> dict[str, Any] | None:
+    if usage is None:
+        return None
+    try:
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "total_tokens": getattr(usage, "total_tokens", None),
+        }
+    except Exception:
+        return None
+
+
+def _parse_response(resp) -> tuple[GeneratedRecipe, dict[str, Any] | None]:
+    content = resp.choices[0].message.content
+    if not content:
+        raise RuntimeError("OpenAI grąžino tuščią atsakymą")
+
+    token_usage = _token_usage(getattr(resp, "usage", None))
+    return parse_openai_chat_content_to_recipe(content=content), token_usage
+
+
+_JSON = json.JSONDecoder()
+
+# Stream'o peržiūra perskaitoma iš viso buferio, o event loop'as bendras visiems job'ams,
+# todėl ji perskaičiuojama ne dažniau nei kas tiek naujų simbolių ir sekundžių.
+PARTIAL_PREVIEW_MIN_CHARS = 400
+PARTIAL_PREVIEW_MIN_SECONDS = 0.5
+
+
+def _skip(content: str, i: int, chars: str = " \t\r\n") -> int:
+    while i < len(content) and content[i] in chars:
+        i += 1
+    return i
+
+
+def _top_level_offsets(content: str) -> dict[str, int]:
+    """Top-level JSON objekto raktų reikšmių pradžios (veikia ir su nebaigtu JSON)."""
+
+    offsets: dict[str, int] = {}
+    depth = 0
+    i = 0
+    while i < len(content):
+        ch = content[i]
+        if ch == '"':
+            try:
+                value, end = _JSON.raw_decode(content, i)
+            except ValueError:
+                break  # eilutė dar nebaigta
+            colon = _skip(content, end)
+            if depth == 1 and content.startswith(":", colon):
+                offsets[value] = _skip(content, colon + 1)
+            i = end
+            continue
+        if ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+        i += 1
+    return offsets
+
+
+def preview_partial_recipe(content: str) -> dict[str, Any]:
+    """Dalinis receptas iš dar generuojamo JSON: `title` ir jau užbaigti `steps`."""
+
+    offsets = _top_level_offsets(content)
+    preview: dict[str, Any] = {}
+    if "title" in offsets:
+        try:
+            title, _end = _JSON.raw_decode(content, offsets["title"])
+        except ValueError:
+            title = None
+        if isinstance(title, str) and title.strip():
+            preview["title"] = _normalize_text(title)
+
+    start = offsets.get("steps")
+    if start is not None and content.startswith("[", start):
+        steps = []
+        i = start + 1
+        while True:
+            i = _skip(content, i, " \t\r\n,")
+            try:
+                step, i = _JSON.raw_decode(content, i)
+            except ValueError:
+                break  # žingsnis dar nebaigtas (arba masyvas baigėsi)
+            if isinstance(step, dict) and step.get("description"):
+                steps.append(
+                    {
+                        "order": step.get("order"),
+                        "title": step.get("title") or None,
+                        "description": step["description"],
+                    }
+                )
+        if steps:
+            preview["steps"] = steps
+    return preview
+
+
 def generate_recipe_from_payload(*, payload: dict[str, Any]) -> tuple[GeneratedRecipe, dict[str, Any] | None]:
     if not getattr(settings, "OPENAI_API_KEY", ""):
         raise RuntimeError("OPENAI_API_KEY nenustatytas")
@@ -185,21 +284,61 @@ def generate_recipe_from_payload(*, payload: dict[str, Any]) -> tuple[GeneratedR
         **req,
         timeout=getattr(settings, "OPENAI_REQUEST_TIMEOUT_SECONDS", 60),
     )
+    return _parse_response(resp)
 
-    content = resp.choices[0].message.content
-    if not content:
-        raise RuntimeError("OpenAI grąžino tuščią atsakymą")
 
-    token_usage = None
-    usage = getattr(resp, "usage", None)
-    if usage is not None:
-        try:
-            token_usage = {
-                "prompt_tokens": getattr(usage, "prompt_tokens", None),
-                "completion_tokens": getattr(usage, "completion_tokens", None),
-                "total_tokens": getattr(usage, "total_tokens", None),
-            }
-        except Exception:
-            token_usage = None
+async def agenerate_recipe(
+    req: dict[str, Any],
+    *,
+    client: AsyncOpenAI,
+    on_partial: Callable[[dict[str, Any]], None] | None = None,
+) -> tuple[GeneratedRecipe, dict[str, Any] | None]:
+    """Async variantas worker'iui: `req` paruošiamas iš anksto (be DB užklausų).
 
-    return parse_openai_chat_content_to_recipe(content=content), token_usage
+    Su `on_partial` atsakymas stream'inamas ir `on_partial(preview)` kviečiamas, kai
+    `preview_partial_recipe` rezultatas pasikeičia (atsirado pavadinimas / naujas žingsnis).
+    Peržiūra skaičiuojama retinant (`PARTIAL_PREVIEW_MIN_*`) ir dar kartą stream'o pabaigoje.
+    """
+
+    timeout = getattr(settings, "OPENAI_REQUEST_TIMEOUT_SECONDS", 60)
+    if on_partial is None:
+        resp = await client.chat.completions.create(**req, timeout=timeout)
+        return _parse_response(resp)
+
+    stream = await client.chat.completions.create(
+        **req, stream=True, stream_options={"include_usage": True}, timeout=timeout
+    )
+    parts: list[str] = []
+    usage = None
+    preview: dict[str, Any] = {}
+    unparsed = 0
+    parsed_at = time.monotonic()
+
+    def refresh_preview(content: str) -> None:
+        nonlocal preview, unparsed, parsed_at
+        unparsed, parsed_at = 0, time.monotonic()
+        current = preview_partial_recipe(content)
+        if current != preview:
+            preview = current
+            on_partial(preview)
+
+    async for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        parts.append(delta)
+        unparsed += len(delta)
+        if (
+            unparsed >= PARTIAL_PREVIEW_MIN_CHARS
+            and time.monotonic() - parsed_at >= PARTIAL_PREVIEW_MIN_SECONDS
+        ):
+            refresh_preview("".join(parts))
+
+    content = "".join(parts)
+    if not content:
+        raise RuntimeError("OpenAI grąžino tuščią atsakymą")
+    if unparsed:
+        refresh_preview(content)
+    return parse_openai_chat_content_to_recipe(content=content), _token_usage(usage)
@@ -0,0 +1,326 @@
+import asyncio
+from io import StringIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+
+from ai.models import RecipeGenerationJob, RecipeGenerationJobStatus
+from recipes.models import Ingredient, IngredientCategory, MeasurementUnit
+
+
+@pytest.mark.django_db
+def test_run_workers_once_processes_ready_queues_and_retries_failures(monkeypatch, settings):
+    from ai.management.commands import process_recipe_generation_jobs
+
+    async def _failing_openai(req, *, client, on_partial=None):
+        raise RuntimeError("OpenAI timeout")
+
+    settings.OPENAI_API_KEY = "test"
+    monkeypatch.setattr(process_recipe_generation_jobs, "agenerate_recipe", _failing_openai)
+    user = get_user_model().objects.create_user(username="u1", password="Password123!")
+    job = RecipeGenerationJob.objects.create(user=user, inputs={"title": "Šaltibarščiai"})
+
+    out = StringIO()
+    call_command("run_workers", "--once", "--queues=generation,image", stdout=out)
+
+    assert "processed=1 succeeded=0 retried=1 failed=0" in out.getvalue()
+    # Paveikslų eilėje job'ų nėra – jos worker'is nekviečiamas.
+    assert "Image worker" not in out.getvalue()
+    job.refresh_from_db()
+    assert job.status == RecipeGenerationJobStatus.QUEUED
+    assert (job.attempts, job.error) == (1, "OpenAI timeout")
+
+    # Atidėtas job'as dar neparuoštas – antras praėjimas nieko nedaro.
+    out = StringIO()
+    call_command("run_workers", "--once", "--queues=generation", stdout=out)
+    assert out.getvalue() == ""
+
+
+@pytest.mark.django_db
+def test_run_workers_runs_each_default_queue_in_its_own_loop(monkeypatch):
+    import os
+    import signal
+    import threading
+
+    from ai.management.commands import run_workers
+
+    calls = []
+    lock = threading.Lock()
+
+    def _fake_call_command(name, **kwargs):
+        with lock:
+            calls.append((name, threading.current_thread().name))
+            if {"process_recipe_generation_jobs", "process_recipe_image_jobs"} <= {
+                called for called, _thread in calls
+            }:
+                os.kill(os.getpid(), signal.SIGTERM)
+
+    monkeypatch.setattr(run_workers.jobqueue, "has_ready", lambda queue: True)
+    monkeypatch.setattr(run_workers, "call_command", _fake_call_command)
+    previous = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+    try:
+        call_command("run_workers", "--poll-interval=0.05", stdout=StringIO())
+    finally:
+        signal.signal(signal.SIGTERM, previous[0])
+        signal.signal(signal.SIGINT, previous[1])
+
+    # Nutrition numatytai neįtraukta; kiekviena eilė – savo gijoje.
+    assert dict(calls) == {
+        "process_recipe_generation_jobs": "worker-generation",
+        "process_recipe_image_jobs": "worker-image",
+    }
+
+
+@pytest.mark.django_db
+def test_generation_worker_fans_out_async_and_records_latency(monkeypatch, settings):
+    from ai.management.commands import process_recipe_generation_jobs
+    from ai.services import GeneratedRecipe
+
+    in_flight = 0
+    peak = 0
+
+    async def _fake_openai(req, *, client, on_partial=None):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        recipe = GeneratedRecipe.model_validate(
+            {
+                "title": "Kibinai",
+                "description": "Traškūs kibinai.",
+                "ingredients": [
+                    {"name": "Miltai", "amount": 500, "unit": "g"},
+                    {"name": "MILTAI", "amount": 100, "unit": "G"},
+                    {"name": "Sviestas", "amount": 200, "unit": "g"},
+                ],
+                "steps": [{"order": 1, "description": "Kepti."}],
+                "preparation_time": 30,
+                "cooking_time": 40,
+                "servings": 4,
+                "difficulty": "medium",
+            }
+        )
+        return recipe, {"prompt_tokens": 100, "completion_tokens": 200, "total_tokens": 300}
+
+    settings.OPENAI_API_KEY = "test"
+    monkeypatch.setattr(process_recipe_generation_jobs, "agenerate_recipe", _fake_openai)
+    user = get_user_model().objects.create_user(username="u2", password="Password123!")
+    jobs = [RecipeGenerationJob.objects.create(user=user, inputs={}) for _ in range(5)]
+    category = IngredientCategory.objects.create(name="Kita")
+    existing = Ingredient.objects.create(name="miltai", category=category)
+
+    out = StringIO()
+    call_command("process_recipe_generation_jobs", "--concurrency=3", stdout=out)
+
+    assert "processed=5 succeeded=5" in out.getvalue()
+    assert peak == 3
+    for job in jobs:
+        job.refresh_from_db()
+        assert job.status == RecipeGenerationJobStatus.SUCCEEDED
+        rows = {r.ingredient_id: r.amount for r in job.result_recipe.recipe_ingredients.all()}
+        assert len(rows) == 2 and rows[existing.id] == 600
+        assert job.token_usage["total_tokens"] == 300 and job.latency_ms >= 50
+    # Pavadinimai sutapatinami be raidžių dydžio – dublikatų nesukuriama.
+    assert Ingredient.objects.count() == 2
+    assert MeasurementUnit.objects.count() == 1
+
+
+def test_streamed_generation_throttles_partial_previews(monkeypatch):
+    import json
+    from types import SimpleNamespace
+
+    from ai import services
+
+    steps = [{"order": i, "description": f"Žingsnis {i}."} for i in range(1, 41)]
+    content = json.dumps(
+        {
+            "title": "Kibinai",
+            "description": "Traškūs kibinai.",
+            "ingredients": [{"name": "Miltai", "amount": 500, "unit": "g"}],
+            "steps": steps,
+            "preparation_time": 30,
+            "cooking_time": 40,
+            "servings": 4,
+            "difficulty": "medium",
+        },
+        ensure_ascii=False,
+    )
+
+    async def _stream():
+        for i in range(0, len(content), 4):
+            delta = SimpleNamespace(content=content[i : i + 4])
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta)])
+
+    class _Completions:
+        async def create(self, **kwargs):
+            return _stream()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=_Completions()))
+    parses = []
+    preview_partial_recipe = services.preview_partial_recipe
+
+    def _counting_preview(buffer):
+        parses.append(len(buffer))
+        return preview_partial_recipe(buffer)
+
+    monkeypatch.setattr(services, "preview_partial_recipe", _counting_preview)
+    monkeypatch.setattr(services, "PARTIAL_PREVIEW_MIN_SECONDS", 0)
+    previews = []
+
+    recipe, _usage = asyncio.run(
+        services.agenerate_recipe({}, client=client, on_partial=previews.append)
+    )
+
+    assert len(recipe.steps) == 40
+    # Ne kiekvienam chunk'ui (visas buferis kaskart), o kas PARTIAL_PREVIEW_MIN_CHARS + pabaigoje.
+    assert len(parses) <= len(content) // services.PARTIAL_PREVIEW_MIN_CHARS + 1
+    assert parses[-1] == len(content)
+    assert previews[-1]["title"] == "Kibinai" and len(previews[-1]["steps"]) == 40
+
+
+@pytest.mark.django_db
+def test_recipe_job_events_stream_status_transitions_and_partial_output(
+    django_capture_on_commit_callbacks,
+):
+    from asgiref.sync import async_to_sync, sync_to_async
+    from django.test import AsyncClient
+
+    from ai.services import preview_partial_recipe
+    from recipe_platform import jobqueue, pubsub
+
+    user = get_user_model().objects.create_user(username="u3", password="Password123!")
+    job = RecipeGenerationJob.objects.create(user=user, inputs={})
+    client = AsyncClient()
+    client.force_login(user)
+    queue = jobqueue.get_queue("generation")
+
+    def _claim():
+        with django_capture_on_commit_callbacks(execute=True):
+            return jobqueue.claim(queue, 1)[0]
+
+    def _stream_and_complete(token):
+        with django_capture_on_commit_callbacks(execute=True):
+            content = '{"title": "Kibinai", "steps": [{"order": 1, "description": "Kepti."}, {"or'
+            pubsub.publish(
+                pubsub.topic("generation", job.id),
+                {"type": "partial", **preview_partial_recipe(content)},
+            )
+            jobqueue.complete(queue, token, job.id)
+
+    async def scenario() -> list[str]:
+        response = await client.get(f"/api/ai/recipe-jobs/{job.id}/events")
+        assert response["Content-Type"] == "text/event-stream"
+        chunks = aiter(response.streaming_content)
+        events = [await anext(chunks)]
+        token = await sync_to_async(_claim)()
+        events.append(await anext(chunks))
+        await sync_to_async(_stream_and_complete)(token)
+        events += [chunk async for chunk in chunks]
+        return [chunk.decode() if isinstance(chunk, bytes) else chunk for chunk in events]
+
+    events = async_to_sync(scenario)()
+
+    assert events[0].startswith("retry: 3000\nevent: status\n")
+    assert '"status": "queued"' in events[0]
+    assert '"status": "running"' in events[1]
+    assert events[2] == (
+        "event: partial\n"
+        'data: {"title": "Kibinai", "steps": '
+        '[{"order": 1, "title": null, "description": "Kepti."}]}'
+        "\n\n"
+    )
+    # Galutinė būsena – srautas baigiasi.
+    assert len(events) == 4 and '"status": "succeeded"' in events[3]
+    assert not pubsub._subscribers
+
+
+@pytest.mark.django_db
+def test_create_recipe_job_is_rate_limited_per_user(
+    monkeypatch, settings, django_assert_num_queries
+):
+    from datetime import timedelta
+
+    from django.test import Client
+    from django.utils import timezone
+
+    from recipe_platform import ratelimit
+
+    settings.AI_RATE_LIMITS = {"generation": {"burst": 2, "per_minute": 1, "per_day": 3}}
+    ratelimit.local_store.clear()
+    user = get_user_model().objects.create_user(username="u4", password="Password123!")
+    client = Client()
+    client.force_login(user)
+    payload = {"dish_type": "sriuba", "prep_speed": "greitas"}
+
+    def post():
+        return client.post("/api/ai/recipe-jobs", payload, content_type="application/json")
+
+    assert [post().status_code for _ in range(2)] == [200, 200]
+    # Ribojama užklausa – tik sesija ir vartotojas, jokių papildomų DB užklausų.
+    with django_assert_num_queries(2):
+        response = post()
+    assert response.status_code == 429
+    assert response["Retry-After"] == "60"
+
+    # Po minutės bucket'as atsipildo vienu token'u, bet dienos kvota (3) jau išnaudota.
+    later = timezone.now() + timedelta(seconds=60)
+    monkeypatch.setattr(ratelimit.timezone, "now", lambda: later)
+    assert post().status_code == 200
+    response = post()
+    assert response.status_code == 429 and response.json() == {"detail": "Išnaudota dienos kvota"}
+    assert 0 < int(response["Retry-After"]) <= 24 * 3600
+    assert RecipeGenerationJob.objects.filter(user=user).count() == 3
+
+
+@pytest.mark.django_db
+def test_image_job_rate_limit_counts_only_accepted_requests(settings):
+    from django.core.cache import cache
+    from django.test import Client
+
+    from recipe_platform import ratelimit
+    from recipes.models import Recipe
+
+    settings.AI_RATE_LIMITS = {"image": {"burst": 1, "per_minute": 1, "per_day": 0}}
+    ratelimit.local_store.clear()
+    user = get_user_model().objects.create_user(username="u5", password="Password123!")
+    client = Client()
+    client.force_login(user)
+    recipe = Recipe.objects.create(
+        title="Kibinai", preparation_time=10, cooking_time=20, difficulty="easy", is_generated=True
+    )
+
+    def post(recipe_id):
+        payload = {"recipe_id": recipe_id}
+        return client.post("/api/ai/recipe-image-jobs", payload, content_type="application/json")
+
+    # 404 ribos nenaudoja – vienintelis token'as lieka tikram job'ui.
+    assert [post(recipe.id + 1).status_code for _ in range(3)] == [404, 404, 404]
+    assert post(recipe.id).status_code == 200
+    # Esamas aktyvus job'as grąžinamas be naujo token'o.
+    assert post(recipe.id).status_code == 200
+
+    # per_minute=0 – bucket'as be papildymo išjungtas, lieka tik dienos kvota.
+    settings.AI_RATE_LIMITS = {"image": {"burst": 1, "per_minute": 0, "per_day": 2}}
+    ratelimit.local_store.clear()
+    ratelimit.check("image", user.id)
+    ratelimit.check("image", user.id)
+    with pytest.raises(ratelimit.RateLimitedError, match="dienos kvota"):
+        ratelimit.check("image", user.id)
+
+    # Bendras cache: lygiagretus srautas ribos neapeina (atomiškas `cache.incr`).
+    settings.AI_RATE_LIMITS = {"image": {"burst": 2, "per_minute": 1, "per_day": 0}}
+    settings.AI_RATE_LIMIT_SHARED = True
+    try:
+        results = []
+        for _ in range(5):
+            try:
+                ratelimit.check("image", user.id)
+                results.append(0)
+            except ratelimit.RateLimitedError as exc:
+                results.append(exc.retry_after)
+        assert results[:2] == [0, 0]
+        assert all(0 < retry_after <= 120 for retry_after in results[2:])
+    finally:
+        cache.clear()
@@ -7,6 +7,7 @@ from ninja import NinjaAPI
 from ai.api import router as ai_router
 from accounts.api import router as accounts_router
 from recipes.api import router as recipes_router
+from recipe_platform.ratelimit import RateLimitedError
 from sitecontent.api import router as sitecontent_router
 
 docs_enabled = getattr(settings, "NINJA_ENABLE_DOCS", settings.DEBUG)
@@ -29,3 +30,10 @@ api.add_router("/sitecontent", sitecontent_router)
 api.add_router("/recipes", recipes_router)
 api.add_router("/ai", ai_router)
 api.add_router("/auth", accounts_router)
+
+
+@api.exception_handler(RateLimitedError)
+def rate_limited(request, exc: RateLimitedError):
+    response = api.create_response(request, {"detail": str(exc)}, status=429)
+    response["Retry-After"] = str(exc.retry_after)
+    return response
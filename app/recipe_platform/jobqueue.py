@@ -0,0 +1,337 @@
+"""Bendra DB eilė asinchroniniams job'ams (nutrition, paveikslai, receptų generavimas).
+
+Job'o modelis paveldi `LeasedJob` ir turi `status` lauką su reikšmėmis `queued`,
+`running`, `succeeded`, `failed`, `dead` (+ `created_at`, `updated_at`, `started_at`,
+`finished_at`, `error`).
+
+- Claim: iki `limit` job'ų paimama su `SKIP LOCKED`, o UPDATE turi `status=queued`
+  sąlygą, todėl job'ą gauna tik vienas worker'is. Job'ai pažymimi lease token'u ir
+  `lease_expires_at`; worker'is ilgiems darbams lease pratęsia (`heartbeat`).
+- Lease galiojimas: nukritusio worker'io job'ai po `lease_expires_at` grąžinami į eilę
+  (`reap_expired`), o viršiję bandymų skaičių tampa `dead`.
+- Klaidos: `fail` grąžina job'ą į eilę su eksponentiniu atidėjimu (`available_at`);
+  išnaudojus `max_attempts` – `dead` (dead-letter). Neatkartojamos klaidos – `failed`.
+- Concurrency: vienu metu `running` (su galiojančiu lease) job'ų skaičius ribojamas
+  eilės `concurrency` (0 – neribota). Riba „minkšta“ – lygiagretūs claim'ai ją gali
+  trumpam viršyti.
+
+Visi rezultato įrašymai daromi per `leased()` queryset'ą (sąlyga `status` + lease
+token), todėl pasibaigus lease ir job'ą perėmus kitam worker'iui senas rezultatas
+nebeįrašomas.
+
+Pažadinimas: sukūrus job'ą `notify(queue_name)` Postgres'e siunčia `NOTIFY`, o ilgai
+veikiantis worker'is (`run_workers`) laukia per `listener()` (`LISTEN`). Kitose DB
+(SQLite) `notify` nieko nedaro, o listener'is tiesiog miega iki kito poll'o.
+
+Progresas: eilėms su `events=True` kiekvienas būsenos pokytis publikuojamas per
+`recipe_platform.pubsub` (topic `<eilė>:<job_id>`, įvykis `{"type": "status", ...}`) –
+juos klientams perduoda SSE endpointai.
+"""
+
+from __future__ import annotations
+
+import time
+import uuid
+from dataclasses import dataclass, replace
+from datetime import timedelta
+from typing import Any, Iterable
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from recipe_platform import pubsub
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+DEAD = "dead"
+
+LEASE_EXPIRED_ERROR = "lease_expired: worker'is neatsiliepė"
+NOTIFY_CHANNEL = "jobqueue"
+
+
+class LeaseLostError(Exception):
+    """Job'o lease nebegalioja (perimtas kito worker'io ar grąžintas į eilę)."""
+
+
+class LeasedJob(models.Model):
+    """Eilės laukai job'o modeliui (bandymai, atidėjimas, lease)."""
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    lease_token = models.CharField(max_length=64, blank=True, default="")
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+
+@dataclass(frozen=True)
+class Queue:
+    name: str
+    model_label: str
+    concurrency: int = 0
+    lease: timedelta = timedelta(minutes=5)
+    max_attempts: int = 3
+    backoff: timedelta = timedelta(seconds=30)
+    max_backoff: timedelta = timedelta(hours=1)
+    # Publikuoti būsenų pokyčius per pub/sub (SSE progresui).
+    events: bool = False
+
+    @property
+    def model(self) -> type[models.Model]:
+        return apps.get_model(self.model_label)
+
+
+QUEUES: dict[str, Queue] = {
+    "generation": Queue("generation", "ai.RecipeGenerationJob", concurrency=16, events=True),
+    "image": Queue(
+        "image", "recipes.RecipeImageJob", concurrency=2, lease=timedelta(minutes=10), events=True
+    ),
+    "nutrition": Queue("nutrition", "recipes.RecipeNutritionJob", max_attempts=5),
+}
+
+
+def get_queue(name: str) -> Queue:
+    """Eilė su `settings.JOB_QUEUES[name]` perrašymais (pvz. `concurrency`, `lease_seconds`)."""
+
+    overrides = dict(getattr(settings, "JOB_QUEUES", {}).get(name, {}))
+    for key in ("lease", "backoff", "max_backoff"):
+        if f"{key}_seconds" in overrides:
+            overrides[key] = timedelta(seconds=overrides.pop(f"{key}_seconds"))
+    return replace(QUEUES[name], **overrides)
+
+
+def new_token() -> str:
+    return uuid.uuid4().hex
+
+
+def backoff_delay(queue: Queue, attempts: int) -> timedelta:
+    return min(queue.backoff * 2 ** max(attempts - 1, 0), queue.max_backoff)
+
+
+def case_by_id(values: dict[int, Any], output_field: models.Field) -> Case:
+    return Case(
+        *(
+            When(id=pk, then=Value(value, output_field=output_field))
+            for pk, value in values.items()
+        ),
+        output_field=output_field,
+    )
+
+
+def publish_status(queue: Queue, job_ids: Iterable[int], status: str) -> None:
+    if not queue.events:
+        return
+    for job_id in job_ids:
+        pubsub.publish(pubsub.topic(queue.name, job_id), {"type": "status", "status": status})
+
+
+def reap_expired(queue: Queue, *, status: str = RUNNING) -> tuple[int, int]:
+    """Pasibaigusio lease job'ai -> atgal į eilę arba `dead`. Grąžina (grąžinta, dead)."""
+
+    now = timezone.now()
+    expired = queue.model.objects.filter(status=status, lease_expires_at__lt=now)
+    released = {"lease_token": "", "lease_expires_at": None, "updated_at": now}
+    exhausted = expired.filter(attempts__gte=queue.max_attempts)
+    with transaction.atomic():
+        if queue.events:
+            # Įvykiai pristatomi po commit'o, todėl galima skelbti prieš UPDATE.
+            dead_ids = list(exhausted.values_list("id", flat=True))
+            publish_status(queue, dead_ids, DEAD)
+            publish_status(
+                queue, expired.exclude(id__in=dead_ids).values_list("id", flat=True), QUEUED
+            )
+        dead = exhausted.update(status=DEAD, error=LEASE_EXPIRED_ERROR, finished_at=now, **released)
+        requeued = expired.update(
+            status=QUEUED, error=LEASE_EXPIRED_ERROR, available_at=now, **released
+        )
+    return requeued, dead
+
+
+def active_count(queue: Queue) -> int:
+    return queue.model.objects.filter(status=RUNNING, lease_expires_at__gte=timezone.now()).count()
+
+
+def has_ready(queue: Queue) -> bool:
+    """Ar yra paruoštų job'ų ir laisvos concurrency vietos (be claim'o)."""
+
+    if queue.concurrency and active_count(queue) >= queue.concurrency:
+        return False
+    return queue.model.objects.filter(status=QUEUED, available_at__lte=timezone.now()).exists()
+
+
+def claim(
+    queue: Queue,
+    limit: int,
+    *,
+    token: str | None = None,
+    status: str = RUNNING,
+    lease: timedelta | None = None,
+    select_related: Iterable[str] = (),
+) -> tuple[str, list[models.Model]]:
+    """Atomiškai užsiima iki `limit` paruoštų (`available_at <= now`) QUEUED job'ų.
+
+    `status` – į kokią būseną pažymėti (pvz. nutrition Batch'ui `submitting`); eilės
+    `concurrency` taikoma tik `running`. Tą patį `token` galima naudoti keliems claim'ams
+    (puslapiais); grąžinami tik šio claim'o job'ai.
+    """
+
+    token = token or new_token()
+    if status == RUNNING and queue.concurrency:
+        limit = min(limit, queue.concurrency - active_count(queue))
+    if limit <= 0:
+        return token, []
+
+    model = queue.model
+    now = timezone.now()
+    values: dict[str, Any] = {
+        "status": status,
+        "lease_token": token,
+        "lease_expires_at": now + (lease or queue.lease),
+        "attempts": F("attempts") + 1,
+        "updated_at": now,
+    }
+    if status == RUNNING:
+        values["started_at"] = now
+    with transaction.atomic():
+        ids = list(
+            model.objects.select_for_update(skip_locked=True)
+            .filter(status=QUEUED, available_at__lte=now)
+            .order_by("available_at", "id")
+            .values_list("id", flat=True)[:limit]
+        )
+        model.objects.filter(id__in=ids, status=QUEUED).update(**values)
+    jobs = list(
+        model.objects.select_related(*select_related)
+        .filter(id__in=ids, lease_token=token, status=status)
+        .order_by("available_at", "id")
+    )
+    publish_status(queue, [job.id for job in jobs], status)
+    return token, jobs
+
+
+def leased(queue: Queue, token: str, *, status: str = RUNNING) -> models.QuerySet:
+    """Job'ai, kuriuos `token` vis dar laiko (naudoti kaip UPDATE sąlygą)."""
+
+    return queue.model.objects.filter(lease_token=token, status=status)
+
+
+def heartbeat(queue: Queue, token: str, *, status: str = RUNNING) -> int:
+    now = timezone.now()
+    return leased(queue, token, status=status).update(
+        lease_expires_at=now + queue.lease, updated_at=now
+    )
+
+
+class Heartbeat:
+    """Pratęsia lease ne dažniau nei kas trečdalį lease trukmės (kviesti cikle)."""
+
+    def __init__(self, queue: Queue, token: str, *, status: str = RUNNING) -> None:
+        self.queue = queue
+        self.token = token
+        self.status = status
+        self._last = time.monotonic()
+
+    def __call__(self) -> None:
+        if time.monotonic() - self._last >= self.queue.lease.total_seconds() / 3:
+            heartbeat(self.queue, self.token, status=self.status)
+            self._last = time.monotonic()
+
+
+def complete(queue: Queue, token: str, job_id: int, **fields) -> bool:
+    """Pažymi job'ą SUCCEEDED, jei lease dar galioja (papildomi laukai – `fields`)."""
+
+    now = timezone.now()
+    updated = (
+        leased(queue, token)
+        .filter(id=job_id)
+        .update(
+            status=SUCCEEDED,
+            error="",
+            finished_at=now,
+            lease_token="",
+            lease_expires_at=None,
+            updated_at=now,
+            **fields,
+        )
+    )
+    if updated:
+        publish_status(queue, [job_id], SUCCEEDED)
+    return updated == 1
+
+
+def fail(
+    queue: Queue, pending: models.QuerySet, errors: dict[int, str], *, retry: bool = True
+) -> tuple[list[int], list[int]]:
+    """Klaidos: job'ai grąžinami į eilę su atidėjimu arba tampa galutiniai.
+
+    `pending` – job'ų queryset'as su būsenos / lease sąlyga. Išnaudoję `max_attempts`
+    job'ai tampa `dead`; su `retry=False` – iškart `failed`.
+    Grąžina (pakartojamų, galutinai nepavykusių) job'ų id.
+    """
+
+    if not errors:
+        return [], []
+    attempts = dict(pending.filter(id__in=list(errors)).values_list("id", "attempts"))
+    retried = [pk for pk, count in attempts.items() if retry and count < queue.max_attempts]
+    terminal = [pk for pk in attempts if pk not in set(retried)]
+
+    now = timezone.now()
+    released = {"lease_token": "", "lease_expires_at": None, "updated_at": now}
+    with transaction.atomic():
+        if retried:
+            pending.filter(id__in=retried).update(
+                status=QUEUED,
+                error=case_by_id({pk: errors[pk] for pk in retried}, models.TextField()),
+                available_at=case_by_id(
+                    {pk: now + backoff_delay(queue, attempts[pk]) for pk in retried},
+                    models.DateTimeField(),
+                ),
+                **released,
+            )
+        if terminal:
+            pending.filter(id__in=terminal).update(
+                status=DEAD if retry else FAILED,
+                error=case_by_id({pk: errors[pk] for pk in terminal}, models.TextField()),
+                finished_at=now,
+                **released,
+            )
+    publish_status(queue, retried, QUEUED)
+    publish_status(queue, terminal, DEAD if retry else FAILED)
+    return retried, terminal
+
+
+def release(
+    queue: Queue, token: str, *, status: str = RUNNING, job_ids: Iterable[int] | None = None
+) -> int:
+    """Grąžina neapdorotus claim'o job'us į eilę (bandymas neįskaičiuojamas)."""
+
+    qs = leased(queue, token, status=status)
+    if job_ids is not None:
+        qs = qs.filter(id__in=list(job_ids))
+    if queue.events:
+        publish_status(queue, list(qs.values_list("id", flat=True)), QUEUED)
+    return qs.update(
+        status=QUEUED,
+        attempts=F("attempts") - 1,
+        lease_token="",
+        lease_expires_at=None,
+        updated_at=timezone.now(),
+    )
+
+
+def notify(queue_name: str) -> None:
+    """Pažadina `run_workers` (Postgres NOTIFY; pristatoma tik po commit'o)."""
+
+    pubsub.notify(NOTIFY_CHANNEL, queue_name)
+
+
+def listener() -> pubsub.Listener:
+    """Laukia `notify` pažadinimų (`wait` grąžina eilių vardus)."""
+
+    return pubsub.Listener(NOTIFY_CHANNEL)
@@ -0,0 +1,188 @@
+"""Lengvas pub/sub job'ų progreso įvykiams (SSE) ir Postgres LISTEN/NOTIFY pagalbininkai.
+
+Worker'iai kviečia `publish(topic, event)`, o ASGI procesas – `subscribe(topic)` ir
+įvykių laukia async (`await subscription.get(timeout)`).
+
+- Postgres: įvykis siunčiamas `NOTIFY job_events` (tarp procesų, pristatoma tik po
+  commit'o). Kiekviename procese su prenumeratoriais veikia viena fono gija su
+  `Listener`, kuri įvykius išdalina prenumeratoriams.
+- Kitos DB (SQLite): įvykiai pristatomi tik to paties proceso prenumeratoriams
+  (po commit'o).
+
+Įvykiai – tik signalai: praleistas įvykis nieko nesugadina, nes SSE būseną visada
+skaito iš DB (ir periodiškai ją perskaito).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = "job_events"
+# Postgres NOTIFY payload riba – 8000 baitų.
+MAX_PAYLOAD_BYTES = 7900
+# Lėtas prenumeratorius nestabdo kitų: seniausi įvykiai išmetami.
+SUBSCRIPTION_BUFFER = 100
+
+
+def notify(channel: str, payload: str) -> None:
+    """Postgres `NOTIFY` (pristatoma tik po commit'o); kitose DB nieko nedaro."""
+
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [channel, payload])
+
+
+class Listener:
+    """Laukia `notify` žinučių atskiru DB ryšiu; ne Postgres DB – paprastas miegas."""
+
+    def __init__(self, channel: str) -> None:
+        self._db = None
+        if connection.vendor == "postgresql":
+            self._db = connections.create_connection(DEFAULT_DB_ALIAS)
+            self._db.ensure_connection()
+            self._db.connection.execute(f"LISTEN {channel}")
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    def wait(self, timeout: float) -> list[str]:
+        """Grąžina gautų žinučių payload'us (tuščias sąrašas – baigėsi `timeout`)."""
+
+        if self._db is None:
+            time.sleep(timeout)
+            return []
+        notifies = self._db.connection.notifies(timeout=timeout, stop_after=1)
+        return [notify.payload for notify in notifies]
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def topic(queue_name: str, job_id: int) -> str:
+    return f"{queue_name}:{job_id}"
+
+
+class Subscription:
+    """Vieno topic'o įvykių eilė; kurti ir skaityti iš to paties event loop'o."""
+
+    def __init__(self, topic: str) -> None:
+        self.topic = topic
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+
+    async def get(self, timeout: float) -> dict[str, Any] | None:
+        """Kitas įvykis arba `None`, jei per `timeout` nieko neatėjo."""
+
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def deliver(self, event: dict[str, Any]) -> None:
+        # Kviečiama iš bet kurios gijos.
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Event loop'as jau uždarytas (klientas atsijungė).
+            self.close()
+
+    def _put(self, event: dict[str, Any]) -> None:
+        if self._queue.qsize() >= SUBSCRIPTION_BUFFER:
+            self._queue.get_nowait()
+        self._queue.put_nowait(event)
+
+    def close(self) -> None:
+        with _lock:
+            subscribers = _subscribers.get(self.topic)
+            if subscribers is not None:
+                subscribers.discard(self)
+                if not subscribers:
+                    del _subscribers[self.topic]
+
+    def __enter__(self) -> Subscription:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+_lock = threading.Lock()
+_subscribers: dict[str, set[Subscription]] = defaultdict(set)
+_listener_thread: threading.Thread | None = None
+
+
+def subscribe(topic: str) -> Subscription:
+    """Prenumerata (kviesti iš async kodo); uždaryti `close()` arba `with`."""
+
+    subscription = Subscription(topic)
+    with _lock:
+        _subscribers[topic].add(subscription)
+    if connection.vendor == "postgresql":
+        _ensure_listener()
+    return subscription
+
+
+def publish(topic: str, event: dict[str, Any]) -> None:
+    """Išsiunčia įvykį prenumeratoriams (po einamosios transakcijos commit'o)."""
+
+    if connection.vendor == "postgresql":
+        payload = json.dumps({"topic": topic, "event": event}, ensure_ascii=False, default=str)
+        if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+            logger.warning(
+                "Įvykis %s per didelis NOTIFY (%s B) – praleidžiamas", topic, len(payload)
+            )
+            return
+        notify(EVENTS_CHANNEL, payload)
+        return
+    transaction.on_commit(lambda: dispatch(topic, event))
+
+
+def dispatch(topic: str, event: dict[str, Any]) -> None:
+    """Pristato įvykį šio proceso prenumeratoriams."""
+
+    with _lock:
+        subscribers = list(_subscribers.get(topic, ()))
+    for subscription in subscribers:
+        subscription.deliver(event)
+
+
+def _ensure_listener() -> None:
+    global _listener_thread
+    with _lock:
+        if _listener_thread is not None and _listener_thread.is_alive():
+            return
+        _listener_thread = threading.Thread(target=_listen, name="pubsub-listener", daemon=True)
+        _listener_thread.start()
+
+
+def _listen() -> None:
+    """Fono gija: `LISTEN job_events` ir įvykių išdalinimas (atsijungus – jungiasi iš naujo)."""
+
+    while True:
+        listener = None
+        try:
+            listener = Listener(EVENTS_CHANNEL)
+            while True:
+                for payload in listener.wait(5.0):
+                    message = json.loads(payload)
+                    dispatch(message["topic"], message["event"])
+        except Exception:
+            logger.exception("pub/sub listener nutrūko – jungiamasi iš naujo")
+            time.sleep(1.0)
+        finally:
+            if listener is not None:
+                listener.close()
@@ -0,0 +1,200 @@
+"""Per-user AI užklausų ribojimas: token bucket (burst + papildymo greitis) ir dienos kvota.
+
+Kiekvienam job'ų tipui (`generation`, `image`) – atskira `Limit`:
+- `burst` – kiek užklausų galima pateikti iš karto (bucket talpa);
+- `per_minute` – kiek užklausų per minutę bucket'as atsipildo;
+- `per_day` – kiek užklausų per kalendorinę dieną (`TIME_ZONE`).
+0 – neribota: bucket'as taikomas tik kai ir `burst`, ir `per_minute` > 0 (bucket'as be
+papildymo niekada neatsipildytų). Reikšmės perrašomos per `settings.AI_RATE_LIMITS`.
+
+Būsena laikoma proceso atmintyje arba (`AI_RATE_LIMIT_SHARED=True`) Django cache
+(Redis) – tada ribos bendros visiems gunicorn worker'iams. DB neliečiama: raktas –
+`request.user.id`, kurį autentifikacija jau turi. Cache'e bucket'as keičiamas slankiuoju
+langu su atomišku `cache.incr` (žr. `CacheStore`) – be lock'ų, kurių lygiagretus srautas
+galėtų išvengti.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+# Vietinės būsenos raktų riba – viršijus išmetami seni (neaktyvūs) bucket'ai.
+MAX_LOCAL_KEYS = 10_000
+
+
+@dataclass(frozen=True)
+class Limit:
+    burst: int = 0
+    per_minute: float = 0
+    per_day: int = 0
+
+
+LIMITS: dict[str, Limit] = {
+    "generation": Limit(burst=3, per_minute=2, per_day=50),
+    "image": Limit(burst=2, per_minute=1, per_day=20),
+}
+
+
+class RateLimitedError(Exception):
+    """Užklausa atmesta; `retry_after` – po kiek sekundžių bandyti vėl."""
+
+    def __init__(self, message: str, *, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_limit(kind: str) -> Limit:
+    """Riba su `settings.AI_RATE_LIMITS[kind]` perrašymais (pvz. `burst`, `per_day`)."""
+
+    return replace(LIMITS[kind], **getattr(settings, "AI_RATE_LIMITS", {}).get(kind, {}))
+
+
+def _seconds_until_midnight(now: datetime) -> int:
+    local = timezone.localtime(now)
+    midnight = (local + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, math.ceil((midnight - local).total_seconds()))
+
+
+def _refill(tokens: float, updated: float, now: float, limit: Limit) -> float:
+    return min(float(limit.burst), tokens + (now - updated) * limit.per_minute / 60)
+
+
+def _wait_seconds(tokens: float, limit: Limit) -> float:
+    """Kiek laukti, kol bucket'e atsiras vienas token'as (`limit.per_minute` > 0)."""
+
+    return (1 - tokens) * 60 / limit.per_minute
+
+
+class LocalStore:
+    """Proceso atminties būsena (thread-safe)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._daily: dict[str, int] = {}
+        self._day = ""
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        """Paima token'ą; grąžina 0 arba kiek sekundžių laukti."""
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (float(limit.burst), now))
+            tokens = _refill(tokens, updated, now, limit)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return _wait_seconds(tokens, limit)
+            if len(self._buckets) >= MAX_LOCAL_KEYS:
+                self._prune(now)
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+
+    def incr_daily(self, key: str, day: str, ttl: int) -> int:
+        with self._lock:
+            if day != self._day:
+                self._daily, self._day = {}, day
+            self._daily[key] = self._daily.get(key, 0) + 1
+            return self._daily[key]
+
+    def decr_daily(self, key: str, day: str) -> None:
+        with self._lock:
+            if day == self._day and self._daily.get(key, 0) > 0:
+                self._daily[key] -= 1
+
+    def _prune(self, now: float) -> None:
+        # Po valandos be užklausų bucket'as bet kokiu atveju pilnas – jį galima pamiršti.
+        self._buckets = {
+            key: value for key, value in self._buckets.items() if now - value[1] < 3600
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._daily.clear()
+
+
+class CacheStore:
+    """Bendra būsena Django cache (Redis): be lock'ų, tik atomiški `cache.add`/`cache.incr`.
+
+    Bucket'as aproksimuojamas slankiuoju langu: lango ilgis – per kiek laiko atsipildo
+    visas bucket'as (`burst / per_minute`), riba lange – `burst`. Einamojo lango skaitiklis
+    didinamas atomiškai, todėl lygiagrečios užklausos ribos neapeina.
+    """
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        window = limit.burst * 60 / limit.per_minute
+        slot = int(now // window)
+        current_key = f"{key}:{slot}"
+        count = self._incr(current_key, ttl=math.ceil(2 * window) + 60)
+        previous = cache.get(f"{key}:{slot - 1}", 0)
+        elapsed = now / window - slot
+        if previous * (1 - elapsed) + count <= limit.burst:
+            return 0.0
+        # Atmesta užklausa token'o nenaudoja.
+        self._decr(current_key)
+        if count <= limit.burst and previous:
+            # Laukti, kol ankstesnio lango svoris sumažės tiek, kad tilptų dar viena.
+            return max(1.0, ((1 - (limit.burst - count) / previous) - elapsed) * window)
+        return max(1.0, (slot + 1) * window - now)
+
+    def _incr(self, key: str, *, ttl: int) -> int:
+        cache.add(key, 0, timeout=ttl)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Raktas spėjo pasibaigti tarp `add` ir `incr`.
+            cache.set(key, 1, timeout=ttl)
+            return 1
+
+    def _decr(self, key: str) -> None:
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
+
+    def incr_daily(self, key: str, day: str, ttl: int) -> int:
+        return self._incr(f"{key}:{day}", ttl=ttl + 60)
+
+    def decr_daily(self, key: str, day: str) -> None:
+        self._decr(f"{key}:{day}")
+
+
+local_store = LocalStore()
+
+
+def _store() -> LocalStore | CacheStore:
+    return CacheStore() if getattr(settings, "AI_RATE_LIMIT_SHARED", False) else local_store
+
+
+def check(kind: str, user_id: int) -> None:
+    """Įskaito vartotojo užklausą; viršijus ribą – `RateLimitedError`."""
+
+    limit = get_limit(kind)
+    bucket = limit.burst > 0 and limit.per_minute > 0
+    if not bucket and not limit.per_day:
+        return
+    store = _store()
+    key = f"ratelimit:{kind}:{user_id}"
+    now = timezone.now()
+
+    day = ""
+    if limit.per_day:
+        day = timezone.localdate(now).isoformat()
+        until_midnight = _seconds_until_midnight(now)
+        if store.incr_daily(f"{key}:day", day, until_midnight) > limit.per_day:
+            store.decr_daily(f"{key}:day", day)
+            raise RateLimitedError("Išnaudota dienos kvota", retry_after=until_midnight)
+
+    if bucket:
+        wait = store.take(f"{key}:bucket", limit, now.timestamp())
+        if wait > 0:
+            # Atmesta užklausa dienos kvotos nenaudoja.
+            if day:
+                store.decr_daily(f"{key}:day", day)
+            raise RateLimitedError("Per daug užklausų", retry_after=math.ceil(wait))
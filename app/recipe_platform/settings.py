@@ -96,6 +96,12 @@ DATABASES = {
     "default": env.db("DATABASE_URL", default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
 }
 
+# Produkcijoje – bendras Redis (pvz. redis://127.0.0.1:6379/1), kad paieškos cache ir
+# indekso versija būtų matomi visiems gunicorn worker'iams ir outbox worker'iui.
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
     {"NAME": "django.contrib.auth.password_validation.MinimumLengthValidator"},
@@ -199,6 +205,48 @@ OPENAI_IMAGE_MODEL = env("OPENAI_IMAGE_MODEL", default="gpt-image-1")
 OPENAI_IMAGE_FALLBACK_MODEL = env("OPENAI_IMAGE_FALLBACK_MODEL", default="dall-e-3")
 OPENAI_IMAGE_SIZE = env("OPENAI_IMAGE_SIZE", default="1024x1024")
 OPENAI_REQUEST_TIMEOUT_SECONDS = env.int("OPENAI_REQUEST_TIMEOUT_SECONDS", default=60)
+# Batch API ribos vienam batch'ui (didesni kiekiai skaidomi į kelis batch'us).
+OPENAI_BATCH_MAX_REQUESTS = env.int("OPENAI_BATCH_MAX_REQUESTS", default=50_000)
+OPENAI_BATCH_MAX_BYTES = env.int("OPENAI_BATCH_MAX_BYTES", default=190 * 1024 * 1024)
+# Tiekėjo „enqueued tokens“ limitas modeliui (0 – neribota). Nakties pateikimas užpildo
+# tik likusią kvotą (limitas - jau pateiktų, dar neapdorotų batch'ų token'ai).
+OPENAI_BATCH_TOKEN_QUOTA = env.int("OPENAI_BATCH_TOKEN_QUOTA", default=2_000_000)
+# Sinchroninis nutrition worker'is: lygiagrečios užklausos ir request'ų per minutę riba
+# (0 – neribota).
+OPENAI_NUTRITION_CONCURRENCY = env.int("OPENAI_NUTRITION_CONCURRENCY", default=4)
+OPENAI_NUTRITION_RPM = env.int("OPENAI_NUTRITION_RPM", default=0)
+# Receptų generavimo worker'is: kiek OpenAI užklausų vienu metu (async).
+OPENAI_RECIPE_CONCURRENCY = env.int("OPENAI_RECIPE_CONCURRENCY", default=8)
+
+# Job eilių (recipe_platform.jobqueue) perrašymai: concurrency – kiek job'ų vienu metu
+# `running` (0 – neribota); taip pat galima `lease_seconds`, `max_attempts`, `backoff_seconds`.
+JOB_QUEUES = {
+    "generation": {"concurrency": env.int("JOB_QUEUE_GENERATION_CONCURRENCY", default=16)},
+    "image": {"concurrency": env.int("JOB_QUEUE_IMAGE_CONCURRENCY", default=2)},
+    "nutrition": {"concurrency": env.int("JOB_QUEUE_NUTRITION_CONCURRENCY", default=0)},
+}
+# SSE job'ų progresas (ai.events): keepalive / atsarginio būsenos patikrinimo intervalas ir
+# maks. vieno srauto trukmė (po jos EventSource persijungia pats).
+JOB_EVENTS_KEEPALIVE_SECONDS = env.int("JOB_EVENTS_KEEPALIVE_SECONDS", default=15)
+JOB_EVENTS_MAX_SECONDS = env.int("JOB_EVENTS_MAX_SECONDS", default=600)
+
+# AI job'ų pateikimo ribos vienam vartotojui (recipe_platform.ratelimit): burst – bucket
+# talpa, per_minute – papildymo greitis, per_day – dienos kvota (0 – neribota; burst ar
+# per_minute = 0 išjungia bucket'ą, lieka tik dienos kvota).
+AI_RATE_LIMITS = {
+    "generation": {
+        "burst": env.int("AI_GENERATION_BURST", default=3),
+        "per_minute": env.float("AI_GENERATION_PER_MINUTE", default=2),
+        "per_day": env.int("AI_GENERATION_PER_DAY", default=50),
+    },
+    "image": {
+        "burst": env.int("AI_IMAGE_BURST", default=2),
+        "per_minute": env.float("AI_IMAGE_PER_MINUTE", default=1),
+        "per_day": env.int("AI_IMAGE_PER_DAY", default=20),
+    },
+}
+# True – ribų būsena bendrame cache (CACHE_URL=redis://...), kitaip – kiekvieno proceso atmintyje.
+AI_RATE_LIMIT_SHARED = env.bool("AI_RATE_LIMIT_SHARED", default=False)
 
 LOGGING = {
     "version": 1,
@@ -0,0 +1,129 @@
+"""Unikalių slug'ų (ir panašių laukų, pvz. `username`) paskirstymas.
+
+Vietoje `exists()` ciklo (`base`, `base-1`, `base-2`, ... po užklausą kiekvienam) visi
+galimai susiduriantys variantai paimami viena užklausa (`startswith` – naudoja indeksą;
+`base` / `base-<skaičius>` atrenkami atmintyje), o pirmas laisvas sufiksas parenkamas
+atmintyje. Lygiagretūs įrašai vis tiek gali susidurti, todėl `save_with_retry` pakartoja
+išsaugojimą su nauju slug'u, kai pažeidžiamas unique constraint.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Callable, Iterable, TypeVar
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+
+T = TypeVar("T")
+
+
+def _taken_values(
+    model: type[models.Model],
+    bases: Iterable[str],
+    *,
+    field: str,
+    case_insensitive: bool,
+    exclude_pk=None,
+) -> set[str]:
+    bases = sorted(set(bases))
+    # `startswith` (LIKE 'base%') naudoja slug'o indeksą; tikslus `base(-N)?` – atmintyje.
+    lookup = "istartswith" if case_insensitive else "startswith"
+    condition = Q()
+    for base in bases:
+        condition |= Q(**{f"{field}__{lookup}": base})
+    alternatives = "|".join(re.escape(base) for base in bases)
+    pattern = re.compile(f"({alternatives})(-[0-9]+)?", re.IGNORECASE if case_insensitive else 0)
+
+    qs = model._default_manager.filter(condition)
+    if exclude_pk is not None:
+        qs = qs.exclude(pk=exclude_pk)
+    values = [value for value in qs.values_list(field, flat=True) if pattern.fullmatch(value)]
+    return {value.lower() for value in values} if case_insensitive else set(values)
+
+
+def _pick(base: str, taken: set[str], *, first_suffix: int, case_insensitive: bool) -> str:
+    def _key(value: str) -> str:
+        return value.lower() if case_insensitive else value
+
+    if _key(base) not in taken:
+        return base
+    counter = first_suffix
+    while _key(f"{base}-{counter}") in taken:
+        counter += 1
+    return f"{base}-{counter}"
+
+
+def allocate(
+    model: type[models.Model],
+    base: str,
+    *,
+    field: str = "slug",
+    exclude_pk=None,
+    first_suffix: int = 1,
+    case_insensitive: bool = False,
+) -> str:
+    """Grąžina laisvą reikšmę `base` arba `base-N` (viena DB užklausa)."""
+
+    taken = _taken_values(
+        model, [base], field=field, case_insensitive=case_insensitive, exclude_pk=exclude_pk
+    )
+    return _pick(base, taken, first_suffix=first_suffix, case_insensitive=case_insensitive)
+
+
+def allocate_many(
+    model: type[models.Model],
+    bases: list[str],
+    *,
+    field: str = "slug",
+    first_suffix: int = 1,
+    case_insensitive: bool = False,
+) -> list[str]:
+    """Bulk režimas importams: unikalios reikšmės visam sąrašui viena užklausa.
+
+    Reikšmės unikalios ir tarpusavyje (du vienodi `base` gauna `base` ir `base-1`).
+    """
+
+    if not bases:
+        return []
+    taken = _taken_values(model, bases, field=field, case_insensitive=case_insensitive)
+    result = []
+    for base in bases:
+        value = _pick(base, taken, first_suffix=first_suffix, case_insensitive=case_insensitive)
+        taken.add(value.lower() if case_insensitive else value)
+        result.append(value)
+    return result
+
+
+def save_with_retry(
+    instance: models.Model,
+    save: Callable[[], T],
+    *,
+    base: str,
+    field: str = "slug",
+    attempts: int = 3,
+    **allocate_kwargs,
+) -> T:
+    """Išsaugo `instance`; jei kitas procesas spėjo užimti tą pačią reikšmę – paskiria naują.
+
+    Kiekvienas bandymas vykdomas savepoint'e, todėl išorinė transakcija nenukenčia.
+    """
+
+    model = type(instance)
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic(using=instance._state.db):
+                return save()
+        except IntegrityError:
+            value = getattr(instance, field)
+            conflict = (
+                model._default_manager.filter(**{field: value}).exclude(pk=instance.pk).exists()
+            )
+            if not conflict or attempt == attempts - 1:
+                raise
+            setattr(
+                instance,
+                field,
+                allocate(model, base, field=field, exclude_pk=instance.pk, **allocate_kwargs),
+            )
+    raise AssertionError("unreachable")
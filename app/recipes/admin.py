@@ -109,10 +109,14 @@ class RecipeAdmin(admin.ModelAdmin):
 
 @admin.register(models.Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
-    list_display = ("name", "category")
+    list_display = ("name", "category", "has_nutrients")
     search_fields = ("name",)
     list_filter = ("category",)
 
+    @admin.display(boolean=True, description="Maistinė vertė")
+    def has_nutrients(self, obj):
+        return bool(obj.nutrients_per_100g)
+
 
 @admin.register(models.IngredientCategory)
 class IngredientCategoryAdmin(admin.ModelAdmin):
@@ -128,7 +132,7 @@ class RecipeCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(models.MeasurementUnit)
 class MeasurementUnitAdmin(admin.ModelAdmin):
-    list_display = ("name", "short_name", "unit_type")
+    list_display = ("name", "short_name", "unit_type", "base_factor")
     list_filter = ("unit_type",)
 
 
@@ -176,3 +180,11 @@ class CommentAdmin(admin.ModelAdmin):
     @admin.action(description="Pažymėti kaip patvirtintus")
     def approve_comments(self, request, queryset):
         queryset.update(is_approved=True)
+
+
+@admin.register(models.SearchIndexOutbox)
+class SearchIndexOutboxAdmin(admin.ModelAdmin):
+    list_display = ("recipe_id", "operation", "attempts", "available_at", "failed_at", "created_at")
+    list_filter = ("operation", "failed_at")
+    search_fields = ("recipe_id",)
+    readonly_fields = ("created_at",)
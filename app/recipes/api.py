@@ -5,8 +5,7 @@ from typing import Iterable
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Avg, Count, Prefetch, Q
-from django.db.models import Case, IntegerField, When
+from django.db.models import Avg, Count, F, Prefetch, Q
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_protect
@@ -55,12 +54,15 @@ from .schemas import (
     RecipeIngredientSchema,
     RecipeListResponse,
     RecipeStepSchema,
+    RecipeSuggestionSchema,
     RecipeSummarySchema,
     RatingCreateSchema,
     RatingSchema,
     SimpleLookupSchema,
     CategoryFilterSchema,
 )
+from . import search_cache, search_sessions, suggest_index
+from .nutrition_service import scale_nutrition
 from .upstash_search import search_recipe_ids
 
 User = get_user_model()
@@ -154,7 +156,7 @@ def _serialize_recipe_summary(request, recipe: Recipe, bookmarked_ids: set[int])
     )
 
 
-def _serialize_ingredients(recipe: Recipe) -> list[RecipeIngredientSchema]:
+def _serialize_ingredients(recipe: Recipe, scale: float = 1.0) -> list[RecipeIngredientSchema]:
     items: list[RecipeIngredientSchema] = []
     for ingredient in recipe.recipe_ingredients.all():
         ingredient_schema = IngredientSchema(
@@ -177,7 +179,7 @@ def _serialize_ingredients(recipe: Recipe) -> list[RecipeIngredientSchema]:
             RecipeIngredientSchema(
                 id=ingredient.id,
                 group=group_schema,
-                amount=float(ingredient.amount),
+                amount=round(float(ingredient.amount) * scale, 2),
                 note=ingredient.note or None,
                 ingredient=ingredient_schema,
                 unit=unit_schema,
@@ -450,10 +452,7 @@ def _annotate_with_ratings(qs):
     )
 
 
-@router.get("/", response=RecipeListResponse)
-def list_recipes(request, filters: RecipeFilters = Query(...)):
-    qs = Recipe.objects.all()
-
+def _filter_facets(qs, filters: RecipeFilters):
     if filters.tag:
         qs = qs.filter(tags__slug=filters.tag)
     if filters.category:
@@ -464,43 +463,95 @@ def list_recipes(request, filters: RecipeFilters = Query(...)):
         qs = qs.filter(meal_types__slug=filters.meal_type)
     if filters.difficulty:
         qs = qs.filter(difficulty=filters.difficulty)
+    if filters.max_total_time:
+        qs = qs.alias(
+            total_time=F("preparation_time") + F("cooking_time")
+        ).filter(total_time__lte=filters.max_total_time)
+    return qs
+
 
-    used_upstash = False
-    candidate_ids: list[int] | None = None
-    if filters.search and filters.offset < 1000:
-        candidate_limit = min(max(filters.limit + filters.offset, 20), 1000)
-        candidate_ids = search_recipe_ids(filters.search, limit=candidate_limit)
-        if candidate_ids:
-            used_upstash = True
-            qs = qs.filter(id__in=candidate_ids)
-        else:
-            candidate_ids = None
-
-    if filters.search and not used_upstash:
+def _filter_recipes(qs, filters: RecipeFilters):
+    qs = _filter_facets(qs, filters)
+    if filters.search:
         qs = qs.filter(
             Q(title__icontains=filters.search)
             | Q(description__icontains=filters.search)
         )
+    return qs.order_by("-published_at", "-updated_at", "-id").distinct()
 
-    qs = _annotate_with_ratings(qs)
 
-    if used_upstash and candidate_ids:
-        ordering = Case(
-            *[When(id=pk, then=pos) for pos, pk in enumerate(candidate_ids)],
-            output_field=IntegerField(),
-        )
-        qs = qs.order_by(ordering)
-    else:
-        qs = qs.order_by("-published_at", "-updated_at", "-id")
+def _hydrate_in_order(
+    recipe_ids: list[int], filters: RecipeFilters | None = None
+) -> list[Recipe]:
+    qs = Recipe.objects.filter(id__in=recipe_ids)
+    if filters is not None:
+        # Apsauga nuo pasenusio indekso (pvz. pakeistas tag'o slug dar nesuindeksuotas):
+        # facet'ai dar kartą patikrinami DB.
+        qs = Recipe.objects.filter(id__in=_filter_facets(qs, filters).values("id"))
+    qs = _prefetch_for_list(_annotate_with_ratings(qs))
+    by_id = {recipe.id: recipe for recipe in qs}
+    return [by_id[pk] for pk in recipe_ids if pk in by_id]
 
-    qs = qs.distinct()
 
-    total = qs.count()
-    qs = _prefetch_for_list(qs)
+@router.get("/", response=RecipeListResponse)
+def list_recipes(request, filters: RecipeFilters = Query(...)):
     start = filters.offset
     end = start + filters.limit
+
+    if filters.search:
+        facets = {
+            "tag": filters.tag,
+            "category": filters.category,
+            "cuisine": filters.cuisine,
+            "meal_type": filters.meal_type,
+            "difficulty": filters.difficulty,
+            "max_total_time": filters.max_total_time,
+        }
+        session_params = {"search": filters.search, **facets}
+        cursor = filters.cursor
+        session = search_sessions.get(cursor, params=session_params)
+        if session is None:
+            # Facet'ai taikomi pačiame indekse – grąžinami tik juos atitinkantys ID.
+            fetch_limit = search_cache.MAX_FETCH_LIMIT
+            ranked_ids = search_recipe_ids(
+                filters.search, limit=fetch_limit, filters=facets)
+            if ranked_ids:
+                cursor, session = search_sessions.create(
+                    ranked_ids,
+                    params=session_params,
+                    has_tail=len(ranked_ids) >= fetch_limit,
+                )
+
+        if session is not None:
+            ranked_ids = session["ids"]
+            recipes_batch = _hydrate_in_order(ranked_ids[start:end], filters)
+            total = len(ranked_ids)
+            if session["has_tail"]:
+                # Už kandidatų lango – DB rezultatai, kurių nėra surikiuotame sąraše.
+                tail_qs = _filter_recipes(Recipe.objects.all(), filters).exclude(
+                    id__in=ranked_ids)
+                if session["tail_total"] is None:
+                    search_sessions.save_tail_total(
+                        cursor, session, tail_qs.count())
+                total += session["tail_total"]
+                if end > len(ranked_ids):
+                    tail_qs = _prefetch_for_list(_annotate_with_ratings(tail_qs))
+                    tail_start = max(start - len(ranked_ids), 0)
+                    tail_end = end - len(ranked_ids)
+                    recipes_batch += list(tail_qs[tail_start:tail_end])
+            return _recipe_list_response(
+                request, recipes_batch, total=total, cursor=cursor)
+
+    qs = _annotate_with_ratings(_filter_recipes(Recipe.objects.all(), filters))
+    total = qs.count()
+    qs = _prefetch_for_list(qs)
     recipes_batch = list(qs[start:end])
+    return _recipe_list_response(request, recipes_batch, total=total)
+
 
+def _recipe_list_response(
+    request, recipes_batch: list[Recipe], *, total: int, cursor: str | None = None
+) -> RecipeListResponse:
     bookmarked_ids: set[int] = set()
     if request.user.is_authenticated and recipes_batch:
         recipe_ids = [recipe.id for recipe in recipes_batch]
@@ -515,7 +566,7 @@ def list_recipes(request, filters: RecipeFilters = Query(...)):
         for recipe in recipes_batch
     ]
 
-    return RecipeListResponse(total=total, items=items)
+    return RecipeListResponse(total=total, items=items, cursor=cursor)
 
 
 @router.get("/bookmarks", response=RecipeListResponse)
@@ -542,8 +593,50 @@ def list_bookmarks(request):
     return RecipeListResponse(total=len(items), items=items)
 
 
+@router.get("/suggest", response=list[RecipeSuggestionSchema])
+def suggest_recipes(
+    request,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(8, ge=1, le=20),
+):
+    """Lengvi pasiūlymai rašant (be pilno receptų serializavimo)."""
+
+    suggestions = suggest_index.get_index().search(q, limit=limit)
+    recipe_ids = [s.object_id for s in suggestions if s.kind == suggest_index.RECIPE]
+    # Thumb'ams – viena užklausa tik su `image` lauku.
+    images = {
+        recipe.id: recipe
+        for recipe in Recipe.objects.filter(id__in=recipe_ids).only("id", "image")
+    }
+
+    items = []
+    for suggestion in suggestions:
+        thumb = None
+        recipe = None
+        if suggestion.kind == suggest_index.RECIPE:
+            recipe = images.get(suggestion.object_id)
+        if recipe is not None and recipe.image:
+            mapping = IMAGE_VARIANT_ATTRS["thumb"]
+            thumb = ImageVariantSchema(
+                avif=_abs_media_url(request, getattr(recipe, mapping["avif"], None)),
+                webp=_abs_media_url(request, getattr(recipe, mapping["webp"], None)),
+            )
+        items.append(
+            RecipeSuggestionSchema(
+                type=suggestion.kind, title=suggestion.title, slug=suggestion.slug, thumb=thumb
+            )
+        )
+    return items
+
+
 @router.get("/{slug}", response=RecipeDetailSchema)
-def get_recipe_detail(request, slug: str):
+def get_recipe_detail(
+    request,
+    slug: str,
+    servings: int | None = Query(None, ge=1, le=100),
+):
+    """Recepto detalė; su `servings` kiekiai ir maistinė vertė perskaičiuojami porcijoms."""
+
     qs = Recipe.objects.filter(slug=slug)
     qs = _annotate_with_ratings(qs)
     qs = _prefetch_for_detail(qs)
@@ -563,6 +656,8 @@ def get_recipe_detail(request, slug: str):
         request, recipe, {recipe.id} if is_bookmarked else set())
     summary_data = summary.dict()
     summary_data["is_bookmarked"] = is_bookmarked
+    target_servings = servings or recipe.servings
+    summary_data["servings"] = target_servings
 
     return RecipeDetailSchema(
         **summary_data,
@@ -571,7 +666,7 @@ def get_recipe_detail(request, slug: str):
         description=recipe.description or None,
         note=getattr(recipe, "note", "") or None,
         video_url=recipe.video_url or None,
-        nutrition=getattr(recipe, "nutrition", None),
+        nutrition=scale_nutrition(recipe.nutrition, target_servings),
         nutrition_updated_at=getattr(recipe, "nutrition_updated_at", None),
         categories=[_simple_lookup(cat) for cat in recipe.categories.all()],
         meal_types=[_simple_lookup(mt) for mt in recipe.meal_types.all()],
@@ -579,7 +674,9 @@ def get_recipe_detail(request, slug: str):
                   for cuisine in recipe.cuisines.all()],
         cooking_methods=[_simple_lookup(method)
                          for method in recipe.cooking_methods.all()],
-        ingredients=_serialize_ingredients(recipe),
+        ingredients=_serialize_ingredients(
+            recipe, target_servings / recipe.servings if recipe.servings else 1.0
+        ),
         steps=_serialize_steps(request, recipe),
         comments=_serialize_comments(recipe.comments.all(), user),
         user_rating=user_rating_value,
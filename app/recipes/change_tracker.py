@@ -0,0 +1,258 @@
+"""Receptų pakeitimų sekimas transakcijos ribose.
+
+Signalai ir `Recipe.save` tik pažymi, kuris receptas ir kaip pasikeitė (`mark`).
+Pakeitimai kaupiami vienai transakcijai, o po commit kiekvienam receptui išsiunčiamas
+vienas sulietas įvykis visiems vartotojams (`CONSUMERS`): nutrition pasenimas /
+perskaičiavimas porcijoms, pasiūlymų indeksas, vaizdų variantai, SEO laukai. Paieškos
+indekso operacija (`SearchIndexOutbox`) įrašoma iškart, toje pačioje transakcijoje,
+pirmo pažymėjimo metu – taip ji neprapuola, net jei procesas nukristų po commit.
+
+Transakcijos būsena laikoma šio modulio gijos atmintyje (`_TransactionState`), o ne
+skaitoma iš Django vidinių struktūrų. Atšaukus savepoint'ą, kuriame outbox buvo įrašytas,
+kitas pažymėjimas jį įrašo iš naujo."""
+
+from __future__ import annotations
+
+import logging
+import threading
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CONTENT = "content"
+INGREDIENTS = "ingredients"
+TAXONOMY = "taxonomy"
+IMAGE = "image"
+SERVINGS = "servings"
+PUBLISH = "publish"
+DELETED = "deleted"
+
+Changes = dict[int, frozenset[str]]
+
+_local = threading.local()
+
+
+class _PendingChanges:
+    """on_commit callback'as, kuris kartu yra ir transakcijos pakeitimų registras."""
+
+    def __init__(self, using: str) -> None:
+        self.using = using
+        self.changes: dict[int, set[str]] = defaultdict(set)
+
+    def __call__(self) -> None:
+        state = _transactions().get(self.using)
+        if state is not None and state.pending() is self:
+            del _transactions()[self.using]
+        dispatch({recipe_id: frozenset(kinds) for recipe_id, kinds in self.changes.items()})
+
+
+class _OutboxWritten:
+    """on_commit žymė outbox įrašui; jos gyvybė rodo, ar įrašas neatšauktas."""
+
+    def __call__(self) -> None:
+        pass
+
+
+class _TransactionState:
+    """Vienos DB transakcijos būsena (gijos atmintyje, pagal DB alias'ą).
+
+    Saugomos tik silpnos nuorodos į on_commit callback'us: Django atšaukto savepoint'o ar
+    transakcijos callback'us išmeta, todėl nuoroda „miršta“ kartu su atšauktais pakeitimais
+    ir outbox įrašu – jie užregistruojami iš naujo kito pažymėjimo metu.
+    """
+
+    def __init__(self, pending: _PendingChanges) -> None:
+        self.pending = weakref.ref(pending)
+        self.outbox: dict[int, tuple[weakref.ref, bool]] = {}
+
+    def outbox_written(self) -> dict[int, bool]:
+        """Receptai, kurių outbox įrašas dar galioja (ir ar tai `delete` operacija)."""
+
+        self.outbox = {
+            recipe_id: (marker, deleted)
+            for recipe_id, (marker, deleted) in self.outbox.items()
+            if marker() is not None
+        }
+        return {recipe_id: deleted for recipe_id, (_marker, deleted) in self.outbox.items()}
+
+
+def _transactions() -> dict[str, _TransactionState]:
+    transactions = getattr(_local, "transactions", None)
+    if transactions is None:
+        transactions = _local.transactions = {}
+    return transactions
+
+
+def _state_for(using: str | None) -> tuple[_TransactionState, _PendingChanges] | None:
+    connection = transaction.get_connection(using)
+    transactions = _transactions()
+    if not connection.in_atomic_block:
+        transactions.pop(connection.alias, None)
+        return None
+    state = transactions.get(connection.alias)
+    pending = state.pending() if state is not None else None
+    if pending is None:
+        # Pirmas pažymėjimas transakcijoje (arba ankstesnis registras atšauktas).
+        pending = _PendingChanges(connection.alias)
+        transaction.on_commit(pending, using=using)
+        outbox = state.outbox if state is not None else {}
+        state = transactions[connection.alias] = _TransactionState(pending)
+        state.outbox = outbox
+    return state, pending
+
+
+def _enqueue_search(recipe_ids: list[int], kinds: Iterable[str]) -> None:
+    from .models import SearchIndexOperation
+    from .upstash_search import enqueue_recipe_syncs
+
+    operation = SearchIndexOperation.DELETE if DELETED in kinds else SearchIndexOperation.UPSERT
+    enqueue_recipe_syncs(recipe_ids, operation)
+
+
+def mark(recipe_id: int | None, *kinds: str, using: str | None = None) -> None:
+    """Pažymi recepto pakeitimą; įvykis išsiunčiamas po commit (be transakcijos – iškart)."""
+
+    if recipe_id is not None:
+        mark_many([recipe_id], *kinds, using=using)
+
+
+def mark_many(recipe_ids: Iterable[int], *kinds: str, using: str | None = None) -> None:
+    """Pažymi daug receptų vienu kartu (outbox – vienu INSERT'u)."""
+
+    ids = list(dict.fromkeys(recipe_ids))
+    if not ids:
+        return
+    kinds_set = set(kinds) or {CONTENT}
+
+    buffers = getattr(_local, "buffers", None)
+    if buffers:
+        for recipe_id in ids:
+            buffers[-1][recipe_id].update(kinds_set)
+        return
+
+    current = _state_for(using)
+    if current is None:
+        _enqueue_search(ids, kinds_set)
+        dispatch({recipe_id: frozenset(kinds_set) for recipe_id in ids})
+        return
+    state, pending = current
+
+    deleted = DELETED in kinds_set
+    written = state.outbox_written()
+    new_ids = [
+        recipe_id
+        for recipe_id in ids
+        if recipe_id not in written or (deleted and not written[recipe_id])
+    ]
+    for recipe_id in ids:
+        pending.changes[recipe_id].update(kinds_set)
+    if new_ids:
+        _enqueue_search(new_ids, kinds_set)
+        marker = _OutboxWritten()
+        transaction.on_commit(marker, using=using)
+        for recipe_id in new_ids:
+            state.outbox[recipe_id] = (weakref.ref(marker), deleted)
+
+
+@contextmanager
+def deferred(using: str | None = None) -> Iterator[None]:
+    """Atideda pažymėjimus iki bloko pabaigos (importams / bulk operacijoms).
+
+    Bloko viduje `mark` tik kaupia pakeitimus atmintyje; sėkmingai pasibaigus
+    blokui jie pažymimi grupėmis per `mark_many` (vienas outbox INSERT grupei).
+    Klaidos atveju sukaupti pakeitimai išmetami kartu su transakcija.
+    """
+
+    buffers = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = []
+    buffer: dict[int, set[str]] = defaultdict(set)
+    buffers.append(buffer)
+    try:
+        yield
+    finally:
+        buffers.pop()
+
+    groups: dict[frozenset[str], list[int]] = defaultdict(list)
+    for recipe_id, kinds in buffer.items():
+        groups[frozenset(kinds)].append(recipe_id)
+    for kinds, ids in groups.items():
+        mark_many(ids, *kinds, using=using)
+
+
+def _mark_nutrition_dirty(changes: Changes) -> None:
+    from .models import Recipe
+
+    # Porcijų pakeitimas nutrition nepasendina: saugomos viso recepto sumos.
+    ids = [rid for rid, kinds in changes.items() if INGREDIENTS in kinds]
+    if ids:
+        Recipe.objects.filter(id__in=ids).update(nutrition_dirty=True)
+
+
+def _rescale_nutrition(changes: Changes) -> None:
+    from .models import Recipe
+    from .nutrition_service import scale_nutrition
+
+    ids = [rid for rid, kinds in changes.items() if SERVINGS in kinds and DELETED not in kinds]
+    if not ids:
+        return
+    recipes = list(
+        Recipe.objects.filter(id__in=ids, nutrition__isnull=False).only(
+            "id", "servings", "nutrition"
+        )
+    )
+    for recipe in recipes:
+        recipe.nutrition = scale_nutrition(recipe.nutrition, recipe.servings)
+    Recipe.objects.bulk_update(recipes, ["nutrition"])
+
+
+def _refresh_suggestions(changes: Changes) -> None:
+    from . import suggest_index
+
+    suggest_index.update_recipes(
+        [rid for rid, kinds in changes.items() if kinds & {CONTENT, PUBLISH, DELETED}]
+    )
+
+
+def _generate_image_variants(changes: Changes) -> None:
+    from .models import Recipe
+
+    ids = [rid for rid, kinds in changes.items() if IMAGE in kinds and DELETED not in kinds]
+    if not ids:
+        return
+    for recipe in Recipe.objects.filter(id__in=ids).exclude(image="").only("id", "image"):
+        recipe._generate_image_variants()
+
+
+def _fill_seo_fields(changes: Changes) -> None:
+    from django.db.models.functions import Left
+
+    from .models import Recipe
+
+    ids = [rid for rid, kinds in changes.items() if DELETED not in kinds]
+    if ids:
+        Recipe.objects.filter(id__in=ids, meta_title="").update(meta_title=Left("title", 80))
+
+
+CONSUMERS: list[Callable[[Changes], None]] = [
+    _mark_nutrition_dirty,
+    _rescale_nutrition,
+    _refresh_suggestions,
+    _generate_image_variants,
+    _fill_seo_fields,
+]
+
+
+def dispatch(changes: Changes) -> None:
+    if not changes:
+        return
+    for consumer in CONSUMERS:
+        try:
+            consumer(changes)
+        except Exception:
+            logger.exception("Recepto pakeitimų vartotojas %s nepavyko", consumer.__name__)
@@ -3,6 +3,7 @@ from __future__ import annotations
 from django.core.management.base import BaseCommand
 from django.db.models import Exists, OuterRef
 
+from recipe_platform import jobqueue
 from recipes.models import Recipe, RecipeImageJob, RecipeImageJobStatus
 from recipes.image_service import build_recipe_image_prompt
 
@@ -60,4 +61,7 @@ class Command(BaseCommand):
             )
             created += 1
 
+        if created and not dry_run:
+            jobqueue.notify("image")
+
         self.stdout.write(self.style.SUCCESS(f"Image job'ai: sukurta={created}, kandidatu={len(recipes)}"))
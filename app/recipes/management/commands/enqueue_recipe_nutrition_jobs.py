@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+from collections import defaultdict
+
 from django.core.management.base import BaseCommand
-from django.db.models import Exists, OuterRef, Q
+from django.db import transaction
+from django.db.models import BooleanField, Exists, ExpressionWrapper, OuterRef, Q
 from django.utils import timezone
 
+from recipes import nutrition_calculator
 from recipes.models import Recipe, RecipeIngredient, RecipeNutritionJob, RecipeNutritionJobStatus
+from recipes.nutrition_service import find_reusable_results, scale_nutrition
 
 
 class Command(BaseCommand):
@@ -20,7 +25,10 @@ class Command(BaseCommand):
         parser.add_argument(
             "--force",
             action="store_true",
-            help="Ignoruoti nutrition_dirty ir bandyti sukurti job'us visiems (vis tiek praleidžia jei yra active job).",
+            help=(
+                "Ignoruoti nutrition_dirty ir bandyti sukurti job'us visiems "
+                "(vis tiek praleidžia jei yra active job)."
+            ),
         )
         parser.add_argument(
             "--dry-run",
@@ -36,7 +44,12 @@ class Command(BaseCommand):
 
         active_jobs = RecipeNutritionJob.objects.filter(
             recipe_id=OuterRef("pk"),
-            status__in=[RecipeNutritionJobStatus.QUEUED, RecipeNutritionJobStatus.RUNNING],
+            status__in=[
+                RecipeNutritionJobStatus.QUEUED,
+                RecipeNutritionJobStatus.SUBMITTING,
+                RecipeNutritionJobStatus.SUBMITTED,
+                RecipeNutritionJobStatus.RUNNING,
+            ],
         )
 
         qs = Recipe.objects.all().annotate(has_active_job=Exists(active_jobs))
@@ -46,40 +59,110 @@ class Command(BaseCommand):
             qs = qs.filter(Q(nutrition__isnull=True) | Q(nutrition_dirty=True))
         qs = qs.filter(has_active_job=False).order_by("id")
 
-        recipes = list(qs[:limit])
+        qs = qs.annotate(
+            nutrition_missing=ExpressionWrapper(
+                Q(nutrition__isnull=True), output_field=BooleanField()
+            )
+        )
+        recipes = list(
+            qs.values_list("id", "servings", "nutrition_input_hash", "nutrition_missing")[:limit]
+        )
+        recipe_ids = [row[0] for row in recipes]
+
+        # Visų kandidatų ingredientai viena užklausa; grupuojam atmintyje.
+        rows_by_recipe: dict[int, list[tuple]] = defaultdict(list)
+        ingredient_rows = (
+            RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+            .values_list("recipe_id", "ingredient_id", "group_id", "unit_id", "amount", "note")
+            .order_by("recipe_id", "ingredient_id", "group_id", "unit_id", "amount", "id")
+        )
+        for recipe_id, *row in ingredient_rows.iterator(chunk_size=5000):
+            rows_by_recipe[recipe_id].append(tuple(row))
 
-        created = 0
+        jobs: list[RecipeNutritionJob] = []
+        unchanged_ids: list[int] = []
         skipped_no_ingredients = 0
-
-        for recipe in recipes:
-            ingredient_rows = list(
-                RecipeIngredient.objects.filter(recipe_id=recipe.id)
-                .values_list("ingredient_id", "group_id", "unit_id", "amount", "note")
-                .order_by("ingredient_id", "group_id", "unit_id", "amount", "id")
-            )
-            if not ingredient_rows:
+        for recipe_id, _servings, stored_hash, nutrition_missing in recipes:
+            rows = rows_by_recipe.get(recipe_id)
+            if not rows:
                 skipped_no_ingredients += 1
                 continue
 
-            input_hash = RecipeNutritionJob.compute_input_hash(
-                servings=recipe.servings,
-                ingredient_rows=ingredient_rows,
+            input_hash = RecipeNutritionJob.compute_input_hash(ingredient_rows=rows)
+            if not force and not nutrition_missing and input_hash == stored_hash:
+                # Turinys nepasikeitė (pvz. re-save) – esama nutrition galioja.
+                unchanged_ids.append(recipe_id)
+                continue
+
+            jobs.append(
+                RecipeNutritionJob(
+                    recipe_id=recipe_id,
+                    status=RecipeNutritionJobStatus.QUEUED,
+                    input_hash=input_hash,
+                )
             )
 
-            if dry_run:
-                created += 1
+        # Pilnai padengti lentelėje receptai skaičiuojami lokaliai, o identiški ingredientų
+        # sąrašai gauna jau turimą rezultatą – abiem atvejais užpildom iškart, be OpenAI.
+        servings_by_id = {recipe_id: servings for recipe_id, servings, *_ in recipes}
+        local = nutrition_calculator.calculate_many(
+            {job.recipe_id: servings_by_id[job.recipe_id] for job in jobs}
+        )
+        reusable = find_reusable_results(
+            job.input_hash for job in jobs if job.recipe_id not in local
+        )
+        now = timezone.now()
+        reused_recipes: list[Recipe] = []
+        for job in jobs:
+            result = local.get(job.recipe_id) or reusable.get(job.input_hash)
+            if result is None:
                 continue
-
-            RecipeNutritionJob.objects.create(
-                recipe_id=recipe.id,
-                status=RecipeNutritionJobStatus.QUEUED,
-                input_hash=input_hash,
+            job.status = RecipeNutritionJobStatus.SUCCEEDED
+            job.result = result
+            job.finished_at = now
+            reused_recipes.append(
+                Recipe(
+                    id=job.recipe_id,
+                    nutrition=scale_nutrition(result, servings_by_id[job.recipe_id]),
+                    nutrition_updated_at=now,
+                    nutrition_input_hash=job.input_hash,
+                    nutrition_dirty=False,
+                )
             )
-            Recipe.objects.filter(pk=recipe.id).update(nutrition_last_enqueued_at=timezone.now())
-            created += 1
+
+        calculated = len(local)
+        reused = len(reused_recipes) - calculated
+        created = len(jobs) - calculated - reused
+        if not dry_run:
+            with transaction.atomic():
+                RecipeNutritionJob.objects.bulk_create(jobs, batch_size=1000)
+                if jobs:
+                    Recipe.objects.filter(id__in=[job.recipe_id for job in jobs]).update(
+                        nutrition_last_enqueued_at=now
+                    )
+                if reused_recipes:
+                    Recipe.objects.bulk_update(
+                        reused_recipes,
+                        [
+                            "nutrition",
+                            "nutrition_updated_at",
+                            "nutrition_input_hash",
+                            "nutrition_dirty",
+                        ],
+                        batch_size=500,
+                    )
+                if unchanged_ids:
+                    Recipe.objects.filter(id__in=unchanged_ids).update(nutrition_dirty=False)
 
         self.stdout.write(
             self.style.SUCCESS(
-                f"Nutrition job'ai: sukurta={created}, praleista_be_ingredientu={skipped_no_ingredients}, kandidatu={len(recipes)}"
+                f"Nutrition job'ai: sukurta={created}, "
+                f"praleista_be_ingredientu={skipped_no_ingredients}, "
+                f"nepasikeite={len(unchanged_ids)}, lokaliai={calculated}, is_cache={reused} "
+                f"(hit_rate={_hit_rate(reused, len(jobs))}), kandidatu={len(recipes)}"
             )
         )
+
+
+def _hit_rate(hits: int, total: int) -> str:
+    return f"{hits / total:.0%}" if total else "-"
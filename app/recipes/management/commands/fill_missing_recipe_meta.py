@@ -5,8 +5,9 @@ from django.core.management.base import BaseCommand
 from django.db.models import Q
 from django.utils import timezone
 
+from recipes import token_budget
 from recipes.models import Recipe
-from recipes.seo_meta_service import generate_meta
+from recipes.seo_meta_service import build_openai_chat_request, generate_meta
 
 
 def _is_blank(value: str | None) -> bool:
@@ -33,6 +34,12 @@ class Command(BaseCommand):
             default="openai",
             help="Meta generavimo tiekėjas. Šiuo metu palaikomas tik openai.",
         )
+        parser.add_argument(
+            "--token-budget",
+            type=int,
+            default=0,
+            help="Maks. įvertintų prompt token'ų per paleidimą (0 – neribota).",
+        )
         parser.add_argument(
             "--dry-run",
             action="store_true",
@@ -44,6 +51,7 @@ class Command(BaseCommand):
         include_drafts: bool = options["include_drafts"]
         provider: str = options["provider"]
         dry_run: bool = options["dry_run"]
+        budget = token_budget.TokenBudget(options["token_budget"] or None)
 
         if provider == "openai" and not getattr(settings, "OPENAI_API_KEY", ""):
             raise RuntimeError("OPENAI_API_KEY nenustatytas")
@@ -82,6 +90,11 @@ class Command(BaseCommand):
             if not (needs_title or needs_desc):
                 continue
 
+            tokens = token_budget.estimate_request_tokens(build_openai_chat_request(recipe=recipe))
+            if not budget.try_spend(tokens):
+                self.stdout.write(f"Token'ų biudžetas išnaudotas (≈{budget.spent}), stabdoma")
+                break
+
             try:
                 generated = generate_meta(recipe)
             except Exception as exc:
@@ -119,6 +132,8 @@ class Command(BaseCommand):
         suffix = " (DRY-RUN)" if dry_run else ""
         self.stdout.write(
             self.style.SUCCESS(
-                f"Recipe meta fill{suffix}: candidates={candidates} updated={updated} title_filled={title_filled} desc_filled={desc_filled} failed={failed}"
+                f"Recipe meta fill{suffix}: candidates={candidates} updated={updated} "
+                f"title_filled={title_filled} desc_filled={desc_filled} failed={failed} "
+                f"tokens≈{budget.spent}"
             )
         )
@@ -0,0 +1,400 @@
+"""Masinis receptų importas iš JSONL.
+
+Kiekviena eilutė – vienas receptas:
+
+    {"title": "Šaltibarščiai", "description": "...", "preparation_time": 15,
+     "cooking_time": 0, "servings": 4, "difficulty": "easy", "published": true,
+     "tags": ["Vasara"], "categories": ["Sriubos"], "cuisines": ["Lietuvių"],
+     "meal_types": [], "cooking_methods": [],
+     "ingredients": [{"name": "Burokėliai", "amount": 500, "unit": "g", "note": "", "group": null}],
+     "steps": [{"title": "", "description": "...", "duration": 5}]}
+
+Eilutė tikrinama ir skaičiai (`servings`, laikai, žingsnių `duration`) konvertuojami
+`_parse` metu – bloga eilutė praleidžiama, importas tęsiamas.
+
+Įrašai apdorojami batch'ais: ingredientai, vienetai, grupės ir taksonomijos
+randamos pagal `casefold()` raktą (indeksas įkeliamas kartą importui – SQLite `LOWER()`
+lietuviškų raidžių neverčia), receptai/žingsniai/ingredientai ir M2M ryšiai kuriami
+`bulk_create`. Signalai per eilutę nevykdomi – batch'o pabaigoje
+visi receptai pažymimi vienu kartu (`change_tracker.mark_many`: outbox + nutrition_dirty).
+
+Naudojimas:
+- python manage.py import_recipes recipes.jsonl
+- python manage.py import_recipes recipes.jsonl --batch-size 500 --publish
+- python manage.py import_recipes recipes.jsonl --dry-run
+"""
+
+from __future__ import annotations
+
+import json
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from recipe_platform import slug_allocator
+from recipes import change_tracker
+from recipes.models import (
+    CookingMethod,
+    Cuisine,
+    Difficulty,
+    Ingredient,
+    IngredientCategory,
+    IngredientGroup,
+    MealType,
+    MeasurementUnit,
+    MeasurementUnitType,
+    Recipe,
+    RecipeCategory,
+    RecipeIngredient,
+    RecipeStep,
+    Tag,
+)
+
+# JSON raktas -> (Recipe M2M laukas, modelis).
+TAXONOMY_FIELDS = {
+    "tags": ("tags", Tag),
+    "categories": ("categories", RecipeCategory),
+    "cuisines": ("cuisines", Cuisine),
+    "meal_types": ("meal_types", MealType),
+    "cooking_methods": ("cooking_methods", CookingMethod),
+}
+
+
+def _allocate_slugs(model: type[models.Model], values: list[str]) -> list[str]:
+    return slug_allocator.allocate_many(model, [slugify(value) or "item" for value in values])
+
+
+def _key(value: Any) -> str:
+    # Python casefold(): SQLite LOWER() lietuviškų raidžių (Š, Ž, ...) nekeičia.
+    return str(value).strip().casefold()
+
+
+def _to_int(value: Any, field: str, default: int, *, minimum: int = 0) -> int:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"netinkamas {field}: {value!r}")
+    try:
+        number = int(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"netinkamas {field}: {value!r}") from None
+    if number < minimum:
+        raise ValueError(f"netinkamas {field}: {value!r}")
+    return number
+
+
+def _list_of(record: dict[str, Any], key: str, item_type: type | tuple[type, ...]) -> list:
+    value = record.get(key) or []
+    if not isinstance(value, list) or not all(isinstance(item, item_type) for item in value):
+        raise ValueError(f"{key} turi būti sąrašas")
+    return value
+
+
+def _guess_unit_type(short_name: str) -> str:
+    s = (short_name or "").strip().lower()
+    if s in {"g", "kg"}:
+        return MeasurementUnitType.WEIGHT
+    if s in {"ml", "l"}:
+        return MeasurementUnitType.VOLUME
+    return MeasurementUnitType.COUNT
+
+
+def _to_decimal_amount(value) -> Decimal:
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, ValueError, TypeError):
+        return Decimal("1.00")
+    if amount.is_nan() or amount <= 0:
+        return Decimal("1.00")
+    return amount.quantize(Decimal("0.01"))
+
+
+class Command(BaseCommand):
+    help = "Importuoja receptus iš JSONL failo (batch'ais, bulk_create, be signalų per eilutę)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str)
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--publish",
+            action="store_true",
+            help="Publikuoti visus importuotus receptus (kitaip – pagal `published` lauką).",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"Failas nerastas: {path}")
+        batch_size: int = max(options["batch_size"], 1)
+        self.publish_all: bool = options["publish"]
+        dry_run: bool = options["dry_run"]
+        # (modelis, laukas) -> {casefold pavadinimas: id}; kraunama kartą visam importui.
+        self._indexes: dict[tuple[type[models.Model], str], dict[str, int]] = {}
+
+        imported = 0
+        skipped = 0
+        batch: list[dict[str, Any]] = []
+        with path.open(encoding="utf-8") as fh:
+            for line_no, line in enumerate(fh, start=1):
+                if not line.strip():
+                    continue
+                record = self._parse(line, line_no)
+                if record is None:
+                    skipped += 1
+                    continue
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    imported += self._import_batch(batch, dry_run=dry_run)
+                    batch = []
+        if batch:
+            imported += self._import_batch(batch, dry_run=dry_run)
+
+        suffix = " (DRY-RUN)" if dry_run else ""
+        self.stdout.write(
+            self.style.SUCCESS(f"Recipe import{suffix}: imported={imported} skipped={skipped}")
+        )
+
+    def _parse(self, line: str, line_no: int) -> dict[str, Any] | None:
+        """Validuoja ir normalizuoja eilutę – blogi skaičiai neturi nutraukti viso batch'o."""
+
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("eilutė nėra JSON objektas")
+            if not str(record.get("title") or "").strip():
+                raise ValueError("trūksta title")
+            record["preparation_time"] = _to_int(
+                record.get("preparation_time"), "preparation_time", 0
+            )
+            record["cooking_time"] = _to_int(record.get("cooking_time"), "cooking_time", 0)
+            record["servings"] = _to_int(record.get("servings"), "servings", 1, minimum=1)
+            for step in _list_of(record, "steps", dict):
+                step["duration"] = (
+                    _to_int(step["duration"], "steps.duration", 0)
+                    if step.get("duration") is not None
+                    else None
+                )
+            _list_of(record, "ingredients", dict)
+            for key in TAXONOMY_FIELDS:
+                _list_of(record, key, (str, int))
+        except ValueError as exc:
+            self.stderr.write(f"Eilutė {line_no} praleista: {exc}")
+            return None
+        return record
+
+    def _import_batch(self, records: list[dict[str, Any]], *, dry_run: bool) -> int:
+        if dry_run:
+            return len(records)
+
+        with transaction.atomic(), change_tracker.deferred():
+            ingredient_ids = self._resolve_ingredients(records)
+            unit_ids = self._resolve_units(records)
+            group_ids = self._resolve_groups(records)
+            taxonomy_ids = {
+                key: self._resolve_named(model, records, key)
+                for key, (_field, model) in TAXONOMY_FIELDS.items()
+            }
+
+            now = timezone.now()
+            titles = [str(record["title"]).strip() for record in records]
+            slugs = _allocate_slugs(Recipe, titles)
+            valid_difficulties = set(Difficulty.values)
+            recipes = []
+            for record, title, slug in zip(records, titles, slugs, strict=True):
+                difficulty = str(record.get("difficulty") or "").strip().lower()
+                published = self.publish_all or bool(record.get("published"))
+                recipes.append(
+                    Recipe(
+                        title=title,
+                        slug=slug,
+                        meta_title=(record.get("meta_title") or title)[:80],
+                        meta_description=(record.get("meta_description") or "")[:160],
+                        description=record.get("description") or "",
+                        note=record.get("note") or "",
+                        is_generated=bool(record.get("is_generated")),
+                        preparation_time=record["preparation_time"],
+                        cooking_time=record["cooking_time"],
+                        servings=record["servings"],
+                        difficulty=(
+                            difficulty if difficulty in valid_difficulties else Difficulty.MEDIUM
+                        ),
+                        video_url=record.get("video_url") or "",
+                        published_at=now if published else None,
+                    )
+                )
+            # PostgreSQL/SQLite grąžina ID po bulk_create.
+            recipes = Recipe.objects.bulk_create(recipes)
+
+            steps = []
+            recipe_ingredients = []
+            through_rows: dict[str, list[models.Model]] = {key: [] for key in TAXONOMY_FIELDS}
+            for recipe, record in zip(recipes, records, strict=True):
+                for order, step in enumerate(record.get("steps") or [], start=1):
+                    steps.append(
+                        RecipeStep(
+                            recipe_id=recipe.id,
+                            order=order,
+                            title=(step.get("title") or "").strip()[:255],
+                            description=(step.get("description") or "").strip(),
+                            note=(step.get("note") or "").strip(),
+                            duration=step["duration"],
+                        )
+                    )
+
+                merged: dict[tuple, dict[str, Any]] = {}
+                for item in record.get("ingredients") or []:
+                    name = (item.get("name") or "").strip()
+                    if not name:
+                        continue
+                    key = (
+                        ingredient_ids[_key(name)],
+                        unit_ids[_key(item.get("unit") or "vnt")],
+                        group_ids.get((item.get("group") or "").strip()),
+                    )
+                    amount = _to_decimal_amount(item.get("amount", 1))
+                    note = (item.get("note") or "").strip()
+                    if key in merged:
+                        merged[key]["amount"] += amount
+                        if note and note not in merged[key]["note"]:
+                            merged[key]["note"] = (merged[key]["note"] + "; " + note).strip("; ")
+                    else:
+                        merged[key] = {"amount": amount, "note": note}
+                for (ingredient_id, unit_id, group_id), data in merged.items():
+                    recipe_ingredients.append(
+                        RecipeIngredient(
+                            recipe_id=recipe.id,
+                            ingredient_id=ingredient_id,
+                            unit_id=unit_id,
+                            group_id=group_id,
+                            amount=data["amount"],
+                            note=data["note"][:255],
+                        )
+                    )
+
+                for key, (field, _model) in TAXONOMY_FIELDS.items():
+                    descriptor = getattr(Recipe, field)
+                    target_column = f"{descriptor.field.m2m_reverse_field_name()}_id"
+                    target_ids = {
+                        taxonomy_ids[key][_key(name)]
+                        for name in record.get(key) or []
+                        if str(name).strip()
+                    }
+                    through_rows[key].extend(
+                        descriptor.through(recipe_id=recipe.id, **{target_column: target_id})
+                        for target_id in target_ids
+                    )
+
+            RecipeStep.objects.bulk_create(steps, batch_size=1000)
+            RecipeIngredient.objects.bulk_create(recipe_ingredients, batch_size=1000)
+            for key, (field, _model) in TAXONOMY_FIELDS.items():
+                getattr(Recipe, field).through.objects.bulk_create(
+                    through_rows[key], batch_size=1000
+                )
+
+            # Vienas batch'inis reindex + nutrition_dirty visiems importuotiems receptams.
+            change_tracker.mark_many(
+                [recipe.id for recipe in recipes],
+                change_tracker.CONTENT,
+                change_tracker.INGREDIENTS,
+                change_tracker.TAXONOMY,
+                change_tracker.PUBLISH,
+            )
+        return len(recipes)
+
+    def _index(self, model: type[models.Model], field: str) -> dict[str, int]:
+        """Esami įrašai pagal `_key(field)` (pirmas pagal id); kraunama kartą importui."""
+
+        key = (model, field)
+        if key not in self._indexes:
+            index: dict[str, int] = {}
+            for value, object_id in (
+                model.objects.order_by("id").values_list(field, "id").iterator()
+            ):
+                index.setdefault(_key(value), object_id)
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def _resolve_ingredients(self, records: list[dict[str, Any]]) -> dict[str, int]:
+        names: dict[str, str] = {}
+        for record in records:
+            for item in record.get("ingredients") or []:
+                name = (item.get("name") or "").strip()
+                if name:
+                    names.setdefault(_key(name), name)
+        if not names:
+            return {}
+
+        resolved = self._index(Ingredient, "name")
+        missing = [name for key, name in names.items() if key not in resolved]
+        if missing:
+            category = IngredientCategory.objects.order_by("id").first()
+            if category is None:
+                category = IngredientCategory.objects.create(name="Kita")
+            created = Ingredient.objects.bulk_create(
+                Ingredient(name=name, slug=slug, category=category)
+                for name, slug in zip(missing, _allocate_slugs(Ingredient, missing), strict=True)
+            )
+            resolved.update({_key(ingredient.name): ingredient.id for ingredient in created})
+        return resolved
+
+    def _resolve_units(self, records: list[dict[str, Any]]) -> dict[str, int]:
+        shorts: dict[str, str] = {}
+        for record in records:
+            for item in record.get("ingredients") or []:
+                short = (item.get("unit") or "vnt").strip()
+                shorts.setdefault(_key(short), short)
+
+        resolved = self._index(MeasurementUnit, "short_name")
+        missing = [short for key, short in shorts.items() if key not in resolved]
+        if missing:
+            created = MeasurementUnit.objects.bulk_create(
+                MeasurementUnit(name=short, short_name=short, unit_type=_guess_unit_type(short))
+                for short in missing
+            )
+            resolved.update({_key(unit.short_name): unit.id for unit in created})
+        return resolved
+
+    def _resolve_groups(self, records: list[dict[str, Any]]) -> dict[str, int]:
+        names = {
+            (item.get("group") or "").strip()
+            for record in records
+            for item in record.get("ingredients") or []
+        } - {""}
+        if not names:
+            return {}
+        resolved = dict(IngredientGroup.objects.filter(name__in=names).values_list("name", "id"))
+        missing = [name for name in names if name not in resolved]
+        if missing:
+            created = IngredientGroup.objects.bulk_create(
+                IngredientGroup(name=name) for name in missing
+            )
+            resolved.update({group.name: group.id for group in created})
+        return resolved
+
+    def _resolve_named(self, model, records: list[dict[str, Any]], key: str) -> dict[str, int]:
+        """Taksonomijos pagal pavadinimą (case-insensitive); trūkstamos sukuriamos."""
+
+        names: dict[str, str] = {}
+        for record in records:
+            for name in record.get(key) or []:
+                cleaned = str(name).strip()
+                if cleaned:
+                    names.setdefault(_key(cleaned), cleaned)
+        if not names:
+            return {}
+
+        resolved = self._index(model, "name")
+        missing = [name for k, name in names.items() if k not in resolved]
+        if missing:
+            created = model.objects.bulk_create(
+                model(name=name, slug=slug)
+                for name, slug in zip(missing, _allocate_slugs(model, missing), strict=True)
+            )
+            resolved.update({_key(obj.name): obj.id for obj in created})
+        return resolved
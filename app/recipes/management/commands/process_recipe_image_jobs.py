@@ -1,18 +1,18 @@
 from __future__ import annotations
 
-import os
-
 from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from django.utils import timezone
 
+from recipe_platform import jobqueue
 from recipes.image_service import build_recipe_image_prompt, generate_recipe_image
-from recipes.models import RecipeImageJob, RecipeImageJobStatus
+from recipes.models import Recipe, RecipeImageJob
 
 
 class Command(BaseCommand):
-    help = "Apdoroja queued RecipeImageJob įrašus ir prisega sugeneruotą paveikslą prie Recipe.image." 
+    help = (
+        "Apdoroja queued RecipeImageJob įrašus ir prisega sugeneruotą paveikslą prie Recipe.image."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("--limit", type=int, default=10)
@@ -20,88 +20,64 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         limit: int = options["limit"]
 
+        queue = jobqueue.get_queue("image")
+        released, dead = jobqueue.reap_expired(queue)
+        if released or dead:
+            self.stdout.write(f"Pasibaigęs lease: grąžinta į eilę={released} dead={dead}")
+
+        # Claim'as ribojamas eilės concurrency (JOB_QUEUES["image"]).
+        token, jobs = jobqueue.claim(queue, limit, select_related=("recipe",))
+        heartbeat = jobqueue.Heartbeat(queue, token)
+
         processed = 0
         succeeded = 0
+        retried = 0
         failed = 0
-
-        while processed < limit:
-            with transaction.atomic():
-                job = (
-                    RecipeImageJob.objects.select_for_update(skip_locked=True)
-                    .select_related("recipe")
-                    .filter(status=RecipeImageJobStatus.QUEUED)
-                    .order_by("created_at")
-                    .first()
-                )
-
-                if not job:
-                    break
-
-                # Idempotency / fast path
-                if getattr(job.recipe, "image", None):
-                    job.status = RecipeImageJobStatus.SUCCEEDED
-                    job.error = ""
-                    job.finished_at = timezone.now()
-                    job.save(update_fields=["status", "error", "finished_at", "updated_at"])
-                    processed += 1
-                    succeeded += 1
-                    continue
-
-                job.status = RecipeImageJobStatus.RUNNING
-                job.started_at = timezone.now()
-                if not (job.prompt or "").strip():
-                    job.prompt = build_recipe_image_prompt(recipe=job.recipe)
-                job.error = ""
-                job.save(update_fields=["status", "started_at", "prompt", "error", "updated_at"])
-
-            # Do the expensive part outside the lock.
-            try:
-                gen = generate_recipe_image(prompt=job.prompt)
-                filename_slug = getattr(job.recipe, "slug", "recipe") or "recipe"
-                filename = f"{filename_slug}-ai.png"
-
-                content = ContentFile(gen.content)
-                content.name = filename
-
-                # Save image to recipe
-                with transaction.atomic():
-                    locked = RecipeImageJob.objects.select_for_update().select_related("recipe").get(pk=job.pk)
-                    if locked.status != RecipeImageJobStatus.RUNNING:
-                        # Someone else handled it.
-                        processed += 1
-                        continue
-
-                    if getattr(locked.recipe, "image", None):
-                        locked.status = RecipeImageJobStatus.SUCCEEDED
-                        locked.error = ""
-                        locked.finished_at = timezone.now()
-                        locked.save(update_fields=["status", "error", "finished_at", "updated_at"])
-                        processed += 1
-                        succeeded += 1
-                        continue
-
-                    locked.recipe.image.save(content.name, content, save=True)
-
-                    locked.status = RecipeImageJobStatus.SUCCEEDED
-                    locked.error = ""
-                    locked.finished_at = timezone.now()
-                    locked.save(update_fields=["status", "error", "finished_at", "updated_at"])
-
+        try:
+            for job in jobs:
                 processed += 1
-                succeeded += 1
-            except Exception as exc:
-                with transaction.atomic():
-                    locked = RecipeImageJob.objects.select_for_update().get(pk=job.pk)
-                    locked.status = RecipeImageJobStatus.FAILED
-                    locked.error = str(exc)[:4000]
-                    locked.finished_at = timezone.now()
-                    locked.save(update_fields=["status", "error", "finished_at", "updated_at"])
-
-                processed += 1
-                failed += 1
+                try:
+                    if self._process_one(queue, token, job):
+                        succeeded += 1
+                except Exception as exc:
+                    retry_ids, _terminal = jobqueue.fail(
+                        queue, jobqueue.leased(queue, token), {job.id: str(exc)[:4000]}
+                    )
+                    if retry_ids:
+                        retried += 1
+                    else:
+                        failed += 1
+                heartbeat()
+        finally:
+            jobqueue.release(queue, token)
 
         self.stdout.write(
             self.style.SUCCESS(
-                f"Image worker: processed={processed} succeeded={succeeded} failed={failed}"
+                f"Image worker: processed={processed} succeeded={succeeded} "
+                f"retried={retried} failed={failed}"
             )
         )
+
+    def _process_one(self, queue: jobqueue.Queue, token: str, job: RecipeImageJob) -> bool:
+        # Idempotency / fast path
+        if getattr(job.recipe, "image", None):
+            return jobqueue.complete(queue, token, job.id)
+
+        if not (job.prompt or "").strip():
+            job.prompt = build_recipe_image_prompt(recipe=job.recipe)
+            jobqueue.leased(queue, token).filter(id=job.id).update(prompt=job.prompt)
+
+        # Do the expensive part outside the lock.
+        gen = generate_recipe_image(prompt=job.prompt)
+        filename_slug = getattr(job.recipe, "slug", "recipe") or "recipe"
+        content = ContentFile(gen.content)
+        content.name = f"{filename_slug}-ai.png"
+
+        with transaction.atomic():
+            if not jobqueue.leased(queue, token).select_for_update().filter(id=job.id).exists():
+                # Lease nebegalioja – job'ą perėmė kitas worker'is.
+                return False
+            recipe = Recipe.objects.select_for_update().get(pk=job.recipe_id)
+            if not getattr(recipe, "image", None):
+                recipe.image.save(content.name, content, save=True)
+            return jobqueue.complete(queue, token, job.id)
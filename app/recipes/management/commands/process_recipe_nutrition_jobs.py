@@ -1,11 +1,25 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from django.utils import timezone
+from openai import OpenAI
+
+from recipe_platform import jobqueue
+from recipes import nutrition_calculator, nutrition_jobs
+from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
+from recipes.nutrition_jobs import JobInfo
+from recipes.nutrition_service import (
+    build_openai_chat_request,
+    compute_current_input_hashes,
+    find_reusable_results,
+    request_nutrition,
+)
+from recipes.token_budget import RateLimiter
 
-from recipes.models import Recipe, RecipeNutritionJob, RecipeNutritionJobStatus
-from recipes.nutrition_service import compute_current_input_hash, generate_nutrition
+STALE_ERROR = "stale_job: recipe pasikeitė po enqueue"
 
 
 class Command(BaseCommand):
@@ -13,6 +27,24 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=getattr(settings, "OPENAI_NUTRITION_CONCURRENCY", 4),
+            help="Kiek OpenAI užklausų vykdyti lygiagrečiai.",
+        )
+        parser.add_argument(
+            "--rpm",
+            type=int,
+            default=getattr(settings, "OPENAI_NUTRITION_RPM", 0),
+            help="Maks. OpenAI request'ų per minutę (0 – neribota).",
+        )
+        parser.add_argument(
+            "--write-batch",
+            type=int,
+            default=20,
+            help="Po kiek rezultatų įrašyti į DB viena transakcija.",
+        )
         parser.add_argument(
             "--dry-run",
             action="store_true",
@@ -23,78 +55,130 @@ class Command(BaseCommand):
         limit: int = options["limit"]
         dry_run: bool = options["dry_run"]
 
-        processed = 0
-        succeeded = 0
-        failed = 0
-        stale = 0
-
-        for _ in range(limit):
-            with transaction.atomic():
-                job = (
-                    RecipeNutritionJob.objects.select_for_update(skip_locked=True)
-                    .select_related("recipe")
-                    .filter(status=RecipeNutritionJobStatus.QUEUED)
-                    .order_by("created_at")
-                    .first()
-                )
-
-                if not job:
-                    break
-
-                recipe: Recipe = job.recipe
-                current_hash = compute_current_input_hash(recipe)
-                if current_hash != job.input_hash:
-                    processed += 1
-                    stale += 1
-                    if not dry_run:
-                        job.status = RecipeNutritionJobStatus.FAILED
-                        job.error = "stale_job: recipe pasikeitė po enqueue"
-                        job.finished_at = timezone.now()
-                        job.save(update_fields=["status", "error", "finished_at", "updated_at"])
-                        Recipe.objects.filter(pk=recipe.pk).update(nutrition_dirty=True)
-                    continue
-
-                processed += 1
-                if dry_run:
-                    self.stdout.write(f"DRY-RUN: apdorotų job_id={job.id} recipe_id={recipe.id}")
-                    continue
-
-                job.status = RecipeNutritionJobStatus.RUNNING
-                job.started_at = timezone.now()
-                job.save(update_fields=["status", "started_at", "updated_at"])
-
-            # OpenAI call outside the transaction to avoid holding DB locks.
-            try:
-                nutrition = generate_nutrition(recipe)
-            except Exception as exc:
-                with transaction.atomic():
-                    job = RecipeNutritionJob.objects.select_for_update().get(pk=job.pk)
-                    job.status = RecipeNutritionJobStatus.FAILED
-                    job.error = str(exc)
-                    job.finished_at = timezone.now()
-                    job.save(update_fields=["status", "error", "finished_at", "updated_at"])
-                failed += 1
-                continue
-
-            with transaction.atomic():
-                job = RecipeNutritionJob.objects.select_for_update().get(pk=job.pk)
-                job.status = RecipeNutritionJobStatus.SUCCEEDED
-                job.result = nutrition
-                job.error = ""
-                job.finished_at = timezone.now()
-                job.save(update_fields=["status", "result", "error", "finished_at", "updated_at"])
-
-                Recipe.objects.filter(pk=recipe.pk).update(
-                    nutrition=nutrition,
-                    nutrition_updated_at=timezone.now(),
-                    nutrition_input_hash=job.input_hash,
-                    nutrition_dirty=False,
-                )
-
-            succeeded += 1
-
+        if dry_run:
+            self._dry_run(limit)
+            return
+
+        queue = nutrition_jobs.nutrition_queue()
+        released, dead = jobqueue.reap_expired(queue)
+        if released or dead:
+            self.stdout.write(f"Pasibaigęs lease: grąžinta į eilę={released} dead={dead}")
+
+        token, jobs = jobqueue.claim(queue, limit, select_related=("recipe",))
+        self.pending = jobqueue.leased(queue, token)
+        self.heartbeat = jobqueue.Heartbeat(queue, token)
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        stale = local = reused = 0
+        try:
+            current = compute_current_input_hashes({job.recipe_id for job in jobs})
+            stale_jobs = [job for job in jobs if current[job.recipe_id] != job.input_hash]
+            if stale_jobs:
+                self._write(jobs, {}, {job.id: STALE_ERROR for job in stale_jobs}, retry=False)
+                stale = len(stale_jobs)
+            jobs = [job for job in jobs if current[job.recipe_id] == job.input_hash]
+
+            # Visi ingredientai turi maistinės vertės duomenis – LLM nereikia.
+            calculated = nutrition_calculator.calculate_many(
+                {job.recipe_id: job.recipe.servings for job in jobs}
+            )
+            # Tas pats ingredientų sąrašas jau apskaičiuotas – OpenAI nekviečiam.
+            cached = find_reusable_results(
+                {job.input_hash for job in jobs if job.recipe_id not in calculated}
+            )
+            ready: dict[int, dict[str, Any]] = {}
+            remote = []
+            for job in jobs:
+                if job.recipe_id in calculated:
+                    ready[job.id] = calculated[job.recipe_id]
+                    local += 1
+                elif job.input_hash in cached:
+                    ready[job.id] = cached[job.input_hash]
+                    reused += 1
+                else:
+                    remote.append(job)
+            self._write(jobs, ready, {})
+
+            if remote:
+                self._run_remote(remote, options)
+        finally:
+            # Nutrauktas paleidimas: neapdoroti job'ai grįžta į eilę.
+            jobqueue.release(queue, token)
+
+        processed = len(jobs) + stale
+        hit_rate = f"{reused / processed:.0%}" if processed else "-"
         self.stdout.write(
             self.style.SUCCESS(
-                f"Nutrition jobs: processed={processed} succeeded={succeeded} failed={failed} stale={stale}"
+                f"Nutrition jobs: processed={processed} succeeded={self.succeeded} "
+                f"retried={self.retried} failed={self.failed} stale={stale} "
+                f"local={local} reused={reused} "
+                f"hit_rate={hit_rate}"
             )
         )
+
+    def _run_remote(self, jobs: list[RecipeNutritionJob], options) -> None:
+        """OpenAI užklausos gijose (be DB), rezultatai įrašomi nedideliais bulk UPDATE'ais."""
+
+        if not getattr(settings, "OPENAI_API_KEY", ""):
+            raise RuntimeError("OPENAI_API_KEY nenustatytas")
+
+        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        limiter = RateLimiter(options["rpm"])
+        write_batch = max(1, options["write_batch"])
+        # Request'ai paruošiami pagrindinėje gijoje – gijos DB nenaudoja.
+        requests = {job.id: build_openai_chat_request(recipe=job.recipe) for job in jobs}
+
+        def call(job: RecipeNutritionJob) -> dict[str, Any]:
+            limiter.acquire()
+            return request_nutrition(requests[job.id], servings=job.recipe.servings, client=client)
+
+        results: dict[int, dict[str, Any]] = {}
+        errors: dict[int, str] = {}
+        with ThreadPoolExecutor(max_workers=max(1, options["concurrency"])) as pool:
+            futures = {pool.submit(call, job): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    results[job.id] = future.result()
+                except Exception as exc:
+                    errors[job.id] = str(exc)
+                if len(results) + len(errors) >= write_batch:
+                    self._write(jobs, results, errors)
+                    results, errors = {}, {}
+                self.heartbeat()
+        self._write(jobs, results, errors)
+
+    def _write(
+        self, jobs, results: dict[int, dict], errors: dict[int, str], *, retry: bool = True
+    ) -> None:
+        if not results and not errors:
+            return
+        info = {job.id: JobInfo(job.recipe_id, job.input_hash, job.recipe.servings) for job in jobs}
+        succeeded, retried, failed = nutrition_jobs.write_results(
+            self.pending, info, results, errors, retry=retry
+        )
+        self.succeeded += succeeded
+        self.retried += retried
+        self.failed += failed
+
+    def _dry_run(self, limit: int) -> None:
+        jobs = list(
+            RecipeNutritionJob.objects.select_related("recipe")
+            .filter(status=RecipeNutritionJobStatus.QUEUED)
+            .order_by("created_at")[:limit]
+        )
+        calculated = nutrition_calculator.calculate_many(
+            {job.recipe_id: job.recipe.servings for job in jobs}
+        )
+        cached = find_reusable_results({job.input_hash for job in jobs})
+        for job in jobs:
+            source = (
+                " (lokaliai)"
+                if job.recipe_id in calculated
+                else " (iš cache)" if job.input_hash in cached else ""
+            )
+            self.stdout.write(
+                f"DRY-RUN: apdorotų job_id={job.id} recipe_id={job.recipe_id}{source}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"DRY-RUN: queued job'ų: {len(jobs)}"))
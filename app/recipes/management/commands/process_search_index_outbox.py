@@ -0,0 +1,136 @@
+"""Upstash Search outbox worker'is.
+
+Naudojimas:
+- python manage.py process_search_index_outbox
+- python manage.py process_search_index_outbox --batch-size 200 --max-batches 10
+- python manage.py process_search_index_outbox --retry-failed
+"""
+
+from __future__ import annotations
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import SearchIndexOutbox
+from recipes.upstash_search import _get_index, outbox_stats, sync_recipes
+
+
+def _backoff_seconds(attempts: int, *, base: int, cap: int) -> int:
+    return min(base * (2 ** max(attempts - 1, 0)), cap)
+
+
+class Command(BaseCommand):
+    help = "Sinchronizuoja SearchIndexOutbox operacijas su Upstash Search (batch'ais, su retry)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=50,
+            help="Kiek batch'ų apdoroti per vieną paleidimą (0 – kol eilė tuščia).",
+        )
+        parser.add_argument("--max-attempts", type=int, default=8)
+        parser.add_argument("--backoff-base", type=int, default=30, help="Sekundės.")
+        parser.add_argument("--backoff-cap", type=int, default=3600, help="Sekundės.")
+        parser.add_argument(
+            "--lease",
+            type=int,
+            default=300,
+            help="Sekundės: kiek paimtas batch'as nematomas kitiems worker'iams "
+            "(nukritus worker'iui – grįžta į eilę).",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Grąžinti į eilę operacijas, kurios viršijo --max-attempts.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size: int = options["batch_size"]
+        max_batches: int = options["max_batches"]
+        max_attempts: int = options["max_attempts"]
+        backoff_base: int = options["backoff_base"]
+        backoff_cap: int = options["backoff_cap"]
+        lease = timedelta(seconds=options["lease"])
+
+        if _get_index() is None:
+            self.stdout.write("Upstash Search išjungtas arba nesukonfigūruotas – nieko nedarom")
+            return
+
+        if options["retry_failed"]:
+            requeued = SearchIndexOutbox.objects.filter(failed_at__isnull=False).update(
+                failed_at=None, attempts=0, available_at=timezone.now()
+            )
+            self.stdout.write(f"Grąžinta į eilę: {requeued}")
+
+        batches = 0
+        synced_ops = 0
+        upserted = 0
+        deleted = 0
+        skipped = 0
+        failed_ops = 0
+
+        while not max_batches or batches < max_batches:
+            rows = self._claim(batch_size, lease)
+            if not rows:
+                break
+            batches += 1
+
+            # Upstash kviečiamas be transakcijos ir row lock'ų – lėtas upstream jų nelaiko.
+            try:
+                # Kelios operacijos tam pačiam receptui suliejamos – sinchronizuojam
+                # pagal dabartinę DB būseną, todėl svarbu tik recipe_id.
+                result = sync_recipes([row.recipe_id for row in rows])
+            except Exception as exc:
+                failed_ops += len(rows)
+                now = timezone.now()
+                for row in rows:
+                    row.attempts += 1
+                    row.last_error = str(exc)[:4000]
+                    delay = _backoff_seconds(row.attempts, base=backoff_base, cap=backoff_cap)
+                    row.available_at = now + timedelta(seconds=delay)
+                    if row.attempts >= max_attempts:
+                        row.failed_at = now
+                SearchIndexOutbox.objects.bulk_update(
+                    rows, ["attempts", "last_error", "available_at", "failed_at"]
+                )
+                self.stderr.write(f"outbox_batch_failed rows={len(rows)} error={exc}")
+                # Dažniausiai tai Upstash sutrikimas – nebandom likusių batch'ų šiame run'e.
+                break
+
+            # Outbox tik INSERT'inamas: sinchronizavimo metu atsiradę nauji pakeitimai yra
+            # naujos eilutės, todėl trinamos tik šio batch'o eilutės.
+            SearchIndexOutbox.objects.filter(id__in=[row.id for row in rows]).delete()
+            synced_ops += len(rows)
+            upserted += result.upserted
+            deleted += result.deleted
+            skipped += result.skipped
+
+        stats = outbox_stats()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Search outbox: batches={batches} synced_ops={synced_ops} upserted={upserted} "
+                f"deleted={deleted} skipped={skipped} failed_ops={failed_ops} "
+                f"pending={stats['pending']} dead={stats['dead']} lag={stats['lag_seconds']:.0f}s"
+            )
+        )
+
+    def _claim(self, batch_size: int, lease: timedelta) -> list[SearchIndexOutbox]:
+        """Trumpa transakcija: paima batch'ą ir atideda jo `available_at` lease trukmei."""
+
+        now = timezone.now()
+        with transaction.atomic():
+            rows = list(
+                SearchIndexOutbox.objects.select_for_update(skip_locked=True)
+                .filter(failed_at__isnull=True, available_at__lte=now)
+                .order_by("id")[:batch_size]
+            )
+            if rows:
+                SearchIndexOutbox.objects.filter(id__in=[row.id for row in rows]).update(
+                    available_at=now + lease
+                )
+        return rows
@@ -13,6 +13,15 @@ class Command(BaseCommand):
             action="store_true",
             help="Įtraukti nepublikuotus receptus (perduodama fill komandai).",
         )
+        parser.add_argument(
+            "--token-budget",
+            type=int,
+            default=0,
+            help=(
+                "Maks. įvertintų prompt token'ų per naktį "
+                "(0 – neribota; perduodama fill komandai)."
+            ),
+        )
         parser.add_argument(
             "--dry-run",
             action="store_true",
@@ -29,6 +38,7 @@ class Command(BaseCommand):
             "fill_missing_recipe_meta",
             limit=limit,
             include_drafts=include_drafts,
+            token_budget=options["token_budget"],
             dry_run=dry_run,
         )
 
@@ -21,6 +21,12 @@ class Command(BaseCommand):
             action="store_true",
             help="Kurti job'us net jei nutrition_dirty=false (perduodama enqueue komandai).",
         )
+        parser.add_argument(
+            "--fill-quota",
+            action="store_true",
+            help="Pateikti tiek job'ų, kiek leidžia likusi OPENAI_BATCH_TOKEN_QUOTA "
+            "(perduodama submit komandai; --limit tada riboja tik enqueue).",
+        )
         parser.add_argument(
             "--completion-window",
             type=str,
@@ -37,6 +43,7 @@ class Command(BaseCommand):
         limit: int = options["limit"]
         include_drafts: bool = options["include_drafts"]
         force: bool = options["force"]
+        fill_quota: bool = options["fill_quota"]
         completion_window: str = options["completion_window"]
         dry_run: bool = options["dry_run"]
 
@@ -53,6 +60,7 @@ class Command(BaseCommand):
         call_command(
             "submit_recipe_nutrition_batch",
             limit=limit,
+            fill_quota=fill_quota,
             completion_window=completion_window,
             dry_run=dry_run,
         )
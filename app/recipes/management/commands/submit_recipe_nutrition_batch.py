@@ -1,17 +1,18 @@
 from __future__ import annotations
 
-import io
-import json
-from datetime import timedelta
+from typing import Iterator
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from django.utils import timezone
 from openai import OpenAI
 
+from recipes import nutrition_calculator, nutrition_jobs, token_budget
 from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
-from recipes.nutrition_service import build_openai_chat_request
+from recipes.nutrition_service import complete_job
+
+# Kiek job'ų užsiimti vienu kartu, kai pateikiama pagal token'ų kvotą.
+CLAIM_PAGE_SIZE = 500
 
 
 class Command(BaseCommand):
@@ -19,6 +20,12 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--limit", type=int, default=200)
+        parser.add_argument(
+            "--fill-quota",
+            action="store_true",
+            help="Ignoruoti --limit ir pateikti tiek job'ų, kiek leidžia likusi "
+            "OPENAI_BATCH_TOKEN_QUOTA.",
+        )
         parser.add_argument(
             "--completion-window",
             type=str,
@@ -35,67 +42,101 @@ class Command(BaseCommand):
         if not getattr(settings, "OPENAI_API_KEY", ""):
             raise RuntimeError("OPENAI_API_KEY nenustatytas")
 
-        limit: int = options["limit"]
+        limit: int | None = None if options["fill_quota"] else options["limit"]
         completion_window: str = options["completion_window"]
         dry_run: bool = options["dry_run"]
 
-        # Paimam queued job'us, kurie dar nėra priskirti batch'ui.
-        jobs = list(
-            RecipeNutritionJob.objects.select_related("recipe")
-            .filter(status=RecipeNutritionJobStatus.QUEUED)
-            .order_by("created_at")[:limit]
-        )
+        released, dead = (0, 0) if dry_run else nutrition_jobs.release_stale_submitting()
+        if released or dead:
+            self.stdout.write(f"Pakibę SUBMITTING job'ai: grąžinta į eilę={released} dead={dead}")
 
-        if not jobs:
-            self.stdout.write("Nėra queued job'ų")
+        available = token_budget.available_batch_tokens()
+        in_flight = token_budget.enqueued_batch_tokens()
+        self.stdout.write(
+            f"Token'ai: pateikta_neapdorota={in_flight} "
+            f"laisva={'neribota' if available is None else available}"
+        )
+        if available == 0:
+            self.stdout.write(
+                "Token'ų kvota išnaudota – laukiam, kol bus apdoroti ankstesni batch'ai"
+            )
             return
 
         if dry_run:
-            self.stdout.write(self.style.SUCCESS(f"DRY-RUN: pateiktų job'ų: {len(jobs)}"))
-            return
-
-        # Build JSONL content: each line is a single request.
-        lines: list[str] = []
-        for job in jobs:
-            body = build_openai_chat_request(recipe=job.recipe)
-            lines.append(
-                json.dumps(
-                    {
-                        "custom_id": f"nutrition_job:{job.id}",
-                        "method": "POST",
-                        "url": "/v1/chat/completions",
-                        "body": body,
-                    },
-                    ensure_ascii=False,
+            queued = RecipeNutritionJob.objects.filter(status=RecipeNutritionJobStatus.QUEUED)
+            count = queued.count()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"DRY-RUN: queued={count}, pateiktų iki "
+                    f"{count if limit is None else min(count, limit)} "
+                    "(pagal kvotą gali būti mažiau)"
                 )
             )
+            return
 
-        jsonl_bytes = ("\n".join(lines) + "\n").encode("utf-8")
-        file_obj = io.BytesIO(jsonl_bytes)
-        file_obj.name = "recipe_nutrition_batch.jsonl"  # required by SDK for multipart
-
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
-        uploaded = client.files.create(file=file_obj, purpose="batch")
-        batch = client.batches.create(
-            input_file_id=uploaded.id,
-            endpoint="/v1/chat/completions",
-            completion_window=completion_window,
-        )
-
-        submitted_at = timezone.now()
-        with transaction.atomic():
-            RecipeNutritionJob.objects.filter(id__in=[j.id for j in jobs]).update(
-                status=RecipeNutritionJobStatus.SUBMITTED,
-                openai_batch_id=batch.id,
-                openai_batch_submitted_at=submitted_at,
+        budget = token_budget.TokenBudget(available)
+        token = nutrition_jobs.new_claim_token()
+        self.local = 0
+        submitted = 0
+        try:
+            client = OpenAI(api_key=settings.OPENAI_API_KEY)
+            shards = nutrition_jobs.iter_shards(
+                self._claimed_jobs(token, limit),
+                max_requests=settings.OPENAI_BATCH_MAX_REQUESTS,
+                max_bytes=settings.OPENAI_BATCH_MAX_BYTES,
+                budget=budget,
             )
+            for shard in shards:
+                with shard.file:
+                    batch_id = nutrition_jobs.submit_shard(
+                        client, token, shard, completion_window=completion_window
+                    )
+                submitted += len(shard.job_ids)
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Batch sukurta: batch_id={batch_id} jobs={len(shard.job_ids)} "
+                        f"tokens≈{shard.tokens} bytes={shard.size}"
+                    )
+                )
+        finally:
+            # Nepateikti (kvota, klaida ar nutrauktas paleidimas) job'ai grįžta į eilę.
+            nutrition_jobs.release_claim(token)
 
+        if not submitted and not self.local:
+            self.stdout.write("Nėra queued job'ų")
+            return
         self.stdout.write(
             self.style.SUCCESS(
-                f"Batch sukurta: batch_id={batch.id} input_file_id={uploaded.id} jobs={len(jobs)}"
+                f"Pateikta job'ų: {submitted} (lokaliai: {self.local}), tokens≈{budget.spent}"
             )
         )
         self.stdout.write(
-            f"Patarimas: pollink su: poetry run python manage.py poll_recipe_nutrition_batch --batch-id {batch.id}"
+            "Patarimas: pollink su: poetry run python manage.py poll_recipe_nutrition_batch"
         )
+
+    def _claimed_jobs(self, token: str, limit: int | None) -> Iterator[RecipeNutritionJob]:
+        """Užsiima job'us puslapiais, kol pasiekiamas limitas arba baigiasi eilė."""
+
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = CLAIM_PAGE_SIZE if remaining is None else min(CLAIM_PAGE_SIZE, remaining)
+            _token, jobs = nutrition_jobs.claim_queued(page_size, token=token)
+            if not jobs:
+                return
+            if remaining is not None:
+                remaining -= len(jobs)
+
+            # Receptai, kuriuos galima apskaičiuoti lokaliai, į Batch nesiunčiami.
+            local = nutrition_calculator.calculate_many(
+                {job.recipe_id: job.recipe.servings for job in jobs}
+            )
+            if local:
+                with transaction.atomic():
+                    for job in jobs:
+                        if job.recipe_id in local:
+                            complete_job(job, local[job.recipe_id])
+                self.local += len(local)
+
+            yield from (job for job in jobs if job.recipe_id not in local)
+            if len(jobs) < page_size:
+                return
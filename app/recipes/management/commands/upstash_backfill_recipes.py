@@ -1,42 +1,166 @@
 """Backfill komanda Upstash Search indeksui.
 
+Receptų ID skaitomi chunk'ais (keyset paginacija pagal `id`), kiekvienas chunk'as
+prefetch'inamas vienu kartu, o dokumentai upsert'inami batch'ais lygiagrečiai
+(`--concurrency`). Po kiekvieno pilnai suindeksuoto chunk'o įrašomas checkpoint'as,
+todėl nutrauktą paleidimą galima pratęsti su `--resume`.
+
 Naudojimas:
 - python manage.py upstash_backfill_recipes
 - python manage.py upstash_backfill_recipes --limit 10
 - python manage.py upstash_backfill_recipes --recipe-id 123
+- python manage.py upstash_backfill_recipes --chunk-size 1000 --batch-size 100 --concurrency 8
+- python manage.py upstash_backfill_recipes --resume
 """
 
 from __future__ import annotations
 
-from django.core.management.base import BaseCommand
+import json
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
+from recipes import search_cache
 from recipes.models import Recipe
-from recipes.upstash_search import upsert_recipe
+from recipes.upstash_search import (
+    _build_recipe_document,
+    _get_index,
+    _recipe_queryset,
+    record_index_state,
+    sync_recipes,
+)
+
+
+def _read_checkpoint(path: Path) -> int:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return 0
+    return int(data.get("last_id") or 0)
+
+
+def _write_checkpoint(path: Path, last_id: int, indexed: int) -> None:
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps({"last_id": last_id, "indexed": indexed}), encoding="utf-8")
+    tmp_path.replace(path)
 
 
 class Command(BaseCommand):
-    help = "Suindeksuoja publikuotus receptus į Upstash Search (best-effort)."
+    help = (
+        "Suindeksuoja publikuotus receptus į Upstash Search "
+        "(chunk'ais, lygiagrečiai, su checkpoint)."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("--limit", type=int, default=None)
         parser.add_argument("--recipe-id", type=int, default=None)
+        parser.add_argument(
+            "--chunk-size", type=int, default=500, help="Kiek receptų prefetch'inti vienu kartu."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=100, help="Kiek dokumentų viename upsert'e."
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=4, help="Lygiagrečių upsert'ų skaičius."
+        )
+        parser.add_argument(
+            "--checkpoint-file",
+            type=str,
+            default=str(Path(settings.BASE_DIR) / ".upstash_backfill_checkpoint.json"),
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Tęsti nuo paskutinio checkpoint'o (receptai su id <= last_id praleidžiami).",
+        )
 
     def handle(self, *args, **options):
-        limit = options.get("limit")
-        recipe_id = options.get("recipe_id")
+        limit: int | None = options.get("limit")
+        recipe_id: int | None = options.get("recipe_id")
+        chunk_size: int = max(options["chunk_size"], 1)
+        batch_size: int = max(options["batch_size"], 1)
+        concurrency: int = max(options["concurrency"], 1)
+        checkpoint_path = Path(options["checkpoint_file"])
+
+        index = _get_index()
+        if index is None:
+            raise CommandError("Upstash Search išjungtas arba nesukonfigūruotas")
 
-        qs = Recipe.objects.all().order_by("id")
         if recipe_id:
-            qs = qs.filter(id=recipe_id)
-        else:
-            qs = qs.filter(published_at__isnull=False)
+            # Vienam receptui – pagal DB būseną (nepublikuotas bus ištrintas iš indekso).
+            result = sync_recipes([recipe_id], force=True)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Upstash backfill baigtas. upserted={result.upserted} deleted={result.deleted}"
+                )
+            )
+            return
 
-        if limit:
-            qs = qs[:limit]
+        base_qs = Recipe.objects.filter(published_at__isnull=False)
+        last_id = _read_checkpoint(checkpoint_path) if options["resume"] else 0
+        if last_id:
+            self.stdout.write(f"Tęsiama nuo recipe_id > {last_id}")
 
         count = 0
-        for recipe in qs:
-            upsert_recipe(recipe.id)
-            count += 1
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending: list[Future] = []
+            pending_last_id = last_id
+            pending_hashes: dict[int, str] = {}
+
+            while limit is None or count < limit:
+                take = chunk_size if limit is None else min(chunk_size, limit - count)
+                chunk_ids = list(
+                    base_qs.filter(id__gt=last_id)
+                    .order_by("id")
+                    .values_list("id", flat=True)[:take]
+                )
+                if not chunk_ids:
+                    break
+
+                recipes = list(_recipe_queryset().filter(id__in=chunk_ids).order_by("id"))
+                documents = [_build_recipe_document(recipe) for recipe in recipes]
+
+                # Kol šio chunk'o upsert'ai vyksta, ankstesnio chunk'o rezultatus patvirtinam.
+                self._wait(pending)
+                if pending:
+                    record_index_state(indexed=pending_hashes)
+                    _write_checkpoint(checkpoint_path, pending_last_id, count)
+
+                pending = [
+                    executor.submit(index.upsert, documents=documents[start : start + batch_size])
+                    for start in range(0, len(documents), batch_size)
+                ]
+                last_id = chunk_ids[-1]
+                pending_last_id = last_id
+                pending_hashes = {
+                    recipe.id: doc["metadata"]["doc_hash"]
+                    for recipe, doc in zip(recipes, documents, strict=True)
+                }
+                count += len(documents)
+
+            self._wait(pending)
+            if pending:
+                record_index_state(indexed=pending_hashes)
+                _write_checkpoint(checkpoint_path, pending_last_id, count)
+
+        if count:
+            search_cache.bump_index_version()
+
+        if limit is None or count < limit:
+            # Pilnas praėjimas baigtas – kitas paleidimas pradės iš naujo.
+            checkpoint_path.unlink(missing_ok=True)
 
         self.stdout.write(self.style.SUCCESS(f"Upstash backfill baigtas. Apdorota: {count}"))
+
+    def _wait(self, futures: list[Future]) -> None:
+        if not futures:
+            return
+        wait(futures)
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise CommandError(
+                f"Upstash upsert nepavyko ({len(errors)} batch'ai): {errors[0]}. "
+                "Pratęskite su --resume."
+            )
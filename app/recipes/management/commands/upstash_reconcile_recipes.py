@@ -0,0 +1,126 @@
+"""Upstash Search indekso ir DB būsenos suderinimas (reconcile).
+
+Perskaito visus indekso dokumentus (`range`, tik ID ir `metadata.doc_hash`), palygina
+su publikuotais receptais ir pataiso tik neatitikimus:
+- trūksta indekse arba skiriasi hash'as -> upsert;
+- yra indekse, bet receptas nepublikuotas/ištrintas -> delete.
+`SearchIndexState` atnaujinamas pagal faktinę indekso būseną.
+
+Naudojimas:
+- python manage.py upstash_reconcile_recipes --dry-run
+- python manage.py upstash_reconcile_recipes
+"""
+
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import search_cache
+from recipes.models import Recipe
+from recipes.upstash_search import (
+    _build_recipe_document,
+    _doc_id,
+    _get_index,
+    _parse_doc_id,
+    _recipe_queryset,
+    record_index_state,
+)
+
+
+class Command(BaseCommand):
+    help = "Suderina Upstash Search indeksą su DB (upsert'ina/trina tik neatitikimus)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--range-page-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Nieko nekeisti indekse, tik parodyti neatitikimų skaičių.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size: int = max(options["chunk_size"], 1)
+        page_size: int = max(options["range_page_size"], 1)
+        dry_run: bool = options["dry_run"]
+
+        index = _get_index()
+        if index is None:
+            raise CommandError("Upstash Search išjungtas arba nesukonfigūruotas")
+
+        index_hashes = self._load_index_hashes(index, page_size=page_size)
+        self.stdout.write(f"Indekse dokumentų: {len(index_hashes)}")
+
+        published_ids: set[int] = set()
+        to_upsert = 0
+        in_sync = 0
+        last_id = 0
+        while True:
+            chunk_ids = list(
+                Recipe.objects.filter(published_at__isnull=False, id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if not chunk_ids:
+                break
+            last_id = chunk_ids[-1]
+            published_ids.update(chunk_ids)
+
+            documents = []
+            matching: dict[int, str] = {}
+            for recipe in _recipe_queryset().filter(id__in=chunk_ids):
+                document = _build_recipe_document(recipe)
+                doc_hash = document["metadata"]["doc_hash"]
+                if index_hashes.get(recipe.id) == doc_hash:
+                    matching[recipe.id] = doc_hash
+                else:
+                    documents.append(document)
+
+            in_sync += len(matching)
+            to_upsert += len(documents)
+            if dry_run:
+                continue
+
+            if documents:
+                index.upsert(documents=documents)
+            record_index_state(
+                indexed={
+                    **matching,
+                    **{
+                        doc["metadata"]["recipe_id"]: doc["metadata"]["doc_hash"]
+                        for doc in documents
+                    },
+                }
+            )
+
+        stale_ids = sorted(set(index_hashes) - published_ids)
+        if not dry_run:
+            for start in range(0, len(stale_ids), chunk_size):
+                batch = stale_ids[start : start + chunk_size]
+                index.delete(ids=[_doc_id(rid) for rid in batch])
+                record_index_state(removed=batch)
+            if to_upsert or stale_ids:
+                search_cache.bump_index_version()
+
+        suffix = " (DRY-RUN)" if dry_run else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Upstash reconcile{suffix}: in_sync={in_sync} upserted={to_upsert} "
+                f"deleted={len(stale_ids)}"
+            )
+        )
+
+    def _load_index_hashes(self, index, *, page_size: int) -> dict[int, str]:
+        hashes: dict[int, str] = {}
+        cursor = ""
+        while True:
+            page = index.range(cursor=cursor, limit=page_size, prefix="recipe:")
+            for document in page.documents:
+                recipe_id = _parse_doc_id(document.id)
+                if recipe_id is None:
+                    continue
+                hashes[recipe_id] = (document.metadata or {}).get("doc_hash") or ""
+            cursor = page.next_cursor
+            if not cursor or not page.documents:
+                break
+        return hashes
@@ -0,0 +1,37 @@
+"""Upstash Search būsenos ataskaita (outbox eilė, indekso atsilikimas, cache, breaker).
+
+Naudojimas:
+- python manage.py upstash_search_status
+"""
+
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from recipes import search_breaker, search_cache
+from recipes.upstash_search import outbox_stats
+
+
+class Command(BaseCommand):
+    help = "Parodo Upstash Search sinchronizacijos būseną (pending/dead operacijos, lag)."
+
+    def handle(self, *args, **options):
+        stats = outbox_stats()
+        self.stdout.write(f"outbox_pending={stats['pending']}")
+        self.stdout.write(f"outbox_dead={stats['dead']}")
+        self.stdout.write(f"index_lag_seconds={stats['lag_seconds']:.0f}")
+
+        cache_stats = search_cache.stats()
+        total = cache_stats["hits"] + cache_stats["misses"]
+        hit_rate = cache_stats["hits"] / total if total else 0.0
+        self.stdout.write(f"search_cache_hits={cache_stats['hits']}")
+        self.stdout.write(f"search_cache_misses={cache_stats['misses']}")
+        self.stdout.write(f"search_cache_hit_rate={hit_rate:.2f}")
+        self.stdout.write(f"search_index_version={cache_stats['index_version']}")
+
+        breaker = search_breaker.stats()
+        self.stdout.write(f"search_breaker_state={breaker['state']}")
+        self.stdout.write(f"search_breaker_consecutive_failures={breaker['consecutive_failures']}")
+        for name in ("calls", "errors", "timeouts", "slow", "short_circuited"):
+            self.stdout.write(f"search_{name}={breaker[name]}")
+        self.stdout.write(f"search_latency_ms_avg={breaker['latency_ms_avg']:.0f}")
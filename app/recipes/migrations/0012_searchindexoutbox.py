@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0011_recipeimagejob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchIndexOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("recipe_id", models.BigIntegerField()),
+                (
+                    "operation",
+                    models.CharField(
+                        choices=[("upsert", "Upsert"), ("delete", "Ištrinti")],
+                        default="upsert",
+                        max_length=10,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("available_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("last_error", models.TextField(blank=True)),
+                ("failed_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Paieškos indekso operacija",
+                "verbose_name_plural": "Paieškos indekso operacijos",
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        fields=["failed_at", "available_at"], name="recipes_sea_failed__761a74_idx"
+                    ),
+                    models.Index(fields=["recipe_id"], name="recipes_sea_recipe__8589a0_idx"),
+                ],
+            },
+        ),
+    ]
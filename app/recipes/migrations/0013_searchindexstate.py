@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0012_searchindexoutbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchIndexState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("recipe_id", models.BigIntegerField(unique=True)),
+                ("doc_hash", models.CharField(blank=True, max_length=64)),
+                ("is_indexed", models.BooleanField(default=False)),
+                ("synced_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "verbose_name": "Paieškos indekso būsena",
+                "verbose_name_plural": "Paieškos indekso būsenos",
+            },
+        ),
+    ]
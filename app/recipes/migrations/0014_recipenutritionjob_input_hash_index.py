@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0013_searchindexstate"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="recipenutritionjob",
+            index=models.Index(
+                fields=["input_hash", "status"], name="recipes_rec_input_h_7648c7_idx"
+            ),
+        ),
+    ]
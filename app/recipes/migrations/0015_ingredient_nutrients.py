@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0014_recipenutritionjob_input_hash_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingredient",
+            name="allergens",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="ingredient",
+            name="density_g_per_ml",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=3,
+                help_text="Tankis (g/ml) tūrio vienetams perskaičiuoti į gramus.",
+                max_digits=6,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="ingredient",
+            name="grams_per_piece",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=2,
+                help_text="Vieno vieneto svoris (g) skaičiuojamiems vienetams (vnt., skiltelė...).",
+                max_digits=8,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="ingredient",
+            name="nutrients_per_100g",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="measurementunit",
+            name="base_factor",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=4,
+                help_text="Kiek bazinių vienetų sudaro 1 vienetas: g (svoris), ml (tūris), vnt. (skaičius).",
+                max_digits=10,
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,106 @@
+"""Nutrition hash'as be porcijų + viso recepto sumos (`totals`) esamiems rezultatams.
+
+Receptams ir job'ams, kurių hash'as atitinka dabartinius ingredientus, hash'as
+perskaičiuojamas naująja formule (be `servings=`), kad nebūtų nereikalingo LLM
+perskaičiavimo. Rezultatams su `per_serving` pridedami `totals` / `micros_totals`.
+"""
+
+import hashlib
+
+from django.db import migrations
+
+CHUNK_SIZE = 1000
+
+
+def _hash(rows, servings=None):
+    parts = [] if servings is None else [f"servings={servings}"]
+    for ingredient_id, group_id, unit_id, amount, note in rows:
+        parts.append(
+            "|".join(
+                [
+                    str(ingredient_id),
+                    str(group_id or ""),
+                    str(unit_id),
+                    str(amount),
+                    (note or "").strip(),
+                ]
+            )
+        )
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _scaled(values, factor):
+    if values is None:
+        return None
+    return {k: None if v is None else round(v * factor, 1) for k, v in values.items()}
+
+
+def _with_totals(result):
+    if not isinstance(result, dict) or "totals" in result:
+        return None
+    servings = result.get("servings")
+    if not servings or not result.get("per_serving"):
+        return None
+    updated = dict(result)
+    updated["totals"] = _scaled(result["per_serving"], servings)
+    updated["micros_totals"] = _scaled(result.get("micros"), servings)
+    return updated
+
+
+def forwards(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    RecipeIngredient = apps.get_model("recipes", "RecipeIngredient")
+    RecipeNutritionJob = apps.get_model("recipes", "RecipeNutritionJob")
+
+    recipe_ids = list(Recipe.objects.order_by("id").values_list("id", flat=True))
+    for start in range(0, len(recipe_ids), CHUNK_SIZE):
+        chunk = recipe_ids[start : start + CHUNK_SIZE]
+        rows_by_recipe = {}
+        rows = (
+            RecipeIngredient.objects.filter(recipe_id__in=chunk)
+            .values_list("recipe_id", "ingredient_id", "group_id", "unit_id", "amount", "note")
+            .order_by("recipe_id", "ingredient_id", "group_id", "unit_id", "amount", "id")
+        )
+        for recipe_id, *row in rows:
+            rows_by_recipe.setdefault(recipe_id, []).append(tuple(row))
+
+        mapping = {}
+        recipes = []
+        for recipe in Recipe.objects.filter(id__in=chunk).only(
+            "id", "servings", "nutrition", "nutrition_input_hash"
+        ):
+            rows = rows_by_recipe.get(recipe.id, [])
+            old_hash = _hash(rows, servings=recipe.servings)
+            new_hash = _hash(rows)
+            mapping[old_hash] = new_hash
+            changed = False
+            if recipe.nutrition_input_hash == old_hash:
+                recipe.nutrition_input_hash = new_hash
+                changed = True
+            nutrition = _with_totals(recipe.nutrition)
+            if nutrition is not None:
+                recipe.nutrition = nutrition
+                changed = True
+            if changed:
+                recipes.append(recipe)
+        Recipe.objects.bulk_update(recipes, ["nutrition", "nutrition_input_hash"])
+
+        jobs = []
+        for job in RecipeNutritionJob.objects.filter(input_hash__in=list(mapping)).only(
+            "id", "input_hash", "result"
+        ):
+            job.input_hash = mapping[job.input_hash]
+            job.result = _with_totals(job.result) or job.result
+            jobs.append(job)
+        RecipeNutritionJob.objects.bulk_update(jobs, ["input_hash", "result"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0015_ingredient_nutrients"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0016_nutrition_totals_and_hash_without_servings"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="recipenutritionjob",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Eilėje"),
+                    ("submitting", "Teikiama (batch)"),
+                    ("submitted", "Pateikta (batch)"),
+                    ("running", "Vykdoma"),
+                    ("succeeded", "Pavyko"),
+                    ("failed", "Nepavyko"),
+                ],
+                default="queued",
+                max_length=20,
+            ),
+        ),
+    ]
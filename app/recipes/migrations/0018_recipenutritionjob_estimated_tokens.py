@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0017_recipenutritionjob_submitting_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipenutritionjob",
+            name="estimated_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:06
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def release_submitting_claims(apps, schema_editor):
+    # Claim token'as anksčiau buvo laikomas `openai_batch_id` lauke, dabar – `lease_token`.
+    RecipeNutritionJob = apps.get_model("recipes", "RecipeNutritionJob")
+    RecipeNutritionJob.objects.filter(status="submitting").update(
+        status="queued", openai_batch_id=""
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0018_recipenutritionjob_estimated_tokens"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipeimagejob",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="recipeimagejob",
+            name="available_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="recipeimagejob",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="recipeimagejob",
+            name="lease_token",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="recipenutritionjob",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="recipenutritionjob",
+            name="available_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="recipenutritionjob",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="recipenutritionjob",
+            name="lease_token",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AlterField(
+            model_name="recipeimagejob",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Eilėje"),
+                    ("running", "Vykdoma"),
+                    ("succeeded", "Pavyko"),
+                    ("failed", "Nepavyko"),
+                    ("dead", "Nepavyko (išnaudoti bandymai)"),
+                ],
+                default="queued",
+                max_length=20,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="recipenutritionjob",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Eilėje"),
+                    ("submitting", "Teikiama (batch)"),
+                    ("submitted", "Pateikta (batch)"),
+                    ("running", "Vykdoma"),
+                    ("succeeded", "Pavyko"),
+                    ("failed", "Nepavyko"),
+                    ("dead", "Nepavyko (išnaudoti bandymai)"),
+                ],
+                default="queued",
+                max_length=20,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipeimagejob",
+            index=models.Index(
+                fields=["status", "available_at"], name="recipes_rec_status_ea76c1_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipenutritionjob",
+            index=models.Index(
+                fields=["status", "available_at"], name="recipes_rec_status_c85981_idx"
+            ),
+        ),
+        migrations.RunPython(release_submitting_claims, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+import os
+
+from django.db import migrations
+
+
+def enqueue_reindex(apps, schema_editor):
+    # Anksčiau suindeksuoti dokumentai neturi facet laukų (`tag_slugs`, `category_slugs`, ...),
+    # todėl filtruota paieška jų nerastų – visi receptai perindeksuojami per outbox.
+    # Sąlyga įrašyta čia (ne importuojama iš `recipes.upstash_search`) – migracija nepriklauso
+    # nuo vėlesnių programos kodo pakeitimų.
+    enabled = os.getenv("UPSTASH_SEARCH_ENABLED", "").strip().lower()
+    if enabled not in {"1", "true", "yes", "y", "on"}:
+        return
+    Recipe = apps.get_model("recipes", "Recipe")
+    SearchIndexOutbox = apps.get_model("recipes", "SearchIndexOutbox")
+    ids = Recipe.objects.order_by("id").values_list("id", flat=True)
+    SearchIndexOutbox.objects.bulk_create(
+        (
+            SearchIndexOutbox(recipe_id=recipe_id, operation="upsert")
+            for recipe_id in ids.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recipes", "0019_job_queue_leases"),
+    ]
+
+    operations = [
+        migrations.RunPython(enqueue_reindex, migrations.RunPython.noop),
+    ]
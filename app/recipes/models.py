@@ -1,30 +1,105 @@
 """Domeno modeliai receptų platformai."""
 
 import hashlib
+from functools import partial
 from uuid import uuid4
 
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.db.models import Q
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
 from django.utils.text import slugify
 from imagekit.models import ImageSpecField
 from imagekit.processors import ResizeToFill, ResizeToFit
 
+from recipe_platform import slug_allocator
+from recipe_platform.jobqueue import LeasedJob
+
+
+def _slug_base(value: str) -> str:
+    return slugify(value) or slugify(uuid4().hex)
+
 
 def _generate_unique_slug(instance: models.Model, value: str, *, field_name: str = "slug") -> str:
-    """Sugeneruoja unikalų slug lauką, kad vengti dublikatų."""
+    """Sugeneruoja unikalų slug lauką, kad vengti dublikatų (viena DB užklausa)."""
+
+    return slug_allocator.allocate(
+        instance.__class__, _slug_base(value), field=field_name, exclude_pk=instance.pk
+    )
+
+
+def _save_with_unique_slug(instance: models.Model, save, value: str) -> None:
+    """Jei slug'as generuojamas automatiškai – pakartoja išsaugojimą, kai jį spėjo užimti kitas."""
+
+    if instance.slug:
+        save()
+        return
+    instance.slug = _generate_unique_slug(instance, value)
+    slug_allocator.save_with_retry(instance, save, base=_slug_base(value))
+
 
-    base_slug = slugify(value) or slugify(uuid4().hex)
-    slug_value = base_slug
-    ModelClass = instance.__class__
-    counter = 1
+def _file_name(value) -> str | None:
+    """FileField reikšmė (FieldFile arba DB string) -> failo vardas arba None."""
 
-    while ModelClass.objects.filter(**{field_name: slug_value}).exclude(pk=instance.pk).exists():
-        slug_value = f"{base_slug}-{counter}"
-        counter += 1
+    name = getattr(value, "name", value)
+    return name or None
 
-    return slug_value
+
+class LoadedStateMixin:
+    """Įsimena `LOADED_STATE_FIELDS` reikšmes, kai objektas užkraunamas iš DB.
+
+    `save()` palygina dabartines reikšmes su momentine kopija, todėl papildomas
+    SELECT reikalingas tik objektams, kurie nebuvo užkrauti iš DB (arba laukas buvo
+    `defer`'intas).
+    """
+
+    LOADED_STATE_FIELDS: tuple[str, ...] = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values, strict=True))
+        instance._loaded_state = {
+            name: loaded[cls._meta.get_field(name).attname]
+            for name in cls.LOADED_STATE_FIELDS
+            if cls._meta.get_field(name).attname in loaded
+        }
+        return instance
+
+    def _previous_state(self, fields: set[str]) -> dict:
+        loaded = getattr(self, "_loaded_state", {})
+        previous = {name: loaded[name] for name in fields if name in loaded}
+        missing = [name for name in fields if name not in loaded]
+        if missing and self.pk is not None:
+            previous.update(
+                type(self)._default_manager.filter(pk=self.pk).values(*missing).first() or {}
+            )
+        return previous
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # Perskaityti laukai – nauja momentinė kopija; kitų laukų kopija nekeičiama.
+        refreshed = None if fields is None else set(fields)
+        self._refresh_loaded_state(
+            name
+            for name in self.LOADED_STATE_FIELDS
+            if refreshed is None
+            or name in refreshed
+            or self._meta.get_field(name).attname in refreshed
+        )
+
+    def _refresh_loaded_state(self, names=None) -> None:
+        deferred = self.get_deferred_fields()
+        state = {} if names is None else dict(getattr(self, "_loaded_state", {}))
+        for name in self.LOADED_STATE_FIELDS if names is None else names:
+            if name in deferred:
+                continue
+            value = getattr(self, name)
+            # FieldFile keičiamas vietoje (`image.save()`), todėl saugom tik vardą.
+            state[name] = _file_name(value) if isinstance(value, FieldFile) else value
+        self._loaded_state = state
 
 
 class TimeStampedModel(models.Model):
@@ -47,9 +122,7 @@ class NamedSluggedModel(TimeStampedModel):
         abstract = True
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = _generate_unique_slug(self, self.name)
-        super().save(*args, **kwargs)
+        _save_with_unique_slug(self, partial(super().save, *args, **kwargs), self.name)
 
     def __str__(self) -> str:  # pragma: no cover - paprastas vaizdavimas
         return self.name
@@ -107,6 +180,24 @@ class Ingredient(NamedSluggedModel):
         related_name="ingredients",
         on_delete=models.PROTECT,
     )
+    # Maistinė vertė 100 g (raktai kaip `NutritionPerServing` / `NutritionMicros`,
+    # pvz. {"energy_kcal": 364, "protein_g": 10.3, ...}); tuščia – skaičiuoja LLM.
+    nutrients_per_100g = models.JSONField(null=True, blank=True)
+    allergens = models.JSONField(default=list, blank=True)
+    density_g_per_ml = models.DecimalField(
+        max_digits=6,
+        decimal_places=3,
+        null=True,
+        blank=True,
+        help_text="Tankis (g/ml) tūrio vienetams perskaičiuoti į gramus.",
+    )
+    grams_per_piece = models.DecimalField(
+        max_digits=8,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Vieno vieneto svoris (g) skaičiuojamiems vienetams (vnt., skiltelė...).",
+    )
 
     class Meta:
         ordering = ["name"]
@@ -133,6 +224,15 @@ class MeasurementUnit(TimeStampedModel):
     short_name = models.CharField(max_length=10)
     unit_type = models.CharField(
         max_length=20, choices=MeasurementUnitType.choices)
+    base_factor = models.DecimalField(
+        max_digits=10,
+        decimal_places=4,
+        null=True,
+        blank=True,
+        help_text=(
+            "Kiek bazinių vienetų sudaro 1 vienetas: g (svoris), ml (tūris), vnt. (skaičius)."
+        ),
+    )
 
     class Meta:
         verbose_name = "Matavimo vienetas"
@@ -167,9 +267,11 @@ class Tag(NamedSluggedModel):
     pass
 
 
-class Recipe(TimeStampedModel):
+class Recipe(LoadedStateMixin, TimeStampedModel):
     """Pagrindinis recepto objektas."""
 
+    LOADED_STATE_FIELDS = ("image", "servings", "published_at")
+
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     meta_title = models.CharField(max_length=80, blank=True)
@@ -270,41 +372,38 @@ class Recipe(TimeStampedModel):
     ]
 
     def save(self, *args, **kwargs):
+        """Išsaugo ir pažymi, kas pasikeitė (`_change_kinds` – signalams/change_tracker).
+
+        Išvestiniai darbai (vaizdų variantai, nutrition pasenimas, paieška) vykdomi
+        `change_tracker` vartotojuose po commit.
+        """
+
         update_fields = kwargs.get("update_fields")
-        image_changed = False
-        servings_changed = False
+        tracked = {"image", "servings", "published_at"}
+        change_kinds: set[str] = set()
         if self.pk is None:
-            image_changed = bool(self.image)
+            if self.image:
+                change_kinds.add("image")
+            if self.published_at:
+                change_kinds.add("publish")
         else:
-            needs_previous = update_fields is None or "image" in update_fields or "servings" in update_fields
-            previous = (
-                Recipe.objects.filter(pk=self.pk).values("image", "servings").first()
-                if needs_previous
-                else None
-            )
+            check = tracked if update_fields is None else tracked & set(update_fields)
+            previous = self._previous_state(check)
+
+            if "image" in check and _file_name(previous.get("image")) != _file_name(self.image):
+                change_kinds.add("image")
+            if "servings" in check and previous.get("servings") != self.servings:
+                change_kinds.add("servings")
+            if "published_at" in check and (
+                (previous.get("published_at") is None) != (self.published_at is None)
+            ):
+                change_kinds.add("publish")
 
-            if update_fields is None or "image" in update_fields:
-                previous_image_name = previous.get("image") if previous else None
-                current_image_name = getattr(self.image, "name", None) if self.image else None
-                image_changed = previous_image_name != current_image_name
-            else:
-                image_changed = False
-
-            if update_fields is None or "servings" in update_fields:
-                previous_servings = previous.get("servings") if previous else None
-                servings_changed = previous_servings != self.servings
-            else:
-                servings_changed = False
-
-        if not self.slug:
-            self.slug = _generate_unique_slug(self, self.title)
         if not self.meta_title:
             self.meta_title = self.title
-        super().save(*args, **kwargs)
-        if image_changed:
-            self._generate_image_variants()
-        if servings_changed:
-            Recipe.objects.filter(pk=self.pk).update(nutrition_dirty=True)
+        self._change_kinds = change_kinds
+        _save_with_unique_slug(self, partial(super().save, *args, **kwargs), self.title)
+        self._refresh_loaded_state()
 
     def __str__(self) -> str:  # pragma: no cover
         return self.title
@@ -356,9 +455,11 @@ class RecipeIngredient(TimeStampedModel):
         return f"{self.recipe}: {self.amount} {self.unit.short_name} {self.ingredient.name}"
 
 
-class RecipeStep(TimeStampedModel):
+class RecipeStep(LoadedStateMixin, TimeStampedModel):
     """Chronologinis žingsnis recepto ruošimui."""
 
+    LOADED_STATE_FIELDS = ("image",)
+
     recipe = models.ForeignKey(
         Recipe, related_name="steps", on_delete=models.CASCADE)
     order = models.PositiveIntegerField()
@@ -446,13 +547,11 @@ class RecipeStep(TimeStampedModel):
             if update_fields is not None and "image" not in update_fields:
                 image_changed = False
             else:
-                previous_image_name = (
-                    RecipeStep.objects.filter(pk=self.pk).values_list("image", flat=True).first()
-                )
-                current_image_name = getattr(self.image, "name", None) if self.image else None
-                image_changed = previous_image_name != current_image_name
+                previous = self._previous_state({"image"})
+                image_changed = _file_name(previous.get("image")) != _file_name(self.image)
 
         super().save(*args, **kwargs)
+        self._refresh_loaded_state()
         if image_changed:
             self._generate_image_variants()
 
@@ -513,13 +612,15 @@ class Comment(TimeStampedModel):
 
 class RecipeNutritionJobStatus(models.TextChoices):
     QUEUED = "queued", "Eilėje"
+    SUBMITTING = "submitting", "Teikiama (batch)"
     SUBMITTED = "submitted", "Pateikta (batch)"
     RUNNING = "running", "Vykdoma"
     SUCCEEDED = "succeeded", "Pavyko"
     FAILED = "failed", "Nepavyko"
+    DEAD = "dead", "Nepavyko (išnaudoti bandymai)"
 
 
-class RecipeNutritionJob(TimeStampedModel):
+class RecipeNutritionJob(LeasedJob, TimeStampedModel):
     """Asinchroninis nutrition informacijos generavimo job'as."""
 
     recipe = models.ForeignKey(
@@ -535,6 +636,8 @@ class RecipeNutritionJob(TimeStampedModel):
     input_hash = models.CharField(max_length=64)
     openai_batch_id = models.CharField(max_length=100, blank=True, default="")
     openai_batch_submitted_at = models.DateTimeField(null=True, blank=True)
+    # Įvertinti prompt token'ai (pildoma pateikiant į Batch; kvotos skaičiavimui).
+    estimated_tokens = models.PositiveIntegerField(default=0)
     result = models.JSONField(null=True, blank=True)
     error = models.TextField(blank=True)
     started_at = models.DateTimeField(null=True, blank=True)
@@ -545,17 +648,22 @@ class RecipeNutritionJob(TimeStampedModel):
         indexes = [
             models.Index(fields=["status", "created_at"]),
             models.Index(fields=["recipe", "status", "created_at"]),
+            models.Index(fields=["input_hash", "status"]),
+            models.Index(fields=["status", "available_at"]),
         ]
 
     @staticmethod
-    def compute_input_hash(*, servings: int, ingredient_rows: list[tuple]) -> str:
-        """Sugeneruoja stabilų SHA256 hash'ą pagal porcijas ir ingredientų eilutes.
+    def compute_input_hash(*, ingredient_rows: list[tuple]) -> str:
+        """Sugeneruoja stabilų SHA256 hash'ą pagal ingredientų eilutes.
 
         `ingredient_rows` tikimasi kaip list of tuples:
         (ingredient_id, group_id, unit_id, amount, note)
+
+        Porcijos į hash'ą neįeina: `nutrition` saugomas viso recepto sumomis, o vertė
+        porcijai išvedama pagal esamas porcijas (žr. `nutrition_service.scale_nutrition`).
         """
 
-        parts: list[str] = [f"servings={servings}"]
+        parts: list[str] = []
         for ingredient_id, group_id, unit_id, amount, note in ingredient_rows:
             parts.append(
                 "|".join(
@@ -577,9 +685,10 @@ class RecipeImageJobStatus(models.TextChoices):
     RUNNING = "running", "Vykdoma"
     SUCCEEDED = "succeeded", "Pavyko"
     FAILED = "failed", "Nepavyko"
+    DEAD = "dead", "Nepavyko (išnaudoti bandymai)"
 
 
-class RecipeImageJob(TimeStampedModel):
+class RecipeImageJob(LeasedJob, TimeStampedModel):
     """Asinchroninis hero paveikslo generavimo job'as."""
 
     recipe = models.ForeignKey(
@@ -610,4 +719,63 @@ class RecipeImageJob(TimeStampedModel):
         indexes = [
             models.Index(fields=["status", "created_at"]),
             models.Index(fields=["recipe", "status", "created_at"]),
+            models.Index(fields=["status", "available_at"]),
+        ]
+
+
+class SearchIndexOperation(models.TextChoices):
+    UPSERT = "upsert", "Upsert"
+    DELETE = "delete", "Ištrinti"
+
+
+class SearchIndexOutbox(models.Model):
+    """Laukianti Upstash indekso operacija (transactional outbox).
+
+    Įrašas kuriamas toje pačioje transakcijoje kaip ir recepto pakeitimas, o
+    `process_search_index_outbox` worker'is jį vėliau sinchronizuoja su indeksu.
+    `recipe_id` sąmoningai ne FK – ištrinto recepto įrašas turi išlikti.
+    """
+
+    recipe_id = models.BigIntegerField()
+    operation = models.CharField(
+        max_length=10,
+        choices=SearchIndexOperation.choices,
+        default=SearchIndexOperation.UPSERT,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Paieškos indekso operacija"
+        verbose_name_plural = "Paieškos indekso operacijos"
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["failed_at", "available_at"]),
+            models.Index(fields=["recipe_id"]),
         ]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"{self.operation} recipe:{self.recipe_id}"
+
+
+class SearchIndexState(models.Model):
+    """Paskutinė į Upstash nusiųsta recepto dokumento būsena.
+
+    Leidžia praleisti upsert'us, kai indeksuojamas turinys nepasikeitė, ir
+    delete kvietimus receptams, kurių indekse jau nėra.
+    """
+
+    recipe_id = models.BigIntegerField(unique=True)
+    doc_hash = models.CharField(max_length=64, blank=True)
+    is_indexed = models.BooleanField(default=False)
+    synced_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Paieškos indekso būsena"
+        verbose_name_plural = "Paieškos indekso būsenos"
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"recipe:{self.recipe_id} ({'indexed' if self.is_indexed else 'absent'})"
@@ -0,0 +1,198 @@
+"""Deterministinis maistinės vertės skaičiavimas iš ingredientų lentelės (be LLM).
+
+Kiekvienas `Ingredient` gali turėti maistinę vertę 100 g (`nutrients_per_100g`) ir
+alergenus; `MeasurementUnit.base_factor` (arba standartinis faktorius pagal trumpinį, jei
+vieneto tipas sutampa) perskaičiuoja kiekį į gramus – tūriui per ingrediento tankį,
+vienetams per vieno vieneto svorį. Jei bent vienas recepto ingredientas nepadengtas,
+receptas grąžinamas kaip neapskaičiuotas ir jį toliau skaičiuoja LLM.
+
+Skaičiavimas stulpelinis: kiekviena ingrediento eilutė paverčiama `NUTRIENT_FIELDS`
+ilgio vektoriumi (g / 100 * vertė), o receptui vektoriai sumuojami po stulpelį.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, get_args
+
+from django.utils import timezone
+
+from recipes.models import MeasurementUnitType, RecipeIngredient
+from recipes.nutrition_service import Allergen, NutritionResult
+
+REQUIRED_FIELDS = ("energy_kcal", "protein_g", "fat_g", "carbs_g")
+PER_SERVING_FIELDS = REQUIRED_FIELDS + ("saturated_fat_g", "sugars_g", "fiber_g", "salt_g")
+MICRO_FIELDS = ("cholesterol_mg", "potassium_mg", "calcium_mg", "iron_mg")
+NUTRIENT_FIELDS = PER_SERVING_FIELDS + MICRO_FIELDS
+
+# Naudojama, kai `MeasurementUnit.base_factor` nenustatytas – tik to paties tipo vienetui
+# (pvz. „a.š.“, pažymėtas COUNT, nebūtų 15 g × vieneto svoris).
+_WEIGHT, _VOLUME, _COUNT = (
+    MeasurementUnitType.WEIGHT,
+    MeasurementUnitType.VOLUME,
+    MeasurementUnitType.COUNT,
+)
+STANDARD_UNIT_FACTORS: dict[str, tuple[str, Decimal]] = {
+    "g": (_WEIGHT, Decimal("1")),
+    "kg": (_WEIGHT, Decimal("1000")),
+    "mg": (_WEIGHT, Decimal("0.001")),
+    "ml": (_VOLUME, Decimal("1")),
+    "l": (_VOLUME, Decimal("1000")),
+    "dl": (_VOLUME, Decimal("100")),
+    "a.š.": (_VOLUME, Decimal("15")),
+    "š.š.": (_VOLUME, Decimal("5")),
+    "stikl.": (_VOLUME, Decimal("250")),
+    "vnt": (_COUNT, Decimal("1")),
+    "vnt.": (_COUNT, Decimal("1")),
+}
+
+ALLERGENS = frozenset(get_args(Allergen))
+
+DISCLAIMER = "Vertės apytikslės, apskaičiuotos pagal ingredientų maistinės vertės lentelę."
+
+_ROW_FIELDS = (
+    "recipe_id",
+    "amount",
+    "unit__unit_type",
+    "unit__short_name",
+    "unit__base_factor",
+    "ingredient__nutrients_per_100g",
+    "ingredient__allergens",
+    "ingredient__density_g_per_ml",
+    "ingredient__grams_per_piece",
+)
+
+
+def ingredient_grams(
+    amount: Decimal,
+    *,
+    unit_type: str,
+    short_name: str,
+    base_factor: Decimal | None,
+    density_g_per_ml: Decimal | None,
+    grams_per_piece: Decimal | None,
+) -> float | None:
+    """Kiekis gramais arba None, jei trūksta perskaičiavimo duomenų."""
+
+    factor = base_factor
+    if not factor:
+        standard = STANDARD_UNIT_FACTORS.get((short_name or "").strip().lower())
+        if standard is None or standard[0] != unit_type:
+            return None
+        factor = standard[1]
+    base = amount * factor
+    if unit_type == MeasurementUnitType.WEIGHT:
+        return float(base)
+    if unit_type == MeasurementUnitType.VOLUME:
+        return float(base * density_g_per_ml) if density_g_per_ml else None
+    if unit_type == MeasurementUnitType.COUNT:
+        return float(base * grams_per_piece) if grams_per_piece else None
+    return None
+
+
+def _row_vector(grams: float, nutrients: dict[str, Any]) -> list[float | None] | None:
+    if any(nutrients.get(field) is None for field in REQUIRED_FIELDS):
+        return None
+    scale = grams / 100
+    vector: list[float | None] = []
+    for field in NUTRIENT_FIELDS:
+        value = nutrients.get(field)
+        vector.append(None if value is None else float(value) * scale)
+    return vector
+
+
+def _sum_columns(vectors: list[list[float | None]]) -> list[float | None]:
+    # Nežinoma (None) bent viename ingrediente -> visa suma nežinoma.
+    return [
+        None if any(value is None for value in column) else sum(column)
+        for column in zip(*vectors, strict=True)
+    ]
+
+
+def _build_result(totals: list[float | None], servings: int, allergens: set[str]) -> dict:
+    per = {
+        field: None if total is None else round(total / servings, 1)
+        for field, total in zip(NUTRIENT_FIELDS, totals, strict=True)
+    }
+    micros = {field: per[field] for field in MICRO_FIELDS}
+    parsed = NutritionResult.model_validate(
+        {
+            "per_serving": {field: per[field] for field in PER_SERVING_FIELDS},
+            "micros": micros if any(value is not None for value in micros.values()) else None,
+            "allergens": sorted(allergens),
+            "notes": [],
+            "disclaimer": DISCLAIMER,
+        }
+    )
+    result = parsed.model_dump()
+    result["computed_at"] = timezone.now().isoformat()
+    result["servings"] = servings
+    rounded = {
+        field: None if total is None else round(total, 1)
+        for field, total in zip(NUTRIENT_FIELDS, totals, strict=True)
+    }
+    result["totals"] = {field: rounded[field] for field in PER_SERVING_FIELDS}
+    result["micros_totals"] = (
+        {field: rounded[field] for field in MICRO_FIELDS} if result["micros"] else None
+    )
+    result["source"] = "local"
+    return result
+
+
+def calculate_many(servings_by_recipe: dict[int, int]) -> dict[int, dict[str, Any]]:
+    """Apskaičiuoja nutrition receptams, kurių visi ingredientai padengti lentelėje.
+
+    Grąžina tik apskaičiuotus receptus; viena DB užklausa visiems.
+    """
+
+    if not servings_by_recipe:
+        return {}
+
+    vectors: dict[int, list[list[float | None]]] = defaultdict(list)
+    allergens: dict[int, set[str]] = defaultdict(set)
+    uncovered: set[int] = set()
+    rows = RecipeIngredient.objects.filter(recipe_id__in=list(servings_by_recipe)).values_list(
+        *_ROW_FIELDS
+    )
+    for (
+        recipe_id,
+        amount,
+        unit_type,
+        short_name,
+        base_factor,
+        nutrients,
+        ingredient_allergens,
+        density,
+        grams_per_piece,
+    ) in rows.iterator(chunk_size=5000):
+        if recipe_id in uncovered:
+            continue
+        grams = ingredient_grams(
+            amount,
+            unit_type=unit_type,
+            short_name=short_name,
+            base_factor=base_factor,
+            density_g_per_ml=density,
+            grams_per_piece=grams_per_piece,
+        )
+        vector = _row_vector(grams, nutrients) if grams is not None and nutrients else None
+        if vector is None:
+            uncovered.add(recipe_id)
+            continue
+        vectors[recipe_id].append(vector)
+        allergens[recipe_id].update(a for a in ingredient_allergens or [] if a in ALLERGENS)
+
+    results: dict[int, dict[str, Any]] = {}
+    for recipe_id, recipe_vectors in vectors.items():
+        servings = servings_by_recipe[recipe_id]
+        if recipe_id in uncovered or not servings or servings <= 0:
+            continue
+        results[recipe_id] = _build_result(
+            _sum_columns(recipe_vectors), servings, allergens[recipe_id]
+        )
+    return results
+
+
+def calculate(recipe) -> dict[str, Any] | None:
+    return calculate_many({recipe.id: recipe.servings}).get(recipe.id)
@@ -0,0 +1,431 @@
+"""OpenAI Batch pateikimas ir rezultatų importas nutrition job'ams.
+
+Pateikimas: job'ai pirmiausia atomiškai „užsiimami“ per bendrą eilę (QUEUED -> SUBMITTING
+su lease token'u, žr. `recipe_platform.jobqueue`), todėl du lygiagretūs paleidimai
+nepateikia to paties job'o dukart. JSONL rašomas srautu į laikinus failus ir automatiškai
+skaidomas į kelis batch'us pagal tiekėjo request'ų skaičiaus ir baitų ribas; kiekvienas
+batch'as (shard'as) toliau poll'inamas atskirai pagal savo `openai_batch_id`.
+
+Importas: output failas atsisiunčiamas srautu į `SpooledTemporaryFile` (mažas – atmintyje,
+didelis – diske), skaitomas eilutė po eilutės ir apdorojamas dalimis (`chunk_size` job'ų):
+kiekviena dalis validuojama ir įrašoma keliais bulk UPDATE'ais vienoje transakcijoje. Nepavykę
+request'ai grąžinami į eilę su atidėjimu (`jobqueue.fail`), išnaudoję bandymus – `dead`.
+
+Idempotentiškumą užtikrina sąlyga UPDATE'o WHERE dalyje (`status=SUBMITTED` ir tas pats
+`openai_batch_id`), o ne eilučių užraktai: pakartotinai ar lygiagrečiai importuojant tą
+patį failą jau apdoroti job'ai nebeliečiami.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import tempfile
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import IO, Any, Iterable, Iterator, NamedTuple
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from recipe_platform import jobqueue
+from recipe_platform.jobqueue import case_by_id
+from recipes.models import Recipe, RecipeNutritionJob, RecipeNutritionJobStatus
+from recipes.nutrition_service import (
+    build_openai_chat_request,
+    parse_openai_chat_content_to_nutrition,
+    scale_nutrition,
+)
+from recipes.token_budget import TokenBudget, estimate_request_tokens
+
+logger = logging.getLogger(__name__)
+
+CUSTOM_ID_PREFIX = "nutrition_job:"
+DEFAULT_CHUNK_SIZE = 500
+# Iki tiek baitų output failas laikomas atmintyje, didesnis – perkeliamas į diską.
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+# SUBMITTING job'ai, kurių procesas nukrito, po tiek laiko grąžinami į eilę.
+SUBMIT_LEASE = timedelta(hours=1)
+
+
+@dataclass(frozen=True)
+class BatchLine:
+    job_id: int
+    prompt_servings: int | None
+    content: str | None = None
+    error: str | None = None
+
+
+class JobInfo(NamedTuple):
+    recipe_id: int
+    input_hash: str
+    servings: int
+
+
+@dataclass
+class ImportStats:
+    processed: int = 0
+    succeeded: int = 0
+    retried: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+    def add(self, other: ImportStats) -> None:
+        self.processed += other.processed
+        self.succeeded += other.succeeded
+        self.retried += other.retried
+        self.failed += other.failed
+        self.skipped += other.skipped
+
+
+def custom_id_for(job: RecipeNutritionJob, servings: int) -> str:
+    # Porcijos, kurioms LLM skaičiuoja vertę (importe -> sumos receptui).
+    return f"{CUSTOM_ID_PREFIX}{job.id}:{servings}"
+
+
+def nutrition_queue() -> jobqueue.Queue:
+    return jobqueue.get_queue("nutrition")
+
+
+def release_stale_submitting() -> tuple[int, int]:
+    """Pakibę (procesas nukrito) SUBMITTING job'ai grąžinami į eilę arba tampa `dead`."""
+
+    return jobqueue.reap_expired(nutrition_queue(), status=RecipeNutritionJobStatus.SUBMITTING)
+
+
+def new_claim_token() -> str:
+    return jobqueue.new_token()
+
+
+def claim_queued(limit: int, *, token: str | None = None) -> tuple[str, list[RecipeNutritionJob]]:
+    """Atomiškai pažymi iki `limit` QUEUED job'ų kaip SUBMITTING šiam paleidimui.
+
+    Claim'as daromas per bendrą eilę (`jobqueue.claim`, `SKIP LOCKED`) su `SUBMIT_LEASE`
+    lease'u; tą patį `token` galima naudoti keliems claim'ams (puslapiais).
+    """
+
+    return jobqueue.claim(
+        nutrition_queue(),
+        limit,
+        token=token,
+        status=RecipeNutritionJobStatus.SUBMITTING,
+        lease=SUBMIT_LEASE,
+        select_related=("recipe",),
+    )
+
+
+def release_claim(token: str, job_ids: Iterable[int] | None = None) -> int:
+    """Grąžina dar nepateiktus (SUBMITTING) claim'o job'us į eilę."""
+
+    return jobqueue.release(
+        nutrition_queue(), token, status=RecipeNutritionJobStatus.SUBMITTING, job_ids=job_ids
+    )
+
+
+@dataclass
+class Shard:
+    file: IO[bytes]
+    # job_id -> įvertinti prompt token'ai
+    job_tokens: dict[int, int] = field(default_factory=dict)
+    size: int = 0
+
+    @property
+    def job_ids(self) -> list[int]:
+        return list(self.job_tokens)
+
+    @property
+    def tokens(self) -> int:
+        return sum(self.job_tokens.values())
+
+
+def _new_shard() -> Shard:
+    return Shard(file=tempfile.TemporaryFile(mode="w+b"))
+
+
+def _finish(shard: Shard) -> Shard:
+    shard.file.seek(0)
+    return shard
+
+
+def iter_shards(
+    jobs: Iterable[RecipeNutritionJob],
+    *,
+    max_requests: int,
+    max_bytes: int,
+    budget: TokenBudget | None = None,
+) -> Iterator[Shard]:
+    """Rašo JSONL į laikinus failus ir grąžina juos po vieną, neviršijant ribų.
+
+    Vienu metu atidarytas tik vienas failas; visas turinys atmintyje nelaikomas. Kai
+    `budget` token'ų nebeužtenka, likę job'ai nebeimami (juos grąžina `release_claim`).
+    """
+
+    shard = _new_shard()
+    for job in jobs:
+        body = build_openai_chat_request(recipe=job.recipe)
+        tokens = estimate_request_tokens(body)
+        if budget is not None and not budget.try_spend(tokens):
+            break
+        line = (
+            json.dumps(
+                {
+                    "custom_id": custom_id_for(job, job.recipe.servings),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": body,
+                },
+                ensure_ascii=False,
+            )
+            + "\n"
+        ).encode("utf-8")
+        if shard.job_tokens and (
+            len(shard.job_tokens) >= max_requests or shard.size + len(line) > max_bytes
+        ):
+            yield _finish(shard)
+            shard = _new_shard()
+        shard.file.write(line)
+        shard.size += len(line)
+        shard.job_tokens[job.id] = tokens
+    if shard.job_tokens:
+        yield _finish(shard)
+    else:
+        shard.file.close()
+
+
+def submit_shard(client, token: str, shard: Shard, *, completion_window: str) -> str:
+    """Įkelia shard'ą, sukuria batch'ą ir pažymi jo job'us SUBMITTED."""
+
+    uploaded = client.files.create(
+        file=("recipe_nutrition_batch.jsonl", shard.file), purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint="/v1/chat/completions",
+        completion_window=completion_window,
+    )
+    now = timezone.now()
+    jobqueue.leased(nutrition_queue(), token, status=RecipeNutritionJobStatus.SUBMITTING).filter(
+        id__in=shard.job_ids
+    ).update(
+        status=RecipeNutritionJobStatus.SUBMITTED,
+        openai_batch_id=batch.id,
+        openai_batch_submitted_at=now,
+        estimated_tokens=case_by_id(shard.job_tokens, models.PositiveIntegerField()),
+        lease_expires_at=None,
+        updated_at=now,
+    )
+    return batch.id
+
+
+def download_output(client, file_id: str) -> IO[bytes]:
+    """Atsisiunčia output failą srautu; grąžina į pradžią atsuktą spooled failą."""
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+    with client.files.with_streaming_response.content(file_id) as response:
+        for chunk in response.iter_bytes():
+            spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def _parse_custom_id(custom_id: Any) -> tuple[int, int | None] | None:
+    if not isinstance(custom_id, str) or not custom_id.startswith(CUSTOM_ID_PREFIX):
+        return None
+    try:
+        job_part, *servings_part = custom_id[len(CUSTOM_ID_PREFIX) :].split(":")
+        return int(job_part), int(servings_part[0]) if servings_part else None
+    except ValueError:
+        return None
+
+
+def parse_line(data: dict[str, Any]) -> BatchLine | None:
+    parsed = _parse_custom_id(data.get("custom_id"))
+    if parsed is None:
+        return None
+    job_id, prompt_servings = parsed
+
+    if data.get("error"):
+        error = json.dumps(data["error"], ensure_ascii=False)[:4000]
+        return BatchLine(job_id, prompt_servings, error=error)
+    response = data.get("response")
+    if not response:
+        return BatchLine(job_id, prompt_servings, error="missing_response")
+    body = response.get("body") or {}
+    if response.get("status_code") != 200:
+        return BatchLine(job_id, prompt_servings, error=json.dumps(body, ensure_ascii=False)[:4000])
+    try:
+        content = body["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError) as exc:
+        return BatchLine(job_id, prompt_servings, error=f"parse_error: {exc!r}")
+    return BatchLine(job_id, prompt_servings, content=content)
+
+
+def iter_lines(fp: IO[bytes]) -> Iterator[BatchLine]:
+    for raw in fp:
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            line = parse_line(json.loads(raw))
+        except (ValueError, AttributeError):
+            logger.warning("Netinkama batch output eilutė: %r", raw[:200])
+            continue
+        if line is not None:
+            yield line
+
+
+def _chunks(lines: Iterable[BatchLine], size: int) -> Iterator[list[BatchLine]]:
+    chunk: list[BatchLine] = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _pending_jobs(batch_id: str, job_ids: Iterable[int]):
+    return RecipeNutritionJob.objects.filter(
+        id__in=list(job_ids),
+        openai_batch_id=batch_id,
+        status=RecipeNutritionJobStatus.SUBMITTED,
+    )
+
+
+def write_results(
+    pending: models.QuerySet,
+    jobs: dict[int, JobInfo],
+    results: dict[int, dict[str, Any]],
+    errors: dict[int, str],
+    *,
+    retry: bool = True,
+) -> tuple[int, int, int]:
+    """Įrašo rezultatus ir klaidas keliais bulk UPDATE'ais vienoje transakcijoje.
+
+    `pending` – job'ų queryset'as su būsenos sąlyga (pvz. `status=SUBMITTED`): atnaujinami
+    tik ją dar atitinkantys job'ai ir tik jų receptai. Klaidos perduodamos `jobqueue.fail`
+    (pakartojimas su atidėjimu; `retry=False` – iškart FAILED). Grąžina (pavykusių, pakartojamų,
+    galutinai nepavykusių) skaičių.
+    """
+
+    succeeded = 0
+    now = timezone.now()
+    with transaction.atomic():
+        won: list[int] = []
+        if results:
+            succeeded = pending.filter(id__in=list(results)).update(
+                status=RecipeNutritionJobStatus.SUCCEEDED,
+                result=case_by_id(results, models.JSONField()),
+                error="",
+                finished_at=now,
+                lease_token="",
+                lease_expires_at=None,
+                updated_at=now,
+            )
+            # Receptai atnaujinami tik job'ams, kuriuos pakeitė šis UPDATE (jų `finished_at`
+            # – šis `now`): kitas importas / worker'is galėjo job'ą jau užbaigti ar grąžinti.
+            if succeeded == len(results):
+                won = list(results)
+            elif succeeded:
+                won = list(
+                    RecipeNutritionJob.objects.filter(
+                        id__in=list(results),
+                        status=RecipeNutritionJobStatus.SUCCEEDED,
+                        finished_at=now,
+                    ).values_list("id", flat=True)
+                )
+        if won:
+            recipes = {jobs[job_id].recipe_id: (jobs[job_id], results[job_id]) for job_id in won}
+            Recipe.objects.filter(id__in=list(recipes)).update(
+                nutrition=case_by_id(
+                    {
+                        recipe_id: scale_nutrition(result, job.servings)
+                        for recipe_id, (job, result) in recipes.items()
+                    },
+                    models.JSONField(),
+                ),
+                nutrition_input_hash=case_by_id(
+                    {recipe_id: job.input_hash for recipe_id, (job, _result) in recipes.items()},
+                    models.CharField(),
+                ),
+                nutrition_updated_at=now,
+                nutrition_dirty=False,
+            )
+        retried, terminal = jobqueue.fail(nutrition_queue(), pending, errors, retry=retry)
+        if terminal:
+            # Receptas lieka „dirty“ – kitas enqueue sukurs naują job'ą.
+            Recipe.objects.filter(id__in=[jobs[job_id].recipe_id for job_id in terminal]).update(
+                nutrition_dirty=True
+            )
+    return succeeded, len(retried), len(terminal)
+
+
+def apply_chunk(batch_id: str, lines: list[BatchLine]) -> ImportStats:
+    """Validuoja ir įrašo vieną output dalį (kelios užklausos visai daliai)."""
+
+    stats = ImportStats()
+    jobs = {
+        job_id: JobInfo(recipe_id, input_hash, servings)
+        for job_id, recipe_id, input_hash, servings in _pending_jobs(
+            batch_id, (line.job_id for line in lines)
+        ).values_list("id", "recipe_id", "input_hash", "recipe__servings")
+    }
+
+    results: dict[int, dict[str, Any]] = {}
+    errors: dict[int, str] = {}
+    for line in lines:
+        job = jobs.get(line.job_id)
+        if job is None or line.job_id in results or line.job_id in errors:
+            stats.skipped += 1
+            continue
+        if line.error is not None:
+            errors[line.job_id] = line.error
+            continue
+        try:
+            results[line.job_id] = parse_openai_chat_content_to_nutrition(
+                content=line.content or "", servings=line.prompt_servings or job.servings
+            )
+        except Exception as exc:
+            errors[line.job_id] = f"parse_error: {exc}"
+
+    stats.succeeded, stats.retried, stats.failed = write_results(
+        RecipeNutritionJob.objects.filter(
+            openai_batch_id=batch_id, status=RecipeNutritionJobStatus.SUBMITTED
+        ),
+        jobs,
+        results,
+        errors,
+    )
+    stats.processed = stats.succeeded + stats.retried + stats.failed
+    return stats
+
+
+def import_output(
+    batch_id: str, fp: IO[bytes], *, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> ImportStats:
+    stats = ImportStats()
+    for chunk in _chunks(iter_lines(fp), chunk_size):
+        stats.add(apply_chunk(batch_id, chunk))
+    return stats
+
+
+def fail_batch(batch_id: str, reason: str) -> tuple[int, int]:
+    """Visi dar SUBMITTED batch'o job'ai grąžinami į eilę arba tampa `dead`.
+
+    Grąžina (pakartojamų, galutinai nepavykusių) skaičių.
+    """
+
+    pending = RecipeNutritionJob.objects.filter(
+        openai_batch_id=batch_id, status=RecipeNutritionJobStatus.SUBMITTED
+    )
+    jobs = {
+        job_id: JobInfo(recipe_id, input_hash, servings)
+        for job_id, recipe_id, input_hash, servings in pending.values_list(
+            "id", "recipe_id", "input_hash", "recipe__servings"
+        )
+    }
+    _succeeded, retried, failed = write_results(
+        pending, jobs, {}, {job_id: reason for job_id in jobs}
+    )
+    return retried, failed
@@ -9,7 +9,7 @@ from django.utils import timezone
 from openai import OpenAI
 from pydantic import BaseModel, Field, field_validator
 
-from recipes.models import Recipe, RecipeIngredient, RecipeNutritionJob
+from recipes.models import Recipe, RecipeIngredient, RecipeNutritionJob, RecipeNutritionJobStatus
 
 
 Allergen = Literal[
@@ -125,13 +125,20 @@ def _user_prompt(inputs: NutritionInputs) -> str:
 
 
 def generate_nutrition(recipe: Recipe) -> dict[str, Any]:
+    return request_nutrition(build_openai_chat_request(recipe=recipe), servings=recipe.servings)
+
+
+def request_nutrition(
+    req: dict[str, Any], *, servings: int, client: OpenAI | None = None
+) -> dict[str, Any]:
+    """Iškviečia OpenAI pagal paruoštą request'ą (be DB užklausų – saugu kviesti gijose)."""
+
     if not getattr(settings, "OPENAI_API_KEY", ""):
         raise RuntimeError("OPENAI_API_KEY nenustatytas")
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    client = client or OpenAI(api_key=settings.OPENAI_API_KEY)
 
     # Naudojam Chat Completions su JSON objektu; validaciją darom per Pydantic.
-    req = build_openai_chat_request(recipe=recipe)
     resp = client.chat.completions.create(
         **req,
         timeout=getattr(settings, "OPENAI_REQUEST_TIMEOUT_SECONDS", 60),
@@ -141,7 +148,7 @@ def generate_nutrition(recipe: Recipe) -> dict[str, Any]:
     if not content:
         raise RuntimeError("OpenAI grąžino tuščią atsakymą")
 
-    return parse_openai_chat_content_to_nutrition(content=content, servings=recipe.servings)
+    return parse_openai_chat_content_to_nutrition(content=content, servings=servings)
 
 
 def build_openai_chat_request(*, recipe: Recipe) -> dict[str, Any]:
@@ -164,14 +171,119 @@ def parse_openai_chat_content_to_nutrition(*, content: str, servings: int) -> di
     parsed = NutritionResult.model_validate(data)
     result = parsed.model_dump()
     result["computed_at"] = timezone.now().isoformat()
+    return with_totals(result, servings)
+
+
+def _scaled(values: dict[str, Any] | None, factor: float) -> dict[str, Any] | None:
+    if values is None:
+        return None
+    return {
+        key: None if value is None else round(value * factor, 1) for key, value in values.items()
+    }
+
+
+def with_totals(result: dict[str, Any], servings: int) -> dict[str, Any]:
+    """Prideda viso recepto sumas (`totals`, `micros_totals`) prie vertės porcijai."""
+
     result["servings"] = servings
+    result["totals"] = _scaled(result.get("per_serving"), servings)
+    result["micros_totals"] = _scaled(result.get("micros"), servings)
     return result
 
 
+def scale_nutrition(nutrition: dict[str, Any] | None, servings: int) -> dict[str, Any] | None:
+    """Išveda `per_serving` / `micros` iš viso recepto sumų nurodytam porcijų skaičiui.
+
+    Seni įrašai be `totals` perskaičiuojami pagal juose įrašytą `servings`.
+    """
+
+    if not nutrition or not servings or servings <= 0:
+        return nutrition
+    totals = nutrition.get("totals")
+    micros_totals = nutrition.get("micros_totals")
+    if totals is None:
+        stored_servings = nutrition.get("servings")
+        if not stored_servings:
+            return nutrition
+        totals = _scaled(nutrition.get("per_serving"), stored_servings)
+        micros_totals = _scaled(nutrition.get("micros"), stored_servings)
+
+    scaled = dict(nutrition)
+    scaled["totals"] = totals
+    scaled["micros_totals"] = micros_totals
+    scaled["per_serving"] = _scaled(totals, 1 / servings)
+    scaled["micros"] = _scaled(micros_totals, 1 / servings)
+    scaled["servings"] = servings
+    return scaled
+
+
+def compute_current_input_hashes(recipe_ids) -> dict[int, str]:
+    """Dabartiniai input hash'ai daugeliui receptų (viena užklausa ingredientams)."""
+
+    rows_by_recipe: dict[int, list[tuple]] = {recipe_id: [] for recipe_id in recipe_ids}
+    rows = (
+        RecipeIngredient.objects.filter(recipe_id__in=list(rows_by_recipe))
+        .values_list("recipe_id", "ingredient_id", "group_id", "unit_id", "amount", "note")
+        .order_by("recipe_id", "ingredient_id", "group_id", "unit_id", "amount", "id")
+    )
+    for recipe_id, *row in rows:
+        rows_by_recipe[recipe_id].append(tuple(row))
+    return {
+        recipe_id: RecipeNutritionJob.compute_input_hash(ingredient_rows=rows)
+        for recipe_id, rows in rows_by_recipe.items()
+    }
+
+
 def compute_current_input_hash(recipe: Recipe) -> str:
     ingredient_rows = list(
         RecipeIngredient.objects.filter(recipe_id=recipe.id)
         .values_list("ingredient_id", "group_id", "unit_id", "amount", "note")
         .order_by("ingredient_id", "group_id", "unit_id", "amount", "id")
     )
-    return RecipeNutritionJob.compute_input_hash(servings=recipe.servings, ingredient_rows=ingredient_rows)
+    return RecipeNutritionJob.compute_input_hash(ingredient_rows=ingredient_rows)
+
+
+def find_reusable_results(input_hashes) -> dict[str, dict[str, Any]]:
+    """Ankstesni SUCCEEDED rezultatai pagal `input_hash` (content-addressed).
+
+    Hash'as priklauso tik nuo ingredientų eilučių, todėl identiškas sąrašas (ar tas pats
+    receptas, išsaugotas iš naujo) gali naudoti jau sugeneruotą rezultatą; vertė porcijai
+    perskaičiuojama pagal recepto porcijas (`scale_nutrition`).
+    Imamas naujausias rezultatas kiekvienam hash'ui; viena DB užklausa.
+    """
+
+    hashes = {h for h in input_hashes if h}
+    if not hashes:
+        return {}
+    rows = (
+        RecipeNutritionJob.objects.filter(
+            status=RecipeNutritionJobStatus.SUCCEEDED,
+            input_hash__in=hashes,
+            result__isnull=False,
+        )
+        .order_by("input_hash", "-finished_at", "-id")
+        .values_list("input_hash", "result")
+    )
+    results: dict[str, dict[str, Any]] = {}
+    for input_hash, result in rows:
+        results.setdefault(input_hash, result)
+    return results
+
+
+def complete_job(job: RecipeNutritionJob, nutrition: dict[str, Any]) -> None:
+    """Pažymi job'ą SUCCEEDED ir įrašo rezultatą į receptą (kviesti transakcijoje)."""
+
+    servings = Recipe.objects.filter(pk=job.recipe_id).values_list("servings", flat=True).first()
+    now = timezone.now()
+    job.status = RecipeNutritionJobStatus.SUCCEEDED
+    job.result = nutrition
+    job.error = ""
+    job.finished_at = now
+    job.save(update_fields=["status", "result", "error", "finished_at", "updated_at"])
+
+    Recipe.objects.filter(pk=job.recipe_id).update(
+        nutrition=scale_nutrition(nutrition, servings),
+        nutrition_updated_at=now,
+        nutrition_input_hash=job.input_hash,
+        nutrition_dirty=False,
+    )
@@ -168,6 +168,15 @@ class RecipeDetailSchema(RecipeSummarySchema):
 class RecipeListResponse(Schema):
     total: int
     items: list[RecipeSummarySchema]
+    cursor: Optional[str] = Field(
+        default=None, description="Paieškos sesija – perduokite kitiems puslapiams")
+
+
+class RecipeSuggestionSchema(Schema):
+    type: str = Field(description="recipe | tag | category | cuisine | meal_type")
+    title: str
+    slug: str
+    thumb: Optional[ImageVariantSchema] = None
 
 
 class RecipeFilters(Schema):
@@ -179,6 +188,10 @@ class RecipeFilters(Schema):
     cuisine: Optional[str] = None
     meal_type: Optional[str] = None
     difficulty: Optional[str] = None
+    max_total_time: Optional[int] = Field(
+        default=None, ge=1, description="Maks. paruošimo + gaminimo laikas (min.)")
+    cursor: Optional[str] = Field(
+        default=None, description="Paieškos sesijos token'as iš ankstesnio atsakymo")
     limit: int = Field(default=20, ge=1, le=100)
     offset: int = Field(default=0, ge=0)
 
@@ -0,0 +1,155 @@
+"""Upstash paieškos kvietimo deadline ir circuit breaker.
+
+Kiekvienas paieškos kvietimas vykdomas atskirame thread pool'e ir laukiama ne ilgiau
+nei `UPSTASH_SEARCH_TIMEOUT_MS` – vėliau API krenta į DB fallback. Iš eilės einančios
+klaidos/timeout'ai/lėti kvietimai atidaro breaker'į: `UPSTASH_SEARCH_BREAKER_COOLDOWN_SECONDS`
+Upstash visai nekviečiamas, po to leidžiamas vienas bandomasis (half-open) kvietimas.
+
+Būsena ir metrikos laikomos Django cache, todėl su bendru Redis jas mato visi procesai.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, TypeVar
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+FAILURES_KEY = "search:breaker:failures"
+OPEN_UNTIL_KEY = "search:breaker:open_until"
+PROBE_KEY = "search:breaker:probe"
+
+METRIC_KEYS = {
+    "calls": "search:metrics:calls",
+    "errors": "search:metrics:errors",
+    "timeouts": "search:metrics:timeouts",
+    "slow": "search:metrics:slow",
+    "short_circuited": "search:metrics:short_circuited",
+    "latency_ms_total": "search:metrics:latency_ms_total",
+}
+
+_executor: ThreadPoolExecutor | None = None
+
+
+class SearchUnavailableError(Exception):
+    """Upstash nekviestas (breaker atidarytas) arba neatsakė laiku."""
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _timeout_seconds() -> float:
+    return _env_int("UPSTASH_SEARCH_TIMEOUT_MS", 800) / 1000
+
+
+def _slow_seconds() -> float:
+    return _env_int("UPSTASH_SEARCH_SLOW_MS", 500) / 1000
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(_env_int("UPSTASH_SEARCH_MAX_INFLIGHT", 8), 1),
+            thread_name_prefix="upstash-search",
+        )
+    return _executor
+
+
+def _incr(key: str, delta: int = 1) -> int:
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, timeout=None)
+        return delta
+
+
+def state() -> str:
+    open_until = cache.get(OPEN_UNTIL_KEY)
+    if open_until is None:
+        return "closed"
+    return "open" if time.time() < open_until else "half_open"
+
+
+def _allow_request() -> bool:
+    open_until = cache.get(OPEN_UNTIL_KEY)
+    if open_until is None:
+        return True
+    if time.time() < open_until:
+        return False
+    # Half-open: tik vienas procesas gauna teisę į bandomąjį kvietimą.
+    return cache.add(PROBE_KEY, 1, timeout=max(int(_timeout_seconds() * 2), 1))
+
+
+def _record_success() -> None:
+    cache.delete_many([FAILURES_KEY, OPEN_UNTIL_KEY, PROBE_KEY])
+
+
+def _record_failure(reason: str) -> None:
+    failures = _incr(FAILURES_KEY)
+    threshold = max(_env_int("UPSTASH_SEARCH_BREAKER_FAILURES", 5), 1)
+    if failures >= threshold or cache.get(OPEN_UNTIL_KEY) is not None:
+        cooldown = _env_int("UPSTASH_SEARCH_BREAKER_COOLDOWN_SECONDS", 30)
+        cache.set(OPEN_UNTIL_KEY, time.time() + cooldown, timeout=None)
+        cache.delete(PROBE_KEY)
+        logger.warning("Upstash breaker atidarytas (%s, failures=%s)", reason, failures)
+
+
+def call(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Kviečia `fn` su deadline per breaker'į.
+
+    Kelia `SearchUnavailableError`, jei breaker atidarytas arba baigėsi laikas; kitos
+    `fn` klaidos perduodamos kviečiančiajam.
+    """
+
+    if not _allow_request():
+        _incr(METRIC_KEYS["short_circuited"])
+        raise SearchUnavailableError("breaker atidarytas")
+
+    started = time.monotonic()
+    future = _get_executor().submit(fn, *args, **kwargs)
+    try:
+        result = future.result(timeout=_timeout_seconds())
+    except FutureTimeoutError:
+        # Thread'as baigsis pats (SDK timeout), bet atsakymo nebelaukiam.
+        _incr(METRIC_KEYS["timeouts"])
+        _record_failure("timeout")
+        raise SearchUnavailableError("deadline viršytas") from None
+    except Exception:
+        _incr(METRIC_KEYS["errors"])
+        _record_failure("error")
+        raise
+    finally:
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        _incr(METRIC_KEYS["calls"])
+        _incr(METRIC_KEYS["latency_ms_total"], elapsed_ms)
+
+    if elapsed_ms / 1000 >= _slow_seconds():
+        _incr(METRIC_KEYS["slow"])
+        _record_failure("slow")
+    else:
+        _record_success()
+    return result
+
+
+def stats() -> dict[str, Any]:
+    values = cache.get_many(list(METRIC_KEYS.values()) + [FAILURES_KEY])
+    metrics = {name: int(values.get(key) or 0) for name, key in METRIC_KEYS.items()}
+    calls = metrics["calls"]
+    metrics["latency_ms_avg"] = metrics["latency_ms_total"] / calls if calls else 0.0
+    metrics["state"] = state()
+    metrics["consecutive_failures"] = int(values.get(FAILURES_KEY) or 0)
+    return metrics
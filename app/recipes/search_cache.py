@@ -0,0 +1,93 @@
+"""Upstash paieškos rezultatų cache.
+
+Normalizuota užklausa -> surikiuotas kandidatų ID sąrašas laikomas Django cache
+(`CACHES["default"]`, produkcijoje – bendras Redis visiems worker'iams). Raktas
+turi indekso versiją, kuri didinama po kiekvieno realaus upsert/delete, todėl
+pasikeitus indeksui seni įrašai tiesiog nebenaudojami ir išnyksta pagal TTL/LRU.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Any
+
+from django.core.cache import cache
+
+INDEX_VERSION_KEY = "search:index_version"
+HITS_KEY = "search:stats:hits"
+MISSES_KEY = "search:stats:misses"
+
+# Kiek kandidatų minimaliai paimti iš Upstash, kad kiti puslapiai būtų aptarnauti iš cache.
+MIN_FETCH_LIMIT = 200
+MAX_FETCH_LIMIT = 1000
+
+
+def _ttl_seconds() -> int:
+    try:
+        return int(os.getenv("UPSTASH_SEARCH_CACHE_TTL_SECONDS", "300"))
+    except ValueError:
+        return 300
+
+
+def normalize_query(query: str) -> str:
+    return " ".join((query or "").casefold().split())
+
+
+def get_index_version() -> int:
+    version = cache.get(INDEX_VERSION_KEY)
+    if version is None:
+        cache.add(INDEX_VERSION_KEY, 1, timeout=None)
+        version = cache.get(INDEX_VERSION_KEY, 1)
+    return int(version)
+
+
+def bump_index_version() -> None:
+    cache.add(INDEX_VERSION_KEY, 1, timeout=None)
+    try:
+        cache.incr(INDEX_VERSION_KEY)
+    except ValueError:  # raktas išmestas tarp add ir incr
+        cache.set(INDEX_VERSION_KEY, 2, timeout=None)
+
+
+def _incr(key: str) -> None:
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def _cache_key(query: str, params: dict[str, Any] | None) -> str:
+    raw = json.dumps([normalize_query(query), params or {}], sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return f"search:q:{get_index_version()}:{digest}"
+
+
+def fetch_limit(limit: int) -> int:
+    return min(max(limit, MIN_FETCH_LIMIT), MAX_FETCH_LIMIT)
+
+
+def get_ids(query: str, *, limit: int, params: dict[str, Any] | None = None) -> list[int] | None:
+    """Grąžina iki `limit` ID iš cache arba None (miss)."""
+
+    entry = cache.get(_cache_key(query, params))
+    # Cache tinka, jei jame pakankamai ID arba Upstash daugiau ir neturėjo.
+    if entry is not None and (entry["fetched"] >= limit or len(entry["ids"]) < entry["fetched"]):
+        _incr(HITS_KEY)
+        return entry["ids"][:limit]
+    _incr(MISSES_KEY)
+    return None
+
+
+def store_ids(
+    query: str, ids: list[int], *, fetched: int, params: dict[str, Any] | None = None
+) -> None:
+    cache.set(_cache_key(query, params), {"ids": ids, "fetched": fetched}, timeout=_ttl_seconds())
+
+
+def stats() -> dict[str, int]:
+    hits = int(cache.get(HITS_KEY) or 0)
+    misses = int(cache.get(MISSES_KEY) or 0)
+    return {"hits": hits, "misses": misses, "index_version": get_index_version()}
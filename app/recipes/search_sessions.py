@@ -0,0 +1,51 @@
+"""Paieškos sesijos gilesnei paginacijai.
+
+Pirmas `GET /api/recipes/?search=...` užklausimas išsaugo surikiuotą Upstash ID sąrašą
+cache'e po atsitiktiniu `cursor` token'u. Kiti puslapiai su tuo pačiu `cursor` pjaunami
+iš to paties sąrašo – rezultatai nesikeičia tarp puslapių ir Upstash nebekviečiamas.
+Jei kandidatų langas pilnas, sąrašą pratęsia DB `icontains` rezultatai (be jau surikiuotų).
+"""
+
+from __future__ import annotations
+
+import os
+import secrets
+from typing import Any
+
+from django.core.cache import cache
+
+
+def _ttl_seconds() -> int:
+    try:
+        return int(os.getenv("SEARCH_SESSION_TTL_SECONDS", "900"))
+    except ValueError:
+        return 900
+
+
+def _key(token: str) -> str:
+    return f"search:session:{token}"
+
+
+def create(
+    ranked_ids: list[int], *, params: dict[str, Any], has_tail: bool
+) -> tuple[str, dict[str, Any]]:
+    token = secrets.token_urlsafe(16)
+    session = {"ids": ranked_ids, "params": params, "has_tail": has_tail, "tail_total": None}
+    cache.set(_key(token), session, timeout=_ttl_seconds())
+    return token, session
+
+
+def get(token: str | None, *, params: dict[str, Any]) -> dict[str, Any] | None:
+    """Grąžina sesiją, jei ji dar galioja ir sukurta tiems patiems paieškos parametrams."""
+
+    if not token:
+        return None
+    session = cache.get(_key(token))
+    if session is None or session["params"] != params:
+        return None
+    return session
+
+
+def save_tail_total(token: str, session: dict[str, Any], tail_total: int) -> None:
+    session["tail_total"] = tail_total
+    cache.set(_key(token), session, timeout=_ttl_seconds())
@@ -1,78 +1,105 @@
-"""Signalai Upstash Search reindeksavimui.
+"""Signalai: receptų pakeitimai perduodami `change_tracker`'iui.
 
-Svarbu: naudojame `transaction.on_commit`, kad indeksuotume tik sėkmingai įrašytą būseną.
+Signalai patys nieko neperskaičiuoja – tik pažymi, kuris receptas ir kaip pasikeitė.
+`change_tracker` tos pačios transakcijos metu įrašo paieškos operaciją į
+`SearchIndexOutbox`, o po commit išsiunčia vieną sulietą įvykį kiekvienam receptui
+(nutrition pasenimas, pasiūlymų indeksas, vaizdų variantai, SEO).
 """
 
 from __future__ import annotations
 
 from django.db import transaction
-from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
-from .models import Recipe, RecipeIngredient
-from .upstash_search import delete_recipe, upsert_recipe
+from . import change_tracker, suggest_index
+from .models import Cuisine, MealType, Recipe, RecipeCategory, RecipeIngredient, Tag
 
 
 @receiver(post_save, sender=Recipe)
 def _recipe_saved(sender, instance: Recipe, created: bool, raw: bool, **kwargs):
     if raw:
         return
-    transaction.on_commit(lambda: upsert_recipe(instance.id))
+    kinds = getattr(instance, "_change_kinds", set())
+    change_tracker.mark(instance.id, change_tracker.CONTENT, *kinds)
 
 
 @receiver(post_delete, sender=Recipe)
 def _recipe_deleted(sender, instance: Recipe, **kwargs):
-    transaction.on_commit(lambda: delete_recipe(instance.id))
+    change_tracker.mark(instance.id, change_tracker.DELETED)
 
 
 @receiver(post_save, sender=RecipeIngredient)
-def _recipe_ingredient_saved(sender, instance: RecipeIngredient, created: bool, raw: bool, **kwargs):
+def _recipe_ingredient_saved(
+    sender, instance: RecipeIngredient, created: bool, raw: bool, **kwargs
+):
     if raw:
         return
-
-    def _on_commit() -> None:
-        Recipe.objects.filter(pk=instance.recipe_id).update(nutrition_dirty=True)
-        upsert_recipe(instance.recipe_id)
-
-    transaction.on_commit(_on_commit)
+    change_tracker.mark(instance.recipe_id, change_tracker.INGREDIENTS)
 
 
 @receiver(post_delete, sender=RecipeIngredient)
 def _recipe_ingredient_deleted(sender, instance: RecipeIngredient, **kwargs):
-
-    def _on_commit() -> None:
-        Recipe.objects.filter(pk=instance.recipe_id).update(nutrition_dirty=True)
-        upsert_recipe(instance.recipe_id)
-
-    transaction.on_commit(_on_commit)
+    change_tracker.mark(instance.recipe_id, change_tracker.INGREDIENTS)
 
 
-def _reindex_on_m2m_change(instance: Recipe, action: str) -> None:
+def _reindex_on_m2m_change(instance, action: str, reverse: bool, pk_set) -> None:
     if action not in {"post_add", "post_remove", "post_clear"}:
         return
-    transaction.on_commit(lambda: upsert_recipe(instance.id))
+    # reverse=True: pvz. `tag.recipes.add(...)` – pakeisti receptai yra pk_set.
+    recipe_ids = (pk_set or ()) if reverse else (instance.id,)
+    for recipe_id in recipe_ids:
+        change_tracker.mark(recipe_id, change_tracker.TAXONOMY)
 
 
 @receiver(m2m_changed, sender=Recipe.tags.through)
-def _recipe_tags_changed(sender, instance: Recipe, action: str, **kwargs):
-    _reindex_on_m2m_change(instance, action)
-
-
 @receiver(m2m_changed, sender=Recipe.categories.through)
-def _recipe_categories_changed(sender, instance: Recipe, action: str, **kwargs):
-    _reindex_on_m2m_change(instance, action)
-
-
 @receiver(m2m_changed, sender=Recipe.cuisines.through)
-def _recipe_cuisines_changed(sender, instance: Recipe, action: str, **kwargs):
-    _reindex_on_m2m_change(instance, action)
+@receiver(m2m_changed, sender=Recipe.meal_types.through)
+@receiver(m2m_changed, sender=Recipe.cooking_methods.through)
+def _recipe_taxonomy_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    _reindex_on_m2m_change(instance, action, reverse, pk_set)
 
 
-@receiver(m2m_changed, sender=Recipe.meal_types.through)
-def _recipe_meal_types_changed(sender, instance: Recipe, action: str, **kwargs):
-    _reindex_on_m2m_change(instance, action)
+def _taxonomy_kind(sender) -> str | None:
+    for kind, model in suggest_index.TAXONOMY_MODELS.items():
+        if sender is model:
+            return kind
+    return None
 
 
-@receiver(m2m_changed, sender=Recipe.cooking_methods.through)
-def _recipe_cooking_methods_changed(sender, instance: Recipe, action: str, **kwargs):
-    _reindex_on_m2m_change(instance, action)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=RecipeCategory)
+@receiver(post_save, sender=Cuisine)
+@receiver(post_save, sender=MealType)
+def _taxonomy_saved(sender, instance, created: bool, raw: bool, **kwargs):
+    if raw:
+        return
+    if not created:
+        # Pakeistas slug / pavadinimas – susiję receptų dokumentai (facet'ai) perindeksuojami.
+        change_tracker.mark_many(
+            instance.recipes.values_list("id", flat=True), change_tracker.TAXONOMY
+        )
+    kind = _taxonomy_kind(sender)
+    transaction.on_commit(
+        lambda: suggest_index.update_taxonomy(kind, instance.id, instance.name, instance.slug)
+    )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=RecipeCategory)
+@receiver(pre_delete, sender=Cuisine)
+@receiver(pre_delete, sender=MealType)
+def _taxonomy_deleting(sender, instance, **kwargs):
+    # Kaskadinis ryšių trynimas m2m_changed nesiunčia – receptai pažymimi prieš jį.
+    change_tracker.mark_many(instance.recipes.values_list("id", flat=True), change_tracker.TAXONOMY)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=RecipeCategory)
+@receiver(post_delete, sender=Cuisine)
+@receiver(post_delete, sender=MealType)
+def _taxonomy_deleted(sender, instance, **kwargs):
+    kind = _taxonomy_kind(sender)
+    object_id = instance.id
+    transaction.on_commit(lambda: suggest_index.update_taxonomy(kind, object_id, None, None))
@@ -0,0 +1,225 @@
+"""Atmintyje laikomas trigramų indeksas paieškos pasiūlymams (search-as-you-type).
+
+Indeksuojami publikuotų receptų pavadinimai ir taksonomijų (tag'ų, kategorijų, virtuvių,
+patiekalų tipų) pavadinimai. Tekstas „sulankstomas“ (casefold + be diakritikų), todėl
+`cepelinai` randa `Cepelinai`, o `sakotis` – `Šakotis`; rašybos klaidas toleruoja
+trigramų panašumas ir Levenshtein atstumas iki žodžių pradžių.
+
+Indeksas yra kiekviename procese atskiras: signalai jį atnaujina inkrementiškai, o kas
+`SUGGEST_INDEX_TTL_SECONDS` jis perstatomas iš DB (kad pasivytų kitų procesų pakeitimus).
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+
+from .models import Cuisine, MealType, Recipe, RecipeCategory, Tag
+
+RECIPE = "recipe"
+# Taksonomijų tipai pasiūlymuose -> modelis.
+TAXONOMY_MODELS = {
+    "tag": Tag,
+    "category": RecipeCategory,
+    "cuisine": Cuisine,
+    "meal_type": MealType,
+}
+
+_NON_WORD_RE = re.compile(r"[^\w]+", re.UNICODE)
+
+# Kiek kandidatų pagal trigramas perskaičiuoti su edit distance.
+_RERANK_CANDIDATES = 50
+
+
+def fold(text: str) -> str:
+    """Casefold + diakritikų pašalinimas (ą->a, č->c, ė->e, š->s, ž->z ...)."""
+
+    decomposed = unicodedata.normalize("NFKD", (text or "").casefold())
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(_NON_WORD_RE.sub(" ", stripped).split())
+
+
+def _trigrams(folded: str) -> set[str]:
+    grams: set[str] = set()
+    for word in folded.split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _prefix_distance(query: str, folded: str) -> int:
+    """Mažiausias atstumas tarp užklausos žodžių ir atitinkamo ilgio žodžių pradžių."""
+
+    words = folded.split()
+    if not words:
+        return len(query)
+    return sum(
+        min(_levenshtein(term, word[: len(term)]) for word in words) for term in query.split()
+    )
+
+
+@dataclass(frozen=True)
+class Entry:
+    kind: str
+    object_id: int
+    title: str
+    slug: str
+    folded: str
+
+
+@dataclass(frozen=True)
+class Suggestion:
+    kind: str
+    object_id: int
+    title: str
+    slug: str
+    score: float
+
+
+class SuggestIndex:
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._entries: dict[tuple[str, int], Entry] = {}
+        self._postings: dict[str, set[tuple[str, int]]] = defaultdict(set)
+        self.built_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, kind: str, object_id: int, title: str, slug: str) -> None:
+        key = (kind, object_id)
+        entry = Entry(kind, object_id, title, slug, fold(title))
+        with self._lock:
+            self._remove_postings(key)
+            self._entries[key] = entry
+            for gram in _trigrams(entry.folded):
+                self._postings[gram].add(key)
+
+    def remove(self, kind: str, object_id: int) -> None:
+        with self._lock:
+            self._remove_postings((kind, object_id))
+            self._entries.pop((kind, object_id), None)
+
+    def _remove_postings(self, key: tuple[str, int]) -> None:
+        previous = self._entries.get(key)
+        if previous is None:
+            return
+        for gram in _trigrams(previous.folded):
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def search(self, query: str, *, limit: int = 8) -> list[Suggestion]:
+        folded_query = fold(query)
+        if not folded_query:
+            return []
+        query_grams = _trigrams(folded_query)
+        # Trumpoms užklausoms leidžiam 1 klaidą, ilgesnėms – ~1 klaidą 4 simboliams.
+        max_distance = max(1, len(folded_query) // 4) if len(folded_query) >= 3 else 0
+
+        with self._lock:
+            overlap: dict[tuple[str, int], int] = defaultdict(int)
+            for gram in query_grams:
+                for key in self._postings.get(gram, ()):
+                    overlap[key] += 1
+            candidates = sorted(overlap.items(), key=lambda item: -item[1])[:_RERANK_CANDIDATES]
+            entries = [(self._entries[key], shared) for key, shared in candidates]
+
+        results: list[Suggestion] = []
+        for entry, shared in entries:
+            similarity = shared / len(query_grams | _trigrams(entry.folded))
+            distance = _prefix_distance(folded_query, entry.folded)
+            if distance > max_distance and similarity < 0.3:
+                continue
+            score = similarity + (1.0 if distance == 0 else 0.5 / (1 + distance))
+            if entry.kind == RECIPE:
+                score += 0.05  # tarp lygių – receptai prieš taksonomijas
+            results.append(Suggestion(entry.kind, entry.object_id, entry.title, entry.slug, score))
+
+        results.sort(key=lambda s: (-s.score, len(s.title), s.title))
+        return results[:limit]
+
+
+_index: SuggestIndex | None = None
+_build_lock = threading.Lock()
+
+
+def _ttl_seconds() -> int:
+    try:
+        return int(os.getenv("SUGGEST_INDEX_TTL_SECONDS", "600"))
+    except ValueError:
+        return 600
+
+
+def build_index() -> SuggestIndex:
+    index = SuggestIndex()
+    published = Recipe.objects.filter(published_at__isnull=False).values_list("id", "title", "slug")
+    for recipe_id, title, slug in published.iterator(chunk_size=2000):
+        index.add(RECIPE, recipe_id, title, slug)
+    for kind, model in TAXONOMY_MODELS.items():
+        for object_id, name, slug in model.objects.values_list("id", "name", "slug"):
+            index.add(kind, object_id, name, slug)
+    index.built_at = time.monotonic()
+    return index
+
+
+def get_index() -> SuggestIndex:
+    global _index
+    index = _index
+    if index is not None and time.monotonic() - index.built_at < _ttl_seconds():
+        return index
+    with _build_lock:
+        if _index is None or time.monotonic() - _index.built_at >= _ttl_seconds():
+            _index = build_index()
+        return _index
+
+
+def reset_index() -> None:
+    global _index
+    _index = None
+
+
+def update_recipes(recipe_ids) -> None:
+    """Inkrementinis atnaujinimas (iš signalų); jei indeksas dar nesukurtas – nieko."""
+
+    if _index is None or not recipe_ids:
+        return
+    rows = {
+        recipe_id: (title, slug)
+        for recipe_id, title, slug in Recipe.objects.filter(
+            pk__in=recipe_ids, published_at__isnull=False
+        ).values_list("id", "title", "slug")
+    }
+    for recipe_id in recipe_ids:
+        if recipe_id in rows:
+            _index.add(RECIPE, recipe_id, *rows[recipe_id])
+        else:
+            _index.remove(RECIPE, recipe_id)
+
+
+def update_taxonomy(kind: str, object_id: int, name: str | None, slug: str | None) -> None:
+    if _index is None:
+        return
+    if name is None:
+        _index.remove(kind, object_id)
+    else:
+        _index.add(kind, object_id, name, slug or "")
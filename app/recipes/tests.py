@@ -1,3 +1,884 @@
-from django.test import TestCase
+import json
+from io import StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from recipes import upstash_search
+from recipes.models import (
+    Difficulty,
+    Recipe,
+    SearchIndexOperation,
+    SearchIndexOutbox,
+    SearchIndexState,
+)
+
+
+class FakeIndex:
+    def __init__(self):
+        self.upserted: list[dict] = []
+        self.deleted: list[str] = []
+
+    def upsert(self, documents):
+        self.upserted.extend(documents)
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+
+
+def _create_recipe(**kwargs) -> Recipe:
+    defaults = {
+        "title": "Cepelinai",
+        "preparation_time": 30,
+        "cooking_time": 40,
+        "difficulty": Difficulty.MEDIUM,
+    }
+    defaults.update(kwargs)
+    return Recipe.objects.create(**defaults)
+
+
+@pytest.fixture
+def search_enabled(monkeypatch):
+    monkeypatch.setenv("UPSTASH_SEARCH_ENABLED", "True")
+    index = FakeIndex()
+    monkeypatch.setattr(upstash_search, "_get_index", lambda: index)
+    monkeypatch.setattr(
+        "recipes.management.commands.process_search_index_outbox._get_index", lambda: index
+    )
+    return index
+
+
+@pytest.mark.django_db
+def test_recipe_save_writes_outbox_only_when_enabled(monkeypatch):
+    monkeypatch.setenv("UPSTASH_SEARCH_ENABLED", "False")
+    _create_recipe(title="Blynai")
+    assert SearchIndexOutbox.objects.count() == 0
+
+    monkeypatch.setenv("UPSTASH_SEARCH_ENABLED", "True")
+    recipe = _create_recipe()
+    assert list(SearchIndexOutbox.objects.values_list("recipe_id", flat=True)) == [recipe.id]
+
+
+@pytest.mark.django_db
+def test_outbox_worker_syncs_current_state_and_drains_queue(search_enabled):
+    published = _create_recipe(published_at=timezone.now())
+    draft = _create_recipe(title="Juodraštis")
+    published.save()
+
+    call_command("process_search_index_outbox", stdout=StringIO())
+
+    assert [doc["id"] for doc in search_enabled.upserted] == [f"recipe:{published.id}"]
+    assert search_enabled.deleted == [f"recipe:{draft.id}"]
+    assert SearchIndexOutbox.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_outbox_worker_leases_batch_and_keeps_changes_made_during_sync(search_enabled, monkeypatch):
+    from recipes.management.commands import process_search_index_outbox
+
+    recipe = _create_recipe(published_at=timezone.now())
+    leased = []
+
+    def _slow_sync(recipe_ids):
+        # Upstash kvietimo metu batch'as paimtas (lease), o kita transakcija receptą pakeičia.
+        leased.extend(SearchIndexOutbox.objects.filter(available_at__gt=timezone.now()))
+        upstash_search.enqueue_recipe_syncs([recipe.id], SearchIndexOperation.UPSERT)
+        return upstash_search.sync_recipes(recipe_ids)
+
+    monkeypatch.setattr(process_search_index_outbox, "sync_recipes", _slow_sync)
+    call_command("process_search_index_outbox", "--max-batches=1", stdout=StringIO())
+
+    assert [row.recipe_id for row in leased] == [recipe.id]
+    assert list(SearchIndexOutbox.objects.values_list("recipe_id", flat=True)) == [recipe.id]
+
+
+@pytest.mark.django_db
+def test_backfill_resumes_from_checkpoint(search_enabled, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        "recipes.management.commands.upstash_backfill_recipes._get_index", lambda: search_enabled
+    )
+    recipes = [_create_recipe(title=f"Sriuba {i}", published_at=timezone.now()) for i in range(3)]
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(f'{{"last_id": {recipes[0].id}}}', encoding="utf-8")
+
+    call_command(
+        "upstash_backfill_recipes",
+        resume=True,
+        chunk_size=1,
+        checkpoint_file=str(checkpoint),
+        stdout=StringIO(),
+    )
+
+    assert {doc["id"] for doc in search_enabled.upserted} == {
+        f"recipe:{recipe.id}" for recipe in recipes[1:]
+    }
+    assert not checkpoint.exists()
+
+
+@pytest.mark.django_db
+def test_sync_skips_unchanged_documents_and_repeated_deletes(search_enabled):
+    published = _create_recipe(published_at=timezone.now())
+    draft = _create_recipe(title="Juodraštis")
+
+    first = upstash_search.sync_recipes([published.id, draft.id])
+    assert (first.upserted, first.deleted, first.skipped) == (1, 1, 0)
+
+    Recipe.objects.filter(pk=published.pk).update(nutrition={"per_serving": {}})
+    second = upstash_search.sync_recipes([published.id, draft.id])
+    assert (second.upserted, second.deleted, second.skipped) == (0, 0, 2)
+    assert SearchIndexState.objects.get(recipe_id=published.id).is_indexed
+
+
+@pytest.mark.django_db
+def test_search_cache_serves_repeated_queries_until_index_changes(search_enabled, monkeypatch):
+    from django.core.cache import cache
+
+    cache.clear()
+    calls: list[str] = []
+
+    def fake_search(query, limit):
+        calls.append(query)
+        return [SimpleNamespace(id="recipe:1"), SimpleNamespace(id="recipe:2")]
+
+    search_enabled.search = fake_search
+    published = _create_recipe(published_at=timezone.now())
+
+    assert upstash_search.search_recipe_ids("Cepelinai ", limit=1) == [1]
+    assert upstash_search.search_recipe_ids("  cepelinai", limit=20) == [1, 2]
+    assert len(calls) == 1
+
+    upstash_search.sync_recipes([published.id])
+    upstash_search.search_recipe_ids("cepelinai")
+    assert len(calls) == 2
+
+
+def test_search_breaker_opens_after_consecutive_failures(monkeypatch):
+    from django.core.cache import cache
+
+    from recipes import search_breaker
+
+    cache.clear()
+    monkeypatch.setenv("UPSTASH_SEARCH_BREAKER_FAILURES", "2")
+    calls: list[int] = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError("upstash down")
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            search_breaker.call(failing)
+
+    assert search_breaker.state() == "open"
+    with pytest.raises(search_breaker.SearchUnavailableError):
+        search_breaker.call(failing)
+    assert len(calls) == 2
+
+    cache.set(search_breaker.OPEN_UNTIL_KEY, 0, timeout=None)
+    assert search_breaker.call(lambda: "ok") == "ok"
+    assert search_breaker.state() == "closed"
+
+
+@pytest.mark.django_db
+def test_list_recipes_pushes_facets_into_search_and_hydrates_page(search_enabled, client):
+    from django.core.cache import cache
+
+    cache.clear()
+    from recipes.models import Tag
+
+    recipes = [_create_recipe(title=f"Sriuba {i}", published_at=timezone.now()) for i in range(3)]
+    tag = Tag.objects.create(name="It's", slug="it's")
+    # recipes[1] indekse dar su tag'u, bet DB jau be jo – puslapyje jo neturi būti.
+    tag.recipes.add(recipes[0], recipes[2])
+    seen: list[dict] = []
+
+    def fake_search(**kwargs):
+        seen.append(kwargs)
+        return [SimpleNamespace(id=f"recipe:{recipe.id}") for recipe in reversed(recipes)]
+
+    search_enabled.search = fake_search
+    response = client.get(
+        "/api/recipes/", {"search": "sriuba", "tag": "it's", "max_total_time": 90, "limit": 2}
+    )
+
+    assert response.status_code == 200
+    assert seen[0]["filter"] == "total_time <= 90 AND tag_slugs CONTAINS 'it\\'s'"
+    data = response.json()
+    assert data["total"] == 3
+    assert [item["id"] for item in data["items"]] == [recipes[2].id]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_taxonomy_slug_change_reenqueues_tagged_recipes(search_enabled):
+    from recipes.models import Tag
+
+    tagged = _create_recipe(title="Šaltibarščiai")
+    _create_recipe(title="Kugelis")
+    tag = Tag.objects.create(name="Vasara", slug="vasara")
+    tag.recipes.add(tagged)
+    SearchIndexOutbox.objects.all().delete()
+
+    tag.slug = "vasaros-patiekalai"
+    tag.save()
+    assert list(SearchIndexOutbox.objects.values_list("recipe_id", flat=True)) == [tagged.id]
+
+    SearchIndexOutbox.objects.all().delete()
+    tag.delete()
+    assert list(SearchIndexOutbox.objects.values_list("recipe_id", flat=True)) == [tagged.id]
+
+
+@pytest.mark.django_db
+def test_search_session_pages_ranked_ids_then_db_tail(search_enabled, client, monkeypatch):
+    from django.core.cache import cache
+
+    from recipes import search_cache
+
+    cache.clear()
+    monkeypatch.setattr(search_cache, "MAX_FETCH_LIMIT", 2)
+    recipes = [_create_recipe(title=f"Sriuba {i}", published_at=timezone.now()) for i in range(3)]
+    calls: list[dict] = []
+
+    def fake_search(**kwargs):
+        calls.append(kwargs)
+        return [SimpleNamespace(id=f"recipe:{recipes[i].id}") for i in (0, 2)]
+
+    search_enabled.search = fake_search
+    first = client.get("/api/recipes/", {"search": "sriuba", "limit": 2}).json()
+    assert [item["id"] for item in first["items"]] == [recipes[0].id, recipes[2].id]
+    assert first["total"] == 3
+
+    second = client.get(
+        "/api/recipes/", {"search": "sriuba", "limit": 2, "offset": 2, "cursor": first["cursor"]}
+    ).json()
+    assert [item["id"] for item in second["items"]] == [recipes[1].id]
+    assert second["cursor"] == first["cursor"]
+    assert len(calls) == 1
+
+
+def _suggest_titles(client, query: str) -> list[str]:
+    return [item["title"] for item in client.get("/api/recipes/suggest", {"q": query}).json()]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_suggest_tolerates_typos_and_diacritics_and_updates_incrementally(client):
+    from recipes import suggest_index
+
+    suggest_index.reset_index()
+    _create_recipe(title="Šakotis", published_at=timezone.now())
+    _create_recipe(title="Cepelinai su mėsa", published_at=timezone.now())
+    _create_recipe(title="Juodraštis")
+
+    assert _suggest_titles(client, "sakotis") == ["Šakotis"]
+    assert _suggest_titles(client, "cepalinai") == ["Cepelinai su mėsa"]
+    assert _suggest_titles(client, "juodrastis") == []
+
+    late = _create_recipe(title="Kibinai", published_at=timezone.now())
+    assert _suggest_titles(client, "kibin") == ["Kibinai"]
+    late.delete()
+    assert _suggest_titles(client, "kibin") == []
+    suggest_index.reset_index()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_change_tracker_dispatches_one_event_per_recipe_after_commit(monkeypatch):
+    from django.db import transaction
+
+    from recipes import change_tracker
+    from recipes.models import Ingredient, IngredientCategory, MeasurementUnit, RecipeIngredient
+
+    monkeypatch.setenv("UPSTASH_SEARCH_ENABLED", "True")
+    events: list[dict] = []
+    monkeypatch.setattr(change_tracker, "CONSUMERS", [*change_tracker.CONSUMERS, events.append])
+
+    category = IngredientCategory.objects.create(name="Daržovės")
+    unit = MeasurementUnit.objects.create(name="gramas", short_name="g", unit_type="weight")
+    ingredients = [
+        Ingredient.objects.create(name=name, category=category) for name in ("Bulvės", "Svogūnai")
+    ]
+    recipe = _create_recipe()
+    Recipe.objects.filter(pk=recipe.pk).update(nutrition_dirty=False)
+    SearchIndexOutbox.objects.all().delete()
+    events.clear()
+
+    with transaction.atomic():
+        for ingredient in ingredients:
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=100, unit=unit
+            )
+        recipe.servings = 4
+        recipe.save()
+        assert events == []
+
+    assert events == [{recipe.id: frozenset({"content", "ingredients", "servings"})}]
+    assert SearchIndexOutbox.objects.filter(recipe_id=recipe.id).count() == 1
+    assert Recipe.objects.get(pk=recipe.pk).nutrition_dirty
+
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            recipe.tags.create(name="Vakarienė")
+            raise RuntimeError
+    assert len(events) == 1
+
+    # Atšauktos transakcijos būsena nepersineša į kitą transakciją.
+    SearchIndexOutbox.objects.all().delete()
+    with transaction.atomic():
+        recipe.tags.create(name="Pietūs")
+    assert events[1] == {recipe.id: frozenset({"taxonomy"})}
+    assert SearchIndexOutbox.objects.filter(recipe_id=recipe.id).count() == 1
+
+
+@pytest.mark.django_db
+def test_import_recipes_bulk_creates_rows_and_marks_once(monkeypatch, tmp_path):
+    import json
+
+    from recipes.models import RecipeIngredient, RecipeStep, Tag
+
+    monkeypatch.setenv("UPSTASH_SEARCH_ENABLED", "True")
+    _create_recipe(title="Vištienos sriuba")
+    Tag.objects.create(name="Šventiniai", slug="sventiniai")
+    SearchIndexOutbox.objects.all().delete()
+    record = {
+        "title": "Vištienos sriuba",
+        "preparation_time": 10,
+        "cooking_time": 40,
+        "difficulty": "easy",
+        "tags": ["Sriubos", "sriubos", "ŠVENTINIAI"],
+        "ingredients": [
+            {"name": "Vištiena", "amount": 300, "unit": "g"},
+            {"name": "vištiena", "amount": 200, "unit": "G"},
+            {"name": "Morkos", "amount": 2, "unit": "vnt"},
+        ],
+        "steps": [{"description": "Išvirti."}, {"description": "Patiekti."}],
+    }
+    source = tmp_path / "recipes.jsonl"
+    lines = [
+        json.dumps(record),
+        "{broken",
+        json.dumps({**record, "title": "Blynai", "servings": "keturi"}),
+        json.dumps(
+            {**record, "title": "Vėdarai", "steps": [{"description": "x", "duration": "5m"}]}
+        ),
+        json.dumps({**record, "title": "Kibinai"}),
+    ]
+    source.write_text("\n".join(lines), encoding="utf-8")
+
+    stderr = StringIO()
+    call_command("import_recipes", str(source), publish=True, stdout=StringIO(), stderr=stderr)
+
+    imported = Recipe.objects.filter(published_at__isnull=False).order_by("id")
+    assert [r.slug for r in imported] == ["vistienos-sriuba-1", "kibinai"]
+    first = imported[0]
+    assert [float(ri.amount) for ri in RecipeIngredient.objects.filter(recipe=first)] == [500, 2]
+    assert RecipeStep.objects.filter(recipe=first).count() == 2
+    # Case-insensitive ir lietuviškoms raidėms (SQLite LOWER() jų nekeičia).
+    assert sorted(first.tags.values_list("name", flat=True)) == ["Sriubos", "Šventiniai"]
+    assert Tag.objects.count() == 2
+    # Blogi skaičiai praleidžia tik savo eilutę.
+    assert "Eilutė 3 praleista: netinkamas servings: 'keturi'" in stderr.getvalue()
+    assert "Eilutė 4 praleista: netinkamas steps.duration: '5m'" in stderr.getvalue()
+    assert sorted(SearchIndexOutbox.objects.values_list("recipe_id", flat=True)) == [
+        r.id for r in imported
+    ]
+
+
+@pytest.mark.django_db
+def test_slug_allocator_uses_one_query_and_retries_on_conflict(django_assert_num_queries):
+    from recipe_platform import slug_allocator
+
+    for title in ("Vištienos sriuba", "Vištienos sriuba", "Vištienos sriuba su ryžiais"):
+        _create_recipe(title=title)
+
+    with django_assert_num_queries(1):
+        assert slug_allocator.allocate(Recipe, "vistienos-sriuba") == "vistienos-sriuba-2"
+    assert slug_allocator.allocate_many(Recipe, ["vistienos-sriuba", "vistienos-sriuba"]) == [
+        "vistienos-sriuba-2",
+        "vistienos-sriuba-3",
+    ]
+
+    stale = Recipe(title="Vištienos sriuba", preparation_time=1, cooking_time=1, difficulty="easy")
+    stale.slug = "vistienos-sriuba-1"  # tarsi kitas procesas jau spėjo jį užimti
+    slug_allocator.save_with_retry(stale, stale.save, base="vistienos-sriuba")
+    assert stale.slug == "vistienos-sriuba-2"
+
+
+@pytest.mark.django_db
+def test_recipe_save_uses_loaded_snapshot_instead_of_pre_save_select(django_assert_num_queries):
+    recipe = _create_recipe()
+    loaded = Recipe.objects.get(pk=recipe.pk)
+    loaded.title = "Cepelinai su spirgais"
+
+    # Tik UPDATE – be papildomo SELECT'o ankstesnėms reikšmėms.
+    with django_assert_num_queries(1):
+        loaded.save()
+    assert loaded._change_kinds == set()
+
+    loaded.servings = 6
+    loaded.save()
+    assert loaded._change_kinds == {"servings"}
+
+
+@pytest.mark.django_db
+def test_recipe_refresh_from_db_retakes_loaded_snapshot():
+    recipe = _create_recipe()
+    loaded = Recipe.objects.get(pk=recipe.pk)
+    Recipe.objects.filter(pk=recipe.pk).update(servings=8)
+
+    loaded.refresh_from_db(fields=["servings"])
+    loaded.save()
+    assert loaded._change_kinds == set()
+
+    # Pilnas refresh – snapshot'as vėl atitinka DB.
+    Recipe.objects.filter(pk=recipe.pk).update(servings=recipe.servings)
+    loaded.refresh_from_db()
+    loaded.servings = 8
+    loaded.save()
+    assert loaded._change_kinds == {"servings"}
+
+
+def _add_ingredient(recipe: Recipe, name: str, amount=100):
+    from recipes.models import Ingredient, IngredientCategory, MeasurementUnit, RecipeIngredient
+
+    category, _ = IngredientCategory.objects.get_or_create(name="Kita")
+    unit, _ = MeasurementUnit.objects.get_or_create(
+        name="gramas", short_name="g", unit_type="weight"
+    )
+    ingredient, _ = Ingredient.objects.get_or_create(name=name, defaults={"category": category})
+    return RecipeIngredient.objects.create(
+        recipe=recipe, ingredient=ingredient, unit=unit, amount=amount
+    )
+
+
+@pytest.mark.django_db
+def test_enqueue_nutrition_jobs_is_set_based_and_skips_unchanged(django_assert_max_num_queries):
+    from recipes.models import RecipeNutritionJob
+
+    recipes = [
+        _create_recipe(title=f"Troškinys {i}", published_at=timezone.now()) for i in range(5)
+    ]
+    for recipe in recipes:
+        _add_ingredient(recipe, "Jautiena")
+        _add_ingredient(recipe, "Morkos", amount=50)
+    unchanged = recipes[0]
+    rows = list(
+        unchanged.recipe_ingredients.values_list(
+            "ingredient_id", "group_id", "unit_id", "amount", "note"
+        ).order_by("ingredient_id", "group_id", "unit_id", "amount", "id")
+    )
+    Recipe.objects.filter(pk=unchanged.pk).update(
+        nutrition={"per_serving": {}},
+        nutrition_input_hash=RecipeNutritionJob.compute_input_hash(ingredient_rows=rows),
+    )
+
+    with django_assert_max_num_queries(9):
+        call_command("enqueue_recipe_nutrition_jobs", stdout=StringIO())
+
+    assert sorted(RecipeNutritionJob.objects.values_list("recipe_id", flat=True)) == [
+        r.id for r in recipes[1:]
+    ]
+    assert not Recipe.objects.get(pk=unchanged.pk).nutrition_dirty
+    assert Recipe.objects.filter(nutrition_last_enqueued_at__isnull=False).count() == 4
+
+
+@pytest.mark.django_db
+def test_nutrition_results_are_reused_by_input_hash(monkeypatch):
+    from recipes.management.commands import process_recipe_nutrition_jobs
+    from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
+    from recipes.nutrition_service import compute_current_input_hash
+
+    def _no_openai(*args, **kwargs):
+        raise AssertionError("OpenAI neturėjo būti kviečiamas")
+
+    monkeypatch.setattr(process_recipe_nutrition_jobs, "request_nutrition", _no_openai)
+
+    source, twin, queued = (
+        _create_recipe(title=title, published_at=timezone.now())
+        for title in ("Blynai", "Blynai II", "Blynai III")
+    )
+    for recipe in (source, twin, queued):
+        _add_ingredient(recipe, "Miltai", amount=200)
+    input_hash = compute_current_input_hash(source)
+    nutrition = {"per_serving": {"energy_kcal": 250}}
+    RecipeNutritionJob.objects.create(
+        recipe=source,
+        status=RecipeNutritionJobStatus.SUCCEEDED,
+        input_hash=input_hash,
+        result=nutrition,
+        finished_at=timezone.now(),
+    )
+    Recipe.objects.filter(pk=source.pk).update(
+        nutrition=nutrition, nutrition_input_hash=input_hash, nutrition_dirty=False
+    )
+    queued_job = RecipeNutritionJob.objects.create(recipe=queued, input_hash=input_hash)
+
+    out = StringIO()
+    call_command("enqueue_recipe_nutrition_jobs", stdout=out)
+    assert "is_cache=1" in out.getvalue()
+    twin.refresh_from_db()
+    assert twin.nutrition == nutrition and not twin.nutrition_dirty
+
+    out = StringIO()
+    call_command("process_recipe_nutrition_jobs", stdout=out)
+    assert "reused=1" in out.getvalue()
+    queued_job.refresh_from_db()
+    assert queued_job.status == RecipeNutritionJobStatus.SUCCEEDED
+    assert Recipe.objects.get(pk=queued.pk).nutrition == nutrition
+
+
+@pytest.mark.django_db
+def test_process_nutrition_jobs_runs_requests_concurrently(monkeypatch, settings):
+    import threading
+
+    from recipes.management.commands import process_recipe_nutrition_jobs
+    from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
+    from recipes.nutrition_service import compute_current_input_hash
+
+    settings.OPENAI_API_KEY = "test"
+    threads = set()
+
+    def _fake_request(req, *, servings, client=None):
+        threads.add(threading.get_ident())
+        if "Ingredientas 3" in json.dumps(req, ensure_ascii=False):
+            raise RuntimeError("rate_limited")
+        return {"per_serving": {"energy_kcal": 100}, "servings": servings}
+
+    monkeypatch.setattr(process_recipe_nutrition_jobs, "request_nutrition", _fake_request)
+
+    jobs = []
+    for i in range(6):
+        recipe = _create_recipe(title=f"Sriuba {i}", published_at=timezone.now())
+        _add_ingredient(recipe, f"Ingredientas {i}")
+        jobs.append(
+            RecipeNutritionJob.objects.create(
+                recipe=recipe, input_hash=compute_current_input_hash(recipe)
+            )
+        )
+    # Receptas pasikeitė po enqueue -> job'as pažymimas stale, OpenAI nekviečiamas.
+    _add_ingredient(jobs[5].recipe, "Druska", amount=5)
+
+    out = StringIO()
+    call_command(
+        "process_recipe_nutrition_jobs",
+        "--limit=10",
+        "--concurrency=3",
+        "--write-batch=2",
+        stdout=out,
+    )
+
+    assert "processed=6 succeeded=4 retried=1 failed=1 stale=1" in out.getvalue()
+    statuses = dict(RecipeNutritionJob.objects.values_list("id", "status"))
+    assert [statuses[job.id] for job in jobs] == [RecipeNutritionJobStatus.SUCCEEDED] * 3 + [
+        RecipeNutritionJobStatus.QUEUED,
+        RecipeNutritionJobStatus.SUCCEEDED,
+        RecipeNutritionJobStatus.FAILED,
+    ]
+    retried = RecipeNutritionJob.objects.get(pk=jobs[3].pk)
+    assert retried.error == "rate_limited" and retried.available_at > timezone.now()
+    assert Recipe.objects.get(pk=jobs[0].recipe_id).nutrition["per_serving"]["energy_kcal"] == 100
+    assert threading.get_ident() not in threads
+
+
+@pytest.mark.django_db
+def test_local_nutrition_calculator_covers_known_ingredients():
+    from decimal import Decimal
+
+    from recipes import nutrition_calculator
+    from recipes.models import Ingredient, IngredientCategory, MeasurementUnit, RecipeIngredient
+
+    category = IngredientCategory.objects.create(name="Pagrindiniai")
+    flour = Ingredient.objects.create(
+        name="Miltai",
+        category=category,
+        nutrients_per_100g={"energy_kcal": 364, "protein_g": 10, "fat_g": 1, "carbs_g": 76},
+        allergens=["gluten"],
+    )
+    milk = Ingredient.objects.create(
+        name="Pienas",
+        category=category,
+        nutrients_per_100g={"energy_kcal": 50, "protein_g": 3.4, "fat_g": 2.5, "carbs_g": 4.8},
+        allergens=["milk"],
+        density_g_per_ml="1.030",
+    )
+    salt = Ingredient.objects.create(name="Druska", category=category)
+    grams = MeasurementUnit.objects.create(name="gramas", short_name="g", unit_type="weight")
+    liters = MeasurementUnit.objects.create(name="litras", short_name="l", unit_type="volume")
+
+    recipe = _create_recipe(title="Blynai", servings=4)
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=flour, unit=grams, amount=200)
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=milk, unit=liters, amount="0.5")
+
+    result = nutrition_calculator.calculate(recipe)
+    assert result["source"] == "local"
+    # (200 g * 3.64 + 515 g * 0.5) / 4 porcijos
+    assert result["per_serving"]["energy_kcal"] == pytest.approx(246.4, abs=0.1)
+    assert result["per_serving"]["sugars_g"] is None
+    assert result["allergens"] == ["gluten", "milk"]
+
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=salt, unit=grams, amount=5)
+    assert nutrition_calculator.calculate(recipe) is None
+
+    # Standartinis faktorius taikomas tik sutampančio tipo vienetui.
+    spoon = {"short_name": "a.š.", "base_factor": None, "density_g_per_ml": Decimal("1")}
+    count = {"unit_type": "count", "grams_per_piece": Decimal("50")}
+    assert nutrition_calculator.ingredient_grams(
+        Decimal("2"), unit_type="volume", grams_per_piece=None, **spoon
+    ) == pytest.approx(30)
+    assert nutrition_calculator.ingredient_grams(Decimal("2"), **count, **spoon) is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_servings_change_rescales_nutrition_without_recompute(client):
+    from recipes.nutrition_service import with_totals
+
+    recipe = _create_recipe(title="Šaltibarščiai", servings=4, published_at=timezone.now())
+    _add_ingredient(recipe, "Burokėliai", amount=400)
+    nutrition = with_totals({"per_serving": {"energy_kcal": 150.0, "protein_g": 6.0}}, 4)
+    Recipe.objects.filter(pk=recipe.pk).update(nutrition=nutrition, nutrition_dirty=False)
+
+    recipe = Recipe.objects.get(pk=recipe.pk)
+    recipe.servings = 6
+    recipe.save()
+    recipe.refresh_from_db()
+    assert not recipe.nutrition_dirty
+    assert recipe.nutrition["per_serving"] == {"energy_kcal": 100.0, "protein_g": 4.0}
+
+    data = client.get(f"/api/recipes/{recipe.slug}?servings=3").json()
+    assert data["servings"] == 3
+    assert data["ingredients"][0]["amount"] == 200.0
+    assert data["nutrition"]["per_serving"]["energy_kcal"] == 200.0
+    assert data["nutrition"]["totals"]["energy_kcal"] == 600.0
+
+
+def _batch_line(job_id: int, servings: int, *, content=None, error=None) -> str:
+    line = {"custom_id": f"nutrition_job:{job_id}:{servings}"}
+    if error:
+        line["error"] = error
+    else:
+        body = {"choices": [{"message": {"content": json.dumps(content)}}]}
+        line["response"] = {"status_code": 200, "body": body}
+    return json.dumps(line)
+
+
+@pytest.mark.django_db
+def test_batch_output_import_is_chunked_and_idempotent(django_assert_max_num_queries):
+    from io import BytesIO
+
+    from recipes import nutrition_jobs
+    from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
+
+    recipes = [_create_recipe(title=f"Kugelis {i}", servings=2) for i in range(3)]
+    jobs = [
+        RecipeNutritionJob.objects.create(
+            recipe=recipe,
+            input_hash=f"hash-{recipe.id}",
+            status=RecipeNutritionJobStatus.SUBMITTED,
+            openai_batch_id="batch_1",
+        )
+        for recipe in recipes
+    ]
+    content = {
+        "per_serving": {"energy_kcal": 300, "protein_g": 8, "fat_g": 12, "carbs_g": 40},
+        "disclaimer": "Apytikslės vertės.",
+    }
+    output = "\n".join(
+        [
+            _batch_line(jobs[0].id, 2, content=content),
+            _batch_line(jobs[1].id, 2, error={"message": "rate_limited"}),
+            _batch_line(jobs[2].id, 2, content=content),
+            "{not json",
+        ]
+    ).encode()
+
+    with django_assert_max_num_queries(14):
+        stats = nutrition_jobs.import_output("batch_1", BytesIO(output), chunk_size=2)
+    assert (stats.succeeded, stats.retried, stats.failed) == (2, 1, 0)
+
+    # Nepavykęs request'as grąžinamas į eilę su atidėjimu.
+    statuses = dict(RecipeNutritionJob.objects.values_list("id", "status"))
+    assert statuses[jobs[1].id] == RecipeNutritionJobStatus.QUEUED
+    recipe = Recipe.objects.get(pk=recipes[0].pk)
+    assert recipe.nutrition["totals"]["energy_kcal"] == 600
+    assert recipe.nutrition_input_hash == f"hash-{recipes[0].id}"
+
+    again = nutrition_jobs.import_output("batch_1", BytesIO(output))
+    assert (again.processed, again.skipped) == (0, 3)
+
+
+@pytest.mark.django_db
+def test_write_results_updates_recipe_only_for_jobs_it_finished():
+    from recipes import nutrition_jobs
+    from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
+
+    recipes = [_create_recipe(title=f"Kibinai {i}", servings=2) for i in range(2)]
+    jobs = [
+        RecipeNutritionJob.objects.create(
+            recipe=recipe, input_hash=f"hash-{recipe.id}", status=RecipeNutritionJobStatus.SUBMITTED
+        )
+        for recipe in recipes
+    ]
+    # Kitas worker'is jau grąžino antrą job'ą į eilę.
+    RecipeNutritionJob.objects.filter(pk=jobs[1].pk).update(status=RecipeNutritionJobStatus.QUEUED)
+    Recipe.objects.filter(pk__in=[r.pk for r in recipes]).update(nutrition=None)
+    result = {"per_serving": {"energy_kcal": 300}, "disclaimer": ""}
+
+    succeeded, _retried, _failed = nutrition_jobs.write_results(
+        RecipeNutritionJob.objects.filter(status=RecipeNutritionJobStatus.SUBMITTED),
+        {job.id: nutrition_jobs.JobInfo(job.recipe_id, job.input_hash, 2) for job in jobs},
+        {job.id: result for job in jobs},
+        {},
+    )
+
+    assert succeeded == 1
+    nutrition = dict(Recipe.objects.values_list("id", "nutrition"))
+    assert nutrition[recipes[0].id] is not None
+    assert nutrition[recipes[1].id] is None
+
+
+@pytest.mark.django_db
+def test_nutrition_batch_submission_claims_and_shards(settings, monkeypatch):
+    from recipes import nutrition_jobs
+    from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
+
+    settings.OPENAI_API_KEY = "test"
+    settings.OPENAI_BATCH_MAX_REQUESTS = 2
+    for i in range(5):
+        recipe = _create_recipe(title=f"Vėdarai {i}")
+        _add_ingredient(recipe, "Bulvės")
+        RecipeNutritionJob.objects.create(recipe=recipe, input_hash=f"h{i}")
+
+    token, claimed = nutrition_jobs.claim_queued(3)
+    _other, rest = nutrition_jobs.claim_queued(10)
+    assert len(claimed) == 3 and len(rest) == 2
+    assert not {job.id for job in claimed} & {job.id for job in rest}
+    nutrition_jobs.release_claim(_other)
+
+    uploads = []
+
+    class FakeClient:
+        files = SimpleNamespace(
+            create=lambda file, purpose: uploads.append(file[1].read())
+            or SimpleNamespace(id=f"file_{len(uploads)}")
+        )
+        batches = SimpleNamespace(
+            create=lambda input_file_id, **kw: SimpleNamespace(id=f"batch_{input_file_id}")
+        )
+
+    monkeypatch.setattr(
+        "recipes.management.commands.submit_recipe_nutrition_batch.OpenAI",
+        lambda api_key: FakeClient(),
+    )
+    nutrition_jobs.release_claim(token)
+    call_command("submit_recipe_nutrition_batch", stdout=StringIO())
+
+    assert [len(body.splitlines()) for body in uploads] == [2, 2, 1]
+    batches = RecipeNutritionJob.objects.values_list("status", "openai_batch_id")
+    assert {status for status, _ in batches} == {RecipeNutritionJobStatus.SUBMITTED}
+    assert {batch_id for _, batch_id in batches} == {"batch_file_1", "batch_file_2", "batch_file_3"}
+
+
+@pytest.mark.django_db
+def test_nutrition_batch_submission_respects_token_quota(settings, monkeypatch):
+    from recipes import token_budget
+    from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
+    from recipes.nutrition_service import build_openai_chat_request
+
+    settings.OPENAI_API_KEY = "test"
+    jobs = []
+    for i in range(4):
+        recipe = _create_recipe(title=f"Skilandis {i}")
+        _add_ingredient(recipe, "Kiauliena")
+        jobs.append(RecipeNutritionJob.objects.create(recipe=recipe, input_hash=f"h{i}"))
+    per_job = token_budget.estimate_request_tokens(build_openai_chat_request(recipe=recipe))
+    in_flight = RecipeNutritionJob.objects.create(
+        recipe=recipe,
+        input_hash="old",
+        status=RecipeNutritionJobStatus.SUBMITTED,
+        openai_batch_id="batch_old",
+        estimated_tokens=per_job,
+    )
+    # Kvota: jau pateiktas job'as + dar 2 nauji (su atsarga mažiau nei 3).
+    settings.OPENAI_BATCH_TOKEN_QUOTA = per_job * 3 + per_job // 2
+
+    client = SimpleNamespace(
+        files=SimpleNamespace(create=lambda file, purpose: SimpleNamespace(id="file_1")),
+        batches=SimpleNamespace(create=lambda **kw: SimpleNamespace(id="batch_new")),
+    )
+    monkeypatch.setattr(
+        "recipes.management.commands.submit_recipe_nutrition_batch.OpenAI", lambda api_key: client
+    )
+    call_command("submit_recipe_nutrition_batch", fill_quota=True, stdout=StringIO())
+
+    submitted = RecipeNutritionJob.objects.filter(openai_batch_id="batch_new")
+    assert submitted.count() == 2
+    assert set(submitted.values_list("estimated_tokens", flat=True)) == {per_job}
+    assert RecipeNutritionJob.objects.filter(status=RecipeNutritionJobStatus.QUEUED).count() == 2
+    assert token_budget.available_batch_tokens() == per_job // 2
+    in_flight.refresh_from_db()
+    assert in_flight.status == RecipeNutritionJobStatus.SUBMITTED
+
+
+@pytest.mark.django_db
+def test_job_queue_leases_retries_and_dead_letter(settings):
+    from datetime import timedelta
+
+    from recipe_platform import jobqueue
+    from recipes.models import RecipeImageJob, RecipeImageJobStatus
+
+    settings.JOB_QUEUES = {"image": {"concurrency": 2, "max_attempts": 2}}
+    queue = jobqueue.get_queue("image")
+    jobs = [
+        RecipeImageJob.objects.create(recipe=_create_recipe(title=f"Cepelinai {i}"))
+        for i in range(3)
+    ]
+
+    # Concurrency: daugiau nei 2 job'ų vienu metu neišduodama.
+    token, claimed = jobqueue.claim(queue, 10)
+    assert [job.id for job in claimed] == [jobs[0].id, jobs[1].id]
+    assert jobqueue.claim(queue, 10)[1] == []
+
+    assert jobqueue.complete(queue, token, jobs[0].id)
+    retried, terminal = jobqueue.fail(queue, jobqueue.leased(queue, token), {jobs[1].id: "timeout"})
+    assert (retried, terminal) == ([jobs[1].id], [])
+    jobs[1].refresh_from_db()
+    assert jobs[1].status == RecipeImageJobStatus.QUEUED
+    assert jobs[1].available_at >= timezone.now() + timedelta(seconds=25)
+
+    # Worker'is nukrito: pasibaigęs lease grąžina job'ą į eilę, antras kartas -> dead.
+    _token, claimed = jobqueue.claim(queue, 10)
+    assert [job.id for job in claimed] == [jobs[2].id]
+    RecipeImageJob.objects.filter(pk=jobs[2].pk).update(
+        lease_expires_at=timezone.now() - timedelta(seconds=1)
+    )
+    assert jobqueue.reap_expired(queue) == (1, 0)
+    _token, claimed = jobqueue.claim(queue, 10)
+    RecipeImageJob.objects.filter(pk=jobs[2].pk).update(
+        lease_expires_at=timezone.now() - timedelta(seconds=1)
+    )
+    assert jobqueue.reap_expired(queue) == (0, 1)
+    statuses = dict(RecipeImageJob.objects.values_list("id", "status"))
+    assert statuses == {
+        jobs[0].id: RecipeImageJobStatus.SUCCEEDED,
+        jobs[1].id: RecipeImageJobStatus.QUEUED,
+        jobs[2].id: RecipeImageJobStatus.DEAD,
+    }
+
+
+@pytest.mark.django_db
+def test_outbox_write_is_redone_after_rolled_back_savepoint(search_enabled):
+    from django.db import transaction
+
+    from recipes import change_tracker
+
+    with transaction.atomic():
+        change_tracker.mark(1001, change_tracker.CONTENT)
+        try:
+            with transaction.atomic():
+                change_tracker.mark(1002, change_tracker.CONTENT)
+                raise RuntimeError("savepoint rollback")
+        except RuntimeError:
+            pass
+        change_tracker.mark(1002, change_tracker.TAXONOMY)
+        change_tracker.mark(1002, change_tracker.CONTENT)
+
+    assert sorted(SearchIndexOutbox.objects.values_list("recipe_id", flat=True)) == [1001, 1002]
@@ -0,0 +1,90 @@
+"""LLM užklausų token'ų įvertinimas, kvotos planavimas ir request'ų dažnio ribojimas.
+
+Token'ai vertinami pagal simbolių skaičių (be tokenizer'io priklausomybės); lietuviškas
+tekstas tokenizuojasi tankiau nei angliškas, todėl imamas atsargus santykis.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from typing import Any
+
+from django.conf import settings
+from django.db.models import Sum
+
+CHARS_PER_TOKEN = 3.0
+# Papildomi token'ai kiekvienai žinutei (role, skirtukai) ir atsakymo pradžiai.
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+
+def estimate_request_tokens(body: dict[str, Any]) -> int:
+    """Įvertina Chat Completions request'o prompt token'us."""
+
+    tokens = REPLY_PRIMING_TOKENS
+    for message in body.get("messages", []):
+        content = message.get("content") or ""
+        tokens += MESSAGE_OVERHEAD_TOKENS + math.ceil(len(content) / CHARS_PER_TOKEN)
+    return tokens
+
+
+def enqueued_batch_tokens() -> int:
+    """Pateiktų, bet dar neapdorotų nutrition batch'ų token'ai."""
+
+    from recipes.models import RecipeNutritionJob, RecipeNutritionJobStatus
+
+    total = RecipeNutritionJob.objects.filter(
+        status__in=[RecipeNutritionJobStatus.SUBMITTING, RecipeNutritionJobStatus.SUBMITTED]
+    ).aggregate(total=Sum("estimated_tokens"))["total"]
+    return total or 0
+
+
+def available_batch_tokens() -> int | None:
+    """Kiek token'ų dar galima pateikti į Batch (None – kvota neribota)."""
+
+    quota = getattr(settings, "OPENAI_BATCH_TOKEN_QUOTA", 0)
+    if not quota:
+        return None
+    return max(0, quota - enqueued_batch_tokens())
+
+
+class TokenBudget:
+    """Paprastas biudžetas: `try_spend` grąžina False, kai token'ų nebeužtenka."""
+
+    def __init__(self, limit: int | None) -> None:
+        self.limit = limit
+        self.spent = 0
+
+    @property
+    def remaining(self) -> int | None:
+        return None if self.limit is None else self.limit - self.spent
+
+    def try_spend(self, tokens: int) -> bool:
+        if self.limit is not None and self.spent + tokens > self.limit:
+            return False
+        self.spent += tokens
+        return True
+
+
+class RateLimiter:
+    """Thread-safe request'ų per minutę ribotuvas (tolygiai paskirsto request'us laike).
+
+    `rpm=0` – neribota. `acquire()` blokuoja, kol ateina kito request'o eilė.
+    """
+
+    def __init__(self, rpm: int) -> None:
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at)
+            self._next_at = start + self.interval
+        if start > now:
+            time.sleep(start - now)
@@ -5,17 +5,32 @@ Spec:
 - Dokumentas mažas: neindeksuojam steps.
 - Best-effort: klaidos tik log'inamos.
 - Stabilus dokumento ID: recipe:<id>.
+- Pakeitimai keliauja per `SearchIndexOutbox` (rašoma toje pačioje transakcijoje),
+  o sinchronizuoja `process_search_index_outbox` worker'is.
+- `SearchIndexState` saugo paskutinio nusiųsto dokumento hash'ą – nepasikeitę
+  dokumentai neupsert'inami, o jau ištrinti – netrinami pakartotinai.
 """
 
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import os
+from dataclasses import dataclass
 from typing import Any
 
-from django.db.models import Prefetch
+from django.db.models import Min, Prefetch
+from django.utils import timezone
 
-from .models import Recipe, RecipeIngredient
+from . import search_breaker, search_cache
+from .models import (
+    Recipe,
+    RecipeIngredient,
+    SearchIndexOperation,
+    SearchIndexOutbox,
+    SearchIndexState,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +50,39 @@ def _doc_id(recipe_id: int) -> str:
     return f"recipe:{recipe_id}"
 
 
+def _parse_doc_id(raw_id: str) -> int | None:
+    if raw_id.startswith("recipe:"):
+        raw_id = raw_id.split(":", 1)[1]
+    try:
+        return int(raw_id)
+    except ValueError:
+        return None
+
+
+def _document_hash(document: dict[str, Any]) -> str:
+    raw = json.dumps(document, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _recipe_queryset():
+    return Recipe.objects.prefetch_related(
+        "tags",
+        "categories",
+        "cuisines",
+        "meal_types",
+        "cooking_methods",
+        Prefetch(
+            "recipe_ingredients",
+            queryset=RecipeIngredient.objects.select_related(
+                "ingredient", "unit", "group"
+            ).order_by("id"),
+        ),
+    )
+
+
+_index_cache: dict[tuple[str, str, str], Any] = {}
+
+
 def _get_index():
     if not _enabled():
         return None
@@ -52,12 +100,19 @@ def _get_index():
         logger.exception("Upstash Search SDK nerastas (pip install upstash-search)")
         return None
 
+    key = (url, token, index_name)
+    if key in _index_cache:
+        return _index_cache[key]
+
     try:
         client = Search(url=url, token=token, allow_telemetry=False)
-        return client.index(index_name)
+        index = client.index(index_name)
     except Exception:
         logger.exception("Nepavyko inicializuoti Upstash Search kliento")
         return None
+    # Klientas (HTTP sesija) pernaudojamas tarp užklausų.
+    _index_cache[key] = index
+    return index
 
 
 def _build_recipe_document(recipe: Recipe) -> dict[str, Any]:
@@ -82,6 +137,14 @@ def _build_recipe_document(recipe: Recipe) -> dict[str, Any]:
         "meal_types": [m.name for m in recipe.meal_types.all()],
         "cooking_methods": [m.name for m in recipe.cooking_methods.all()],
         "ingredients": ingredients,
+        # Filtruojami laukai (Upstash filter), kad facet'ai būtų taikomi indekse, o ne SQL.
+        "tag_slugs": [tag.slug for tag in recipe.tags.all()],
+        "category_slugs": [cat.slug for cat in recipe.categories.all()],
+        "cuisine_slugs": [c.slug for c in recipe.cuisines.all()],
+        "meal_type_slugs": [m.slug for m in recipe.meal_types.all()],
+        "preparation_time": recipe.preparation_time,
+        "cooking_time": recipe.cooking_time,
+        "total_time": recipe.preparation_time + recipe.cooking_time,
     }
 
     metadata: dict[str, Any] = {
@@ -90,48 +153,114 @@ def _build_recipe_document(recipe: Recipe) -> dict[str, Any]:
         "published_at": recipe.published_at.isoformat() if recipe.published_at else None,
     }
 
-    return {
+    document = {
         "id": _doc_id(recipe.id),
         "content": content,
         "metadata": metadata,
     }
+    # Hash'as skaičiuojamas be savęs paties ir įrašomas į metadata, kad reconcile
+    # galėtų palyginti indekso turinį su DB be pilno dokumento lyginimo.
+    metadata["doc_hash"] = _document_hash(document)
+    return document
+
+
+def record_index_state(*, indexed: dict[int, str] | None = None, removed=()) -> None:
+    """Įrašo, kas šiuo metu yra indekse (`indexed`: recipe_id -> doc_hash)."""
+
+    now = timezone.now()
+    rows = [
+        SearchIndexState(recipe_id=rid, doc_hash=doc_hash, is_indexed=True, synced_at=now)
+        for rid, doc_hash in (indexed or {}).items()
+    ]
+    rows.extend(
+        SearchIndexState(recipe_id=rid, doc_hash="", is_indexed=False, synced_at=now)
+        for rid in removed
+    )
+    if not rows:
+        return
+    SearchIndexState.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["recipe_id"],
+        update_fields=["doc_hash", "is_indexed", "synced_at"],
+    )
 
 
-def upsert_recipe(recipe_id: int) -> None:
-    """Upsert'ina receptą į Upstash.
+@dataclass(frozen=True)
+class SyncResult:
+    upserted: int = 0
+    deleted: int = 0
+    skipped: int = 0
 
-    Jei receptas nepublikuotas arba nerastas – ištrina dokumentą.
+
+def sync_recipes(recipe_ids: list[int], *, force: bool = False) -> SyncResult:
+    """Suvienodina receptų dokumentus su dabartine DB būsena.
+
+    Publikuoti receptai upsert'inami, nepublikuoti/nerasti – ištrinami. Kadangi
+    sprendžiama pagal DB būseną, kartotinis kvietimas yra idempotentiškas.
+    Operacijos, kurios pagal `SearchIndexState` nieko nepakeistų, praleidžiamos
+    (nebent `force=True`). Skirtingai nei `upsert_recipe`, klaidos neslopinamos.
     """
 
     index = _get_index()
     if index is None:
+        raise RuntimeError("Upstash Search išjungtas arba nesukonfigūruotas")
+
+    unique_ids = sorted(set(recipe_ids))
+    if not unique_ids:
+        return SyncResult()
+
+    published = {
+        recipe.id: recipe
+        for recipe in _recipe_queryset().filter(id__in=unique_ids, published_at__isnull=False)
+    }
+    states = {
+        state.recipe_id: state
+        for state in SearchIndexState.objects.filter(recipe_id__in=unique_ids)
+    }
+
+    documents: list[dict[str, Any]] = []
+    indexed: dict[int, str] = {}
+    removed: list[int] = []
+    skipped = 0
+    for rid in unique_ids:
+        state = states.get(rid)
+        if rid in published:
+            document = _build_recipe_document(published[rid])
+            doc_hash = document["metadata"]["doc_hash"]
+            if not force and state and state.is_indexed and state.doc_hash == doc_hash:
+                skipped += 1
+                continue
+            documents.append(document)
+            indexed[rid] = doc_hash
+        else:
+            # Be būsenos įrašo nežinom, ar dokumentas indekse – triname dėl saugumo.
+            if not force and state and not state.is_indexed:
+                skipped += 1
+                continue
+            removed.append(rid)
+
+    if documents:
+        index.upsert(documents=documents)
+    if removed:
+        index.delete(ids=[_doc_id(rid) for rid in removed])
+    record_index_state(indexed=indexed, removed=removed)
+    if documents or removed:
+        search_cache.bump_index_version()
+    return SyncResult(upserted=len(documents), deleted=len(removed), skipped=skipped)
+
+
+def upsert_recipe(recipe_id: int) -> None:
+    """Upsert'ina receptą į Upstash (sinchroniškai, best-effort).
+
+    Jei receptas nepublikuotas arba nerastas – ištrina dokumentą.
+    """
+
+    if _get_index() is None:
         return
 
     try:
-        recipe = (
-            Recipe.objects.filter(id=recipe_id)
-            .prefetch_related(
-                "tags",
-                "categories",
-                "cuisines",
-                "meal_types",
-                "cooking_methods",
-                Prefetch(
-                    "recipe_ingredients",
-                    queryset=RecipeIngredient.objects.select_related(
-                        "ingredient", "unit", "group"
-                    ).order_by("id"),
-                ),
-            )
-            .first()
-        )
-
-        if recipe is None or recipe.published_at is None:
-            delete_recipe(recipe_id)
-            return
-
-        doc = _build_recipe_document(recipe)
-        index.upsert(documents=[doc])
+        sync_recipes([recipe_id])
     except Exception:
         logger.exception("Nepavyko suindeksuoti recepto į Upstash (recipe_id=%s)", recipe_id)
 
@@ -143,36 +272,116 @@ def delete_recipe(recipe_id: int) -> None:
 
     try:
         index.delete(ids=[_doc_id(recipe_id)])
+        record_index_state(removed=[recipe_id])
+        search_cache.bump_index_version()
     except Exception:
         logger.exception("Nepavyko ištrinti recepto iš Upstash (recipe_id=%s)", recipe_id)
 
 
-def search_recipe_ids(query: str, *, limit: int = 50) -> list[int] | None:
+def enqueue_recipe_sync(recipe_id: int, operation: str = SearchIndexOperation.UPSERT) -> None:
+    """Įrašo indekso operaciją į outbox dabartinėje transakcijoje.
+
+    Kai Upstash išjungtas, nieko nerašom (kitaip outbox augtų be worker'io);
+    įjungus paiešką reikia paleisti `upstash_backfill_recipes`.
+    """
+
+    enqueue_recipe_syncs([recipe_id], operation)
+
+
+def enqueue_recipe_syncs(recipe_ids, operation: str = SearchIndexOperation.UPSERT) -> None:
+    """Kaip `enqueue_recipe_sync`, bet daugeliui receptų vienu INSERT'u."""
+
+    if not _enabled() or not recipe_ids:
+        return
+    SearchIndexOutbox.objects.bulk_create(
+        [SearchIndexOutbox(recipe_id=rid, operation=operation) for rid in recipe_ids],
+        batch_size=500,
+    )
+
+
+def outbox_stats() -> dict[str, Any]:
+    """Outbox būsena: laukiančios, nepavykusios (dead) operacijos ir indekso atsilikimas."""
+
+    pending_qs = SearchIndexOutbox.objects.filter(failed_at__isnull=True)
+    oldest = pending_qs.aggregate(oldest=Min("created_at"))["oldest"]
+    lag_seconds = max((timezone.now() - oldest).total_seconds(), 0.0) if oldest else 0.0
+    return {
+        "pending": pending_qs.count(),
+        "dead": SearchIndexOutbox.objects.filter(failed_at__isnull=False).count(),
+        "lag_seconds": lag_seconds,
+    }
+
+
+# API filtras -> (dokumento laukas, operatorius).
+SEARCH_FILTER_FIELDS: dict[str, tuple[str, str]] = {
+    "tag": ("tag_slugs", "CONTAINS"),
+    "category": ("category_slugs", "CONTAINS"),
+    "cuisine": ("cuisine_slugs", "CONTAINS"),
+    "meal_type": ("meal_type_slugs", "CONTAINS"),
+    "difficulty": ("difficulty", "="),
+    "max_total_time": ("total_time", "<="),
+}
+
+
+def _filter_literal(value: Any) -> str:
+    if isinstance(value, int):
+        return str(value)
+    escaped = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def build_search_filter(filters: dict[str, Any] | None) -> str | None:
+    """Suformuoja Upstash filter išraišką iš API filtrų (tuščios reikšmės ignoruojamos)."""
+
+    clauses = []
+    for name, value in sorted((filters or {}).items()):
+        if value is None or value == "":
+            continue
+        field, operator = SEARCH_FILTER_FIELDS[name]
+        clauses.append(f"{field} {operator} {_filter_literal(value)}")
+    return " AND ".join(clauses) or None
+
+
+def search_recipe_ids(
+    query: str, *, limit: int = 50, filters: dict[str, Any] | None = None
+) -> list[int] | None:
     """Grąžina receptų ID sąrašą pagal Upstash paiešką (relevance tvarka).
 
-    Grąžina None, jei Upstash išjungtas arba įvyko klaida.
+    `filters` (žr. `SEARCH_FILTER_FIELDS`) taikomi pačiame indekse, todėl grąžinami
+    tik juos atitinkantys ID. Grąžina None, jei Upstash išjungtas arba įvyko klaida.
     """
 
     query = (query or "").strip()
-    if not query:
+    if not query or not _enabled():
         return None
 
+    search_filter = build_search_filter(filters)
+    cache_params = {"filter": search_filter} if search_filter else None
+    cached = search_cache.get_ids(query, limit=limit, params=cache_params)
+    if cached is not None:
+        return cached
+
     index = _get_index()
     if index is None:
         return None
 
     try:
-        results = index.search(query=query, limit=limit)
+        # Paimam daugiau kandidatų, kad kiti puslapiai būtų aptarnauti iš cache.
+        fetch_limit = search_cache.fetch_limit(limit)
+        search_kwargs: dict[str, Any] = {"query": query, "limit": fetch_limit}
+        if search_filter:
+            search_kwargs["filter"] = search_filter
+        results = search_breaker.call(index.search, **search_kwargs)
         ids: list[int] = []
         for item in results:
-            raw_id = item.id
-            if raw_id.startswith("recipe:"):
-                raw_id = raw_id.split(":", 1)[1]
-            try:
-                ids.append(int(raw_id))
-            except ValueError:
-                continue
-        return ids
+            recipe_id = _parse_doc_id(item.id)
+            if recipe_id is not None:
+                ids.append(recipe_id)
+        search_cache.store_ids(query, ids, fetched=fetch_limit, params=cache_params)
+        return ids[:limit]
+    except search_breaker.SearchUnavailableError as exc:
+        logger.warning("Upstash paieška praleista (%s), naudojamas DB fallback", exc)
+        return None
     except Exception:
         logger.exception("Upstash paieška nepavyko (query=%r)", query)
         return None